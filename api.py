@@ -0,0 +1,334 @@
+"""Versioned JSON API: /api/v1/users, /api/v1/posts, /api/v1/tags."""
+import datetime
+import hashlib
+
+from flask import Blueprint, abort, current_app, jsonify, request, url_for
+from sqlalchemy import exc
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import HTTPException
+
+import bulk_posts
+import idempotency
+from http_cache import table_versions
+from metrics import count_error
+from models import AUTHOR_VISIBLE, Post, PostTag, Tag, User, check_version, db
+from pagination import InvalidCursor, get_page_size, keyset_paginate
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class Resource:
+    """
+    How one model is exposed: readable fields (those in default_fields, all
+    by default, are returned when ?fields= is absent), fields a PATCH may
+    change, sort key, includes, the criterion rows must meet to be visible
+    and the tables behind all of that.
+    """
+
+    def __init__(self, model, fields, order_by, descending=False, includes=(),
+                 visible=None, default_fields=None, writable=(), tables=()):
+        self.model = model
+        # the tables its rows are read from, whose versions validate them
+        self.tables = tables
+        self.fields = fields
+        self.default_fields = default_fields or fields
+        self.writable = writable
+        self.order_by = order_by
+        self.descending = descending
+        self.includes = includes
+        self.visible = visible
+
+    def query(self, fields, includes):
+        query = db.session.query(*self.columns(fields, includes))
+        if self.visible is not None:
+            query = query.filter(self.visible)
+        return query
+
+    def __repr__(self):
+        return f"<Resource: model={self.model.__name__} fields={self.fields}>"
+
+    def columns(self, fields, includes):
+        """Columns to select for the requested fields, sort key and includes."""
+        names = ['id', *fields, *(column.key for column in self.order_by)]
+        if 'user' in includes:
+            names.append('user_id')
+        return [getattr(self.model, name) for name in dict.fromkeys(names)]
+
+
+# users pending deletion (see jobs.py) and their posts are hidden
+RESOURCES = {
+    'users': Resource(
+        User, ('first_name', 'last_name', 'image_url', 'version'), (User.id,),
+        visible=User.deleted_at.is_(None),
+        writable=('first_name', 'last_name', 'image_url'), tables=('users',)
+    ),
+    'posts': Resource(
+        Post, ('title', 'content', 'excerpt', 'created_at', 'user_id', 'version'),
+        (Post.created_at, Post.id), descending=True, includes=('tags', 'user'),
+        visible=AUTHOR_VISIBLE,
+        # ?fields=title,excerpt,... lists posts without their full content
+        default_fields=('title', 'content', 'created_at', 'user_id', 'version'),
+        writable=('title', 'content'), tables=('posts', 'users')
+    ),
+    'tags': Resource(Tag, ('name', 'post_count', 'version'), (Tag.id,), writable=('name',),
+                     tables=('tags',)),
+}
+# the tables each include is read from
+INCLUDE_TABLES = {'user': ('users',), 'tags': ('posts_tags', 'tags')}
+USER_COLUMNS = (User.id, User.first_name, User.last_name, User.image_url)
+USER_COLUMNS_FIELDS = tuple(column.key for column in USER_COLUMNS[1:])
+
+
+def _parse_list(name, allowed):
+    """Parse a comma-separated query argument, rejecting unknown values."""
+    values = [value for value in request.args.get(name, '').split(',') if value]
+    unknown = set(values) - set(allowed)
+    if unknown:
+        abort(400, f"unknown {name}: {', '.join(sorted(unknown))}")
+    return values
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def _serialize(row, fields):
+    return {'id': row.id, **{field: _jsonable(getattr(row, field)) for field in fields}}
+
+
+def _load_includes(rows, includes):
+    """
+    Fetch the related users/tags of a page of post rows with one IN query
+    per relationship; returns {include: {post_id: value}}.
+    """
+    loaded = {}
+    if not rows:
+        return loaded
+    if 'user' in includes:
+        users = db.session.query(*USER_COLUMNS).filter(
+            User.id.in_({row.user_id for row in rows})
+        ).all()
+        by_id = {user.id: user for user in users}
+        loaded['user'] = {row.id: by_id.get(row.user_id) for row in rows}
+    if 'tags' in includes:
+        tags = {row.id: [] for row in rows}
+        for post_id, tag_id, name in db.session.query(
+            PostTag.post_id, Tag.id, Tag.name
+        ).join(Tag).filter(PostTag.post_id.in_(tags)).order_by(Tag.name):
+            tags[post_id].append((tag_id, name))
+        loaded['tags'] = tags
+    return loaded
+
+
+def _etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _versions_etag(resource, includes, *request_parts):
+    """
+    ETag from the versions of the tables a response is read from and the
+    normalized request (request_parts), known before any of it is queried;
+    None when the database does not track changes.
+    """
+    tables = sorted(set(resource.tables).union(*(INCLUDE_TABLES[name] for name in includes)))
+    versions = table_versions(tables)
+    if versions is None:
+        return None
+    return _etag(*request_parts, includes, [versions[table] for table in tables])
+
+
+def _not_modified(etag):
+    """Return a 304 when the client already holds etag, else None."""
+    if etag is None or not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def _respond(etag, build):
+    """
+    Return 304 when the client already holds etag; otherwise call build()
+    to serialize the payload. No serialization happens on a match.
+    """
+    response = _not_modified(etag)
+    if response is None:
+        response = jsonify(build())
+        response.set_etag(etag)
+    return response
+
+
+def _document(rows, fields, includes, loaded):
+    data = []
+    for row in rows:
+        item = _serialize(row, fields)
+        if 'user' in includes:
+            user = loaded['user'][row.id]
+            item['user'] = user and _serialize(user, USER_COLUMNS_FIELDS)
+        if 'tags' in includes:
+            item['tags'] = [
+                {'id': tag_id, 'name': name} for tag_id, name in loaded['tags'][row.id]
+            ]
+        data.append(item)
+    return data
+
+
+def _request_shape(resource):
+    fields = _parse_list('fields', resource.fields) or list(resource.default_fields)
+    includes = _parse_list('include', resource.includes)
+    return fields, includes
+
+
+@api.route('/<any(users, posts, tags):kind>')
+def list_resources(kind):
+    """
+    Keyset-paginated collection. ?fields= limits the returned (and selected)
+    columns, ?include= embeds related objects, ?cursor= / ?limit= page.
+    A matching If-None-Match is answered before the page is queried.
+    """
+    resource = RESOURCES[kind]
+    fields, includes = _request_shape(resource)
+    limit = get_page_size(
+        request.args.get('limit'),
+        current_app.config['API_PAGE_SIZE'], current_app.config['API_PAGE_SIZE_MAX']
+    )
+    cursor = request.args.get('cursor')
+    etag = _versions_etag(resource, includes, kind, fields, cursor, limit)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        page = keyset_paginate(
+            resource.query(fields, includes),
+            resource.order_by, cursor=cursor,
+            limit=limit, descending=resource.descending
+        )
+    except InvalidCursor:
+        abort(400, 'invalid cursor')
+
+    loaded = _load_includes(page.items, includes)
+    next_url = page.next_cursor and url_for(
+        'api.list_resources', kind=kind, cursor=page.next_cursor, limit=limit,
+        fields=request.args.get('fields'), include=request.args.get('include')
+    )
+    if etag is None:
+        # no change counters (e.g. SQLite): validate by the rows themselves
+        etag = _etag(kind, fields, includes, page.items, loaded, next_url)
+    return _respond(etag, lambda: {
+        'data': _document(page.items, fields, includes, loaded),
+        'links': {'next': next_url},
+    })
+
+
+@api.route('/<any(users, posts, tags):kind>/<int:item_id>')
+def get_resource(kind, item_id):
+    """A single user, post or tag, with the same ?fields= and ?include=."""
+    resource = RESOURCES[kind]
+    fields, includes = _request_shape(resource)
+    etag = _versions_etag(resource, includes, kind, item_id, fields)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    row = resource.query(fields, includes).filter(
+        resource.model.id == item_id
+    ).first()
+    if row is None:
+        abort(404, f"{kind[:-1]} {item_id} not found")
+
+    loaded = _load_includes([row], includes)
+    if etag is None:
+        etag = _etag(kind, fields, includes, row, loaded)
+    return _respond(etag, lambda: {
+        'data': _document([row], fields, includes, loaded)[0],
+    })
+
+
+@api.route('/<any(users, posts, tags):kind>/<int:item_id>', methods=['PATCH'])
+def update_resource(kind, item_id):
+    """
+    Change writable fields of a user, post or tag. The JSON body carries the
+    new values and the version they were based on (as read from the API);
+    if the item changed since, nothing is written and the answer is 409 with
+    the current version. Returns the updated item like get_resource.
+    """
+    resource = RESOURCES[kind]
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        abort(400, 'expected a JSON object')
+    version = changes.pop('version', None)
+    if not isinstance(version, int):
+        abort(428, 'version is required')
+    unknown = set(changes) - set(resource.writable)
+    if unknown:
+        abort(400, f"fields not writable: {', '.join(sorted(unknown))}")
+
+    query = resource.model.query.filter(resource.model.id == item_id)
+    if resource.visible is not None:
+        query = query.filter(resource.visible)
+    item = query.first()
+    if item is None:
+        abort(404, f"{kind[:-1]} {item_id} not found")
+    try:
+        check_version(item, version)
+        for field, value in changes.items():
+            setattr(item, field, value)
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        current = db.session.query(resource.model.version).filter(
+            resource.model.id == item_id
+        ).scalar()
+        abort(409, f"{kind[:-1]} {item_id} changed; current version is {current}")
+    except exc.SQLAlchemyError as err:
+        db.session.rollback()
+        count_error(err)
+        abort(422, f"could not update {kind[:-1]} {item_id}")
+    return get_resource(kind, item_id)
+
+
+@api.route('/posts', methods=['POST'])
+def create_posts():
+    """
+    Create the posts of the JSON body {"data": [{title, content, user_id,
+    tags: [names]}, ...]} (up to BULK_POSTS_MAX) in one transaction, creating
+    missing tags; answers 201 with the new posts. With an Idempotency-Key
+    header, a retry of the same request gets the first answer again (marked
+    Idempotent-Replayed) and reusing the key for another request is a 422.
+    """
+    body = request.get_json(silent=True)
+    items = body.get('data') if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        abort(400, 'expected a JSON object with a non-empty "data" list')
+    if len(items) > current_app.config['BULK_POSTS_MAX']:
+        abort(413, f"at most {current_app.config['BULK_POSTS_MAX']} posts per request")
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= 128:
+        abort(400, 'Idempotency-Key must be 1 to 128 characters')
+
+    try:
+        if key is not None:
+            stored = idempotency.claim('posts', key, request.get_data())
+            if stored is not None:
+                db.session.rollback()
+                response = jsonify(stored.response)
+                response.status_code = stored.status_code
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+        document = {'data': bulk_posts.create_posts(items)}
+        if key is not None:
+            idempotency.save('posts', key, 201, document)
+        db.session.commit()
+    except (bulk_posts.InvalidPosts, idempotency.IdempotencyKeyReused) as err:
+        db.session.rollback()
+        abort(422, str(err))
+    except exc.SQLAlchemyError as err:
+        db.session.rollback()
+        count_error(err)
+        abort(422, 'could not create posts')
+    return jsonify(document), 201
+
+
+@api.errorhandler(HTTPException)
+def api_error(error):
+    """Report API errors as JSON instead of HTML error pages."""
+    return jsonify(error=error.description, status=error.code), error.code
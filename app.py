@@ -1,33 +1,171 @@
 """Blogly application."""
+import copy
 import datetime
+import functools
+import math
+import os
+import string
+
+from flask import (Flask, abort, current_app, flash, jsonify, redirect,
+                   render_template, request, url_for)
+
+from api import api
+from associations import link_tag_posts, sync_post_tags, sync_tag_posts, unlink_tag_posts
+from catalog import post_picker, tag_catalog, user_directory
+from cli import blogly_cli
+from config import profile_config
+from fragment_cache import fragment_cache
+from http_cache import conditional, init_http_cache
+from instrumentation import init_query_stats
+from jobs import enqueue, init_jobs
+from metrics import count_error, init_metrics, metrics
+from models import (AUTHOR_VISIBLE, Job, Post, PostTag, Tag, User, UserPostSummary,
+                    check_version, connect_db, db)
+from pagination import InvalidCursor, get_page_size, keyset_paginate
+from pool_metrics import pool_snapshot
+from related import related_posts
+from search import search_posts
+from startup import StartupProfiler
+from streaming import StreamedRows, stream_template
+from templating import init_templates
+from sqlalchemy import exc
+from sqlalchemy.orm import defer, load_only, selectinload
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
+
+SETTINGS = {
+    # home feed page size (?limit= is clamped to POSTS_PER_PAGE_MAX)
+    'POSTS_PER_PAGE': 20,
+    'POSTS_PER_PAGE_MAX': 100,
+    'SEARCH_RESULTS_PER_PAGE': 20,
+    'API_PAGE_SIZE': 50,
+    'API_PAGE_SIZE_MAX': 500,
+    # tag cloud: number of tags shown and of font-size steps
+    'TAG_CLOUD_SIZE': 50,
+    'TAG_CLOUD_LEVELS': 5,
+    'TOP_TAGS_MAX': 100,
+    # user directory page size
+    'USERS_PER_PAGE': 100,
+    'USERS_PER_PAGE_MAX': 500,
+    # streamed listings (tags): rows fetched per batch, and the size in
+    # characters of the chunks sent
+    'STREAM_BATCH_SIZE': 500,
+    'STREAM_BUFFER_BYTES': 16384,
+    # related posts kept per post (see related.py)
+    'RELATED_POSTS': 5,
+    # posts offered per page by the post picker of the tag forms
+    'POST_PICKER_PAGE_SIZE': 20,
+    'POST_PICKER_PAGE_SIZE_MAX': 100,
+    # posts accepted per POST /api/v1/posts, and seconds an Idempotency-Key
+    # is remembered (see idempotency.py)
+    'BULK_POSTS_MAX': 500,
+    'IDEMPOTENCY_KEY_TTL': 86400,
+    # per-endpoint query budgets; exceeding one fails the test suite
+    # (read pages spend one of them on the table_versions lookup of http_cache)
+    'SQL_QUERY_BUDGETS': {
+        'index_view': 0,
+        'pool_status_view': 0,
+        'metrics_view': 0,
+        'job_status_view': 1,
+        'home_view': 3,
+        'search_view': 2,
+        'search_json_view': 2,
+        'users_view': 2,
+        'new_user_view': 1,
+        'user_detail_view': 3,
+        'edit_user_view': 3,
+        # posting with tags also queues a related-posts refresh (2 queries)
+        'new_post_view': 4,
+        'post_detail_view': 4,
+        'post_picker_view': 2,
+        'edit_post_view': 6,
+        'tags_view': 2,
+        'tag_cloud_view': 2,
+        'top_tags_view': 2,
+        'tag_detail_view': 3,
+        'new_tag_view': 2,
+        'edit_tag_view': 5,
+        # versions + page + one batched IN query per include
+        'api.list_resources': 4,
+        'api.get_resource': 4,
+        # item, UPDATE, then get_resource
+        'api.update_resource': 6,
+        # key, users, tags (upsert + existing), posts, links, job, response
+        'api.create_posts': 8,
+    },
+}
+
+# views of this module; create_app adds them to every app it builds
+ROUTES = []
+
+
+def route(rule, **options):
+    """Like app.route, but recorded in ROUTES for create_app."""
+    def decorator(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+
+# tables each read page is rendered from; their change counters validate it
+POST_PAGE_TABLES = ('posts', 'users', 'tags', 'posts_tags')
+
+
+def get_user_or_404(user_id):
+    """Return the user unless missing or hidden by a pending delete."""
+    return User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+
+
+def visible_posts():
+    """Posts query without the posts of users pending deletion."""
+    return Post.query.filter(AUTHOR_VISIBLE)
+
+
+def form_version():
+    """
+    The version of the object an edit form was rendered from (its hidden
+    version field), or None for forms that do not send one.
+    """
+    try:
+        return request.form.get('version', type=int)
+    except ValueError:
+        abort(400)
 
-from flask import Flask, flash, redirect, render_template, request, url_for
-from flask_debugtoolbar import DebugToolbarExtension
 
-from models import Post, PostTag, Tag, User, connect_db, db
-from sqlalchemy import exc
+def edit_conflict(kind, url):
+    """Discard a stale edit and send the user back to the fresh form."""
+    db.session.rollback()
+    flash(f'This {kind} was changed by someone else while you were editing; '
+          'your changes were not saved. Review it and edit again.', 'warning')
+    return redirect(url)
 
-app = Flask(__name__)
-# database setup
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgres:///blogly'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-# app.config['SQLALCHEMY_ECHO'] = True
-connect_db(app)
-db.create_all()
-# debug setup
-# app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = "test"
-app.debug = True
-tool_bar = DebugToolbarExtension(app)
 
 def isValid(text):
     return text.isalnum()
 
-@app.template_filter('datetime')
+def tag_cloud_weights(tags, levels):
+    """
+    Pair each tag with a weight in 1..levels, scaled logarithmically between
+    the smallest and largest post_count so one huge tag doesn't flatten the rest.
+    """
+    if not tags:
+        return []
+    low = math.log1p(min(tag.post_count for tag in tags))
+    high = math.log1p(max(tag.post_count for tag in tags))
+    spread = (high - low) or 1
+    return [
+        (tag, 1 + round((math.log1p(tag.post_count) - low) / spread * (levels - 1)))
+        for tag in tags
+    ]
+
+# every card formats its post's created_at; the same posts are shown again
+# and again, so remember the formatted strings
+@functools.lru_cache(maxsize=4096)
 def format_datetime(value):
     return datetime.datetime.strftime(value, '%a %b %d %Y, %I:%M %p')
 
-@app.route('/')
+
+@route('/')
 def index_view():
     """
     Index page: /home, /users, /tags
@@ -36,29 +174,163 @@ def index_view():
         'index.html'
     )
 
-@app.route('/home')
+@route('/home')
+@conditional(*POST_PAGE_TABLES)
 def home_view():
     """
-    Home page; redirects to users page.
+    Home page: most recent posts first, one keyset page at a time.
+    ?before=<cursor> continues after the last post of the previous page and
+    ?limit= sets the page size. Tags are fetched in one batched IN query, so a
+    page costs a fixed number of queries. Cards show the stored excerpt and
+    author name; neither the full content nor the users are loaded.
+    """
+    limit = get_page_size(
+        request.args.get('limit'),
+        current_app.config['POSTS_PER_PAGE'], current_app.config['POSTS_PER_PAGE_MAX']
+    )
+    try:
+        page = keyset_paginate(
+            visible_posts().options(selectinload(Post.tags), defer(Post.content)),
+            (Post.created_at, Post.id),
+            cursor=request.args.get('before'), limit=limit, descending=True
+        )
+    except InvalidCursor:
+        abort(400)
+
+    next_url = None
+    if page.next_cursor:
+        next_url = url_for(
+            'home_view', before=page.next_cursor, limit=request.args.get('limit')
+        )
+    return render_template(
+        'home.html', next_url=next_url,
+        cards=fragment_cache.render_posts('_post_card.html', page.items)
+    )
+
+
+def _search_args():
+    """
+    Parse ?q=, ?tag=, ?author= (user id) and ?page= for the search views.
     """
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        author = request.args.get('author', type=int)
+    except ValueError:
+        abort(400)
+    return {
+        'terms': request.args.get('q', '').strip(),
+        'tag': request.args.get('tag') or None,
+        'user_id': author,
+        'page': page,
+        'per_page': current_app.config['SEARCH_RESULTS_PER_PAGE'],
+    }
+
+
+@route('/search')
+@conditional(*POST_PAGE_TABLES)
+def search_view():
+    """
+    Full-text search over post titles and content, best match first;
+    optionally filtered by ?tag= name and ?author= user id.
+    """
+    args = _search_args()
+    results, has_next = search_posts(**args) if args['terms'] else ([], False)
     return render_template(
-        'home.html', posts=Post.query.order_by(Post.created_at.desc())
+        'search.html', results=results, has_next=has_next, **args
+    )
+
+
+@route('/search.json')
+@conditional(*POST_PAGE_TABLES)
+def search_json_view():
+    """
+    JSON variant of search_view: ranked posts with highlighted snippets.
+    """
+    args = _search_args()
+    if not args['terms']:
+        abort(400)
+    results, has_next = search_posts(**args)
+    return jsonify(
+        page=args['page'],
+        has_next=has_next,
+        results=[{
+            'id': result.post.id,
+            'title': result.post.title,
+            'author': result.post.author_name,
+            'user_id': result.post.user_id,
+            'created_at': result.post.created_at.isoformat(),
+            'rank': result.rank,
+            'snippet': str(result.snippet),
+        } for result in results]
+    )
+
+
+@route('/status/pool')
+def pool_status_view():
+    """
+    Connection-pool gauges and counters of this worker, per engine
+    ('primary' plus any configured replica binds).
+    """
+    binds = [None] + list(current_app.config['SQLALCHEMY_BINDS'] or ())
+    return jsonify({
+        bind or 'primary': pool_snapshot(db.get_engine(current_app, bind).pool)
+        for bind in binds
+    })
+
+
+@route('/metrics')
+def metrics_view():
+    """
+    Request metrics of all workers in the Prometheus text format.
+    """
+    return current_app.response_class(
+        metrics.expose(), mimetype='text/plain; version=0.0.4'
+    )
+
+
+@route('/jobs/<int:job_id>')
+def job_status_view(job_id):
+    """
+    Status and progress of a background job (see jobs.py).
+    """
+    job = Job.query.get_or_404(job_id)
+    return jsonify(
+        id=job.id, kind=job.kind, status=job.status,
+        progress_done=job.progress_done, progress_total=job.progress_total,
+        attempts=job.attempts,
+        finished_at=job.finished_at and job.finished_at.isoformat(),
     )
 
 
 # User Views
-@app.route('/users')
+@route('/users')
+@conditional('users')
 def users_view():
     """
-    Show all users; links each user to detail page; includes a link to add user.
+    Show the users by last and first name, one keyset page at a time
+    (?after=, ?limit=); ?q= (or an A-Z link) shows those whose last name
+    starts with it. Includes a link to add user.
     """
+    q = request.args.get('q', '')
+    limit = get_page_size(
+        request.args.get('limit'),
+        current_app.config['USERS_PER_PAGE'], current_app.config['USERS_PER_PAGE_MAX']
+    )
+    try:
+        page = user_directory(q, request.args.get('after'), limit)
+    except InvalidCursor:
+        abort(400)
+
+    next_url = page.next_cursor and url_for(
+        'users_view', q=q or None, after=page.next_cursor, limit=request.args.get('limit')
+    )
     return render_template(
-        'users.html',
-        users=User.query.order_by(User.last_name, User.first_name).all()
+        'users.html', users=page.items, q=q, next_url=next_url,
+        letters=string.ascii_uppercase
     )
 
 
-@app.route('/users/new', methods=['GET', 'POST'])
+@route('/users/new', methods=['GET', 'POST'])
 def new_user_view():
     """
     GET: Display form for adding a new user.
@@ -86,7 +358,8 @@ def new_user_view():
             db.session.add(new_user)
             db.session.commit()
             flash('Success: user created!', 'success')
-        except exc.SQLAlchemyError:
+        except exc.SQLAlchemyError as err:
+            count_error(err)
             flash('Failed to add user', 'danger')
             return redirect(url_for('new_user_view'))
         return redirect(url_for('users_view'))
@@ -94,21 +367,43 @@ def new_user_view():
     return render_template('new_user.html')
 
 
-@app.route('/users/<int:user_id>')
+@route('/users/<int:user_id>')
+@conditional(*POST_PAGE_TABLES)
 def user_detail_view(user_id):
     """
     Display user details (name, image) and buttons to edit or delete user.
+    The user's posts, newest first, are read a keyset page at a time
+    (?before=, ?limit=) from the user_post_summaries read model.
     """
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
+    limit = get_page_size(
+        request.args.get('limit'),
+        current_app.config['POSTS_PER_PAGE'], current_app.config['POSTS_PER_PAGE_MAX']
+    )
+    try:
+        page = keyset_paginate(
+            UserPostSummary.query.filter_by(user_id=user_id),
+            (UserPostSummary.created_at, UserPostSummary.post_id),
+            cursor=request.args.get('before'), limit=limit, descending=True
+        )
+    except InvalidCursor:
+        abort(400)
+
+    next_url = None
+    if page.next_cursor:
+        next_url = url_for(
+            'user_detail_view', user_id=user_id,
+            before=page.next_cursor, limit=request.args.get('limit')
+        )
     return render_template(
-        'user_detail.html', user=user,
+        'user_detail.html', user=user, summaries=page.items, next_url=next_url,
         edit_url=url_for('edit_user_view', user_id=user_id),
         delete_url=url_for('delete_user', user_id=user_id),
-        posts=user.posts, new_post_url=url_for('new_post_view', user_id=user_id)
+        new_post_url=url_for('new_post_view', user_id=user_id)
     )
 
 
-@app.route('/users/<int:user_id>/edit', methods=['GET', 'POST'])
+@route('/users/<int:user_id>/edit', methods=['GET', 'POST'])
 def edit_user_view(user_id):
     """
     GET: Display form for editing a user.
@@ -130,7 +425,8 @@ def edit_user_view(user_id):
             return redirect(url_for('new_user_view'))
 
         try:
-            user = User.query.get_or_404(user_id)
+            user = get_user_or_404(user_id)
+            check_version(user, form_version())
             user.first_name = first_name
             user.last_name = last_name
             if url:
@@ -138,32 +434,48 @@ def edit_user_view(user_id):
             db.session.add(user)
             db.session.commit()
             flash('Success: user updated!', 'success')
-        except exc.SQLAlchemyError:
+        except StaleDataError:
+            return edit_conflict('user', url_for('edit_user_view', user_id=user_id))
+        except exc.SQLAlchemyError as err:
+            count_error(err)
             flash('Failed to update user', 'danger')
             return redirect(url_for('edit_user_view', user_id=user_id))
         return redirect(url_for('user_detail_view', user_id=user_id))
 
-    return render_template('edit_user.html', user=User.query.get(user_id))
+    return render_template('edit_user.html', user=get_user_or_404(user_id))
 
 
-@app.route('/users/<int:user_id>/delete', methods=['POST'])
+@route('/users/<int:user_id>/delete', methods=['POST'])
 def delete_user(user_id):
     """
     Query and delete user from db; redirect to users_view if succesful
     else redirect back to this page.
+    A user with more than JOB_INLINE_MAX_ROWS posts is hidden at once and
+    deleted by a background job, a chunk of posts at a time.
     """
     try:
-        db.session.delete(User.query.get_or_404(user_id))
+        user = get_user_or_404(user_id)
+        post_count = Post.query.filter_by(user_id=user_id).count()
+        if post_count > current_app.config['JOB_INLINE_MAX_ROWS']:
+            user.deleted_at = datetime.datetime.utcnow()
+            enqueue('delete_user', {'user_id': user_id},
+                    key=f"user:{user_id}", total=post_count + 1)
+            db.session.commit()
+            flash(f'Success: user deleted; removing {post_count} posts '
+                  'in the background', 'success')
+            return redirect(url_for('users_view'))
+        db.session.delete(user)
         db.session.commit()
         flash('Success: user deleted', 'success')
-    except exc.SQLAlchemyError:
+    except exc.SQLAlchemyError as err:
+        count_error(err)
         flash('Failed to delete user', 'danger')
         return redirect(url_for('users_view'))
     return redirect(url_for('users_view'))
 
 
 # Post Views
-@app.route('/users/<int:user_id>/posts/new', methods=['GET', 'POST'])
+@route('/users/<int:user_id>/posts/new', methods=['GET', 'POST'])
 def new_post_view(user_id):
     """
     GET: Display form for adding a new post.
@@ -174,19 +486,20 @@ def new_post_view(user_id):
     if request.method == 'POST':
         title = request.form.get('title')
         content = request.form.get('content')
-        tag_ids = request.form.getlist('tags')
+        tag_ids = set(map(int, request.form.getlist('tags')))
 
         try:
             new_post = Post(title=title, content=content, user_id=user_id)
-            new_post.posttags.extend([
-                PostTag(post_id=new_post.id, tag_id=tag_id)
-                for tag_id in tag_ids
-            ])
-
             db.session.add(new_post)
+            db.session.flush()
+            sync_post_tags(new_post.id, tag_ids, prune=False)
+            if tag_ids:
+                enqueue('refresh_related_posts', {'post_ids': [new_post.id]},
+                        key=f"related:{new_post.id}")
             db.session.commit()
             flash('Success: post created!', 'success')
-        except exc.SQLAlchemyError:
+        except exc.SQLAlchemyError as err:
+            count_error(err)
             flash('Failed to create post', 'danger')
             return redirect(url_for('new_post_view', user_id=user_id))
         
@@ -194,26 +507,105 @@ def new_post_view(user_id):
 
     return render_template(
         'new_post.html',
-        user_name=User.query.get_or_404(user_id).full_name,
-        tags=Tag.query.order_by(Tag.name).all()
+        user_name=get_user_or_404(user_id).full_name,
+        tags=tag_catalog.tags()
     )
 
 
-@app.route('/posts/<int:post_id>')
+@route('/posts/<int:post_id>')
+@conditional(*POST_PAGE_TABLES, 'related_posts')
 def post_detail_view(post_id):
     """
-    Display post details (title, content, author) and buttons to edit or delete post.
+    Display post details (title, content, author), related posts and buttons
+    to edit or delete post.
     """
-    post = Post.query.get_or_404(post_id)
+    post = visible_posts().filter(Post.id == post_id).options(
+        selectinload(Post.tags)
+    ).first_or_404()
     return render_template(
-        'post_detail.html', post=post,
+        'post_detail.html', post=post, related=related_posts(post_id),
         user_url=url_for('user_detail_view', user_id=post.user_id),
         edit_url=url_for('edit_post_view', post_id=post_id),
         delete_url=url_for('delete_post', post_id=post_id)
     )
 
 
-@app.route('/posts/<int:post_id>/edit', methods=['GET', 'POST'])
+def _picker_args():
+    """Parse ?q=, ?after= and ?limit= of the post picker."""
+    return {
+        'prefix': request.args.get('q', ''),
+        'after': request.args.get('after'),
+        'limit': get_page_size(
+            request.args.get('limit'),
+            current_app.config['POST_PICKER_PAGE_SIZE'],
+            current_app.config['POST_PICKER_PAGE_SIZE_MAX']
+        ),
+    }
+
+
+def _post_choices(form):
+    """
+    (added, removed) post ids chosen so far on a tag form. The form carries
+    the choices of the picker pages seen before as add= and remove=, lists
+    the posts of its own page as shown= and checks some of them as posts=;
+    a shown post counts as it is checked now.
+    """
+    try:
+        added, removed, shown, checked = (
+            set(map(int, form.getlist(name)))
+            for name in ('add', 'remove', 'shown', 'posts')
+        )
+    except ValueError:
+        abort(400)
+    added = (added - shown) | checked
+    return added, ((removed - shown) | (shown - checked)) - added
+
+
+def _picker_page(tag_id=None):
+    """
+    Template arguments for the post picker of a tag form: one page of posts
+    (not yet tagged with tag_id) matching ?q=, one page of tag_id's own
+    posts, their next cursors and the choices carried from earlier pages.
+    """
+    args = _picker_args()
+    added, removed = _post_choices(request.args)
+    try:
+        page = post_picker(exclude_tag_id=tag_id, **args)
+        tagged = None
+        if tag_id is not None:
+            tagged = post_picker(
+                tag_id=tag_id, after=request.args.get('tagged_after'), limit=args['limit']
+            )
+    except InvalidCursor:
+        abort(400)
+    return {
+        'posts': page.items, 'q': args['prefix'], 'next_cursor': page.next_cursor,
+        'tagged_posts': tagged.items if tagged else [],
+        'tagged_next_cursor': tagged.next_cursor if tagged else None,
+        'added': added, 'removed': removed,
+    }
+
+
+@route('/posts/picker')
+@conditional('posts', 'posts_tags')
+def post_picker_view():
+    """
+    Typeahead for choosing posts: (id, title) of posts whose title starts
+    with ?q=, by title, ?limit= at a time; ?after= continues from the next
+    cursor of the previous page and ?exclude_tag= leaves out a tag's posts.
+    """
+    try:
+        exclude_tag = request.args.get('exclude_tag', type=int)
+        page = post_picker(exclude_tag_id=exclude_tag, **_picker_args())
+    except InvalidCursor:
+        abort(400)
+    return jsonify(
+        results=[{'id': post.id, 'title': post.title} for post in page.items],
+        next=page.next_cursor
+    )
+
+
+@route('/posts/<int:post_id>/edit', methods=['GET', 'POST'])
 def edit_post_view(post_id):
     """
     GET: Display form for editing the post.
@@ -225,28 +617,27 @@ def edit_post_view(post_id):
     if request.method == 'POST':
         title = request.form.get('title')
         content = request.form.get('content')
-        tag_ids = set(map(lambda item: int(item), request.form.getlist('tags')))
+        tag_ids = set(map(int, request.form.getlist('tags')))
 
         try:
             post = Post.query.get_or_404(post_id)
+            check_version(post, form_version())
             post.title = title
             post.content = content
-            old_tag_ids = set(map(lambda item: item.tag_id, post.posttags))
-            # associate post with new tags
-            post.posttags.extend([
-                PostTag(post_id=post.id, tag_id=tag_id)
-                for tag_id in (tag_ids - old_tag_ids)
-            ])
+            # the tags are part of the edit: bump the version even when
+            # only they changed
+            flag_modified(post, 'title')
             db.session.add(post)
-            db.session.commit()
-
-            # dissociate post with removed tags
-            db.session.query(PostTag).filter(
-                PostTag.tag_id.in_(old_tag_ids - tag_ids)
-            ).delete(synchronize_session='fetch')
+            added, removed = sync_post_tags(post_id, tag_ids)
+            if added or removed:
+                enqueue('refresh_related_posts', {'post_ids': [post_id]},
+                        key=f"related:{post_id}")
             db.session.commit()
             flash('Success: post updated!', 'success')
-        except exc.SQLAlchemyError:
+        except StaleDataError:
+            return edit_conflict('post', url_for('edit_post_view', post_id=post_id))
+        except exc.SQLAlchemyError as err:
+            count_error(err)
             flash('Failed to update post', 'danger')
             return redirect(url_for('edit_post_view', post_id=post_id))
         
@@ -254,11 +645,11 @@ def edit_post_view(post_id):
 
     return render_template(
         'edit_post.html', post=Post.query.get(post_id),
-        tags=Tag.query.order_by(Tag.name).all()
+        tags=tag_catalog.tags()
     )
 
 
-@app.route('/posts/<int:post_id>/delete', methods=['POST'])
+@route('/posts/<int:post_id>/delete', methods=['POST'])
 def delete_post(post_id):
     """
     Query and delete post from db; redirect to post_detail_view if succesful
@@ -269,39 +660,75 @@ def delete_post(post_id):
         db.session.delete(post)
         db.session.commit()
         flash('Success: post deleted!', 'success')
-    except exc.SQLAlchemyError:
+    except exc.SQLAlchemyError as err:
+        count_error(err)
         flash('Failed to delete post', 'danger')
         return redirect(url_for('post_detail_view', post_id=post_id))
     return redirect(url_for('user_detail_view', user_id=post.user_id))
 
 
 # Tag views
-@app.route('/tags')
+@route('/tags')
+@conditional('tags')
 def tags_view():
     """
     Show all tags; links each tag to detail page; includes a link to add tag.
+    The list is streamed, a batch of tags at a time.
+    """
+    return stream_template('tags.html', tags=StreamedRows(
+        Tag.query.order_by(Tag.name).options(load_only(Tag.id, Tag.name, Tag.post_count)),
+        current_app.config['STREAM_BATCH_SIZE']
+    ))
+
+
+@route('/tags/cloud')
+@conditional('tags')
+def tag_cloud_view():
+    """
+    Tag cloud of the most used tags, alphabetical, sized by post count.
+    Reads only the denormalized tags.post_count; never touches posts_tags.
+    """
+    tags = Tag.query.order_by(Tag.post_count.desc(), Tag.id).limit(
+        current_app.config['TAG_CLOUD_SIZE']
+    ).all()
+    tags.sort(key=lambda tag: tag.name.lower())
+    return render_template(
+        'tag_cloud.html',
+        weighted_tags=tag_cloud_weights(tags, current_app.config['TAG_CLOUD_LEVELS'])
+    )
+
+
+@route('/tags/top')
+@conditional('tags')
+def top_tags_view():
+    """
+    Show the ?n= (default 10) tags with the most posts.
     """
+    limit = get_page_size(request.args.get('n'), 10, current_app.config['TOP_TAGS_MAX'])
     return render_template(
-        'tags.html',
-        tags=Tag.query.order_by(Tag.name).all()
+        'top_tags.html',
+        tags=Tag.query.order_by(Tag.post_count.desc(), Tag.id).limit(limit).all()
     )
 
 
-@app.route('/tags/<int:tag_id>')
+@route('/tags/<int:tag_id>')
+@conditional(*POST_PAGE_TABLES)
 def tag_detail_view(tag_id):
     """
     Display tag details (title, content, author) and buttons to edit or delete tag.
     """
     tag = Tag.query.get_or_404(tag_id)
     return render_template(
-        'tag_detail.html', tag=tag, posts=tag.posts,
+        'tag_detail.html', tag=tag,
+        posts=visible_posts().join(Post.posttags).filter(PostTag.tag_id == tag_id)
+        .options(load_only(Post.id, Post.title)).all(),
         tags_url=url_for('tags_view'),
         edit_url=url_for('edit_tag_view', tag_id=tag_id),
         delete_url=url_for('delete_tag', tag_id=tag_id)
     )
 
 
-@app.route('/tags/new', methods=['GET', 'POST'])
+@route('/tags/new', methods=['GET', 'POST'])
 def new_tag_view():
     """
     GET: Display form for adding a new tag.
@@ -311,27 +738,25 @@ def new_tag_view():
     """
     if request.method == 'POST':
         name = request.form.get('name')
-        post_ids = request.form.getlist('posts')
+        post_ids, _ = _post_choices(request.form)
         try:
             new_tag = Tag(name=name)
-            new_tag.posttags.extend([
-                PostTag(post_id=post_id, tag_id=new_tag.id)
-                for post_id in post_ids
-            ])
             db.session.add(new_tag)
+            db.session.flush()
+            sync_tag_posts(new_tag.id, post_ids, prune=False)
             db.session.commit()
             flash('Success: tag created!', 'success')
-        except exc.SQLAlchemyError:
+        except exc.SQLAlchemyError as err:
+            count_error(err)
             flash('Failed to create tag', 'danger')
             return redirect(url_for('new_tag_view'))
         return redirect(url_for('tags_view'))
 
     return render_template(
-        'new_tag.html',
-        posts=Post.query.order_by(Post.title).all()
+        'new_tag.html', name=request.args.get('name', ''), **_picker_page()
     )
 
-@app.route('/tags/<int:tag_id>/edit', methods=['GET', 'POST'])
+@route('/tags/<int:tag_id>/edit', methods=['GET', 'POST'])
 def edit_tag_view(tag_id):
     """
     GET: Display form for editing the tag.
@@ -342,43 +767,55 @@ def edit_tag_view(tag_id):
     """
     if request.method == 'POST':
         name = request.form.get('name')
-        post_ids = request.form.getlist('posts')
+        added, removed = _post_choices(request.form)
 
         try:
             tag = Tag.query.get_or_404(tag_id)
+            check_version(tag, form_version())
             tag.name = name
-
-            # remove all rows in posts_tags under this tag
-            db.session.query(PostTag).filter(
-                PostTag.tag_id == tag.id
-            ).delete(synchronize_session='fetch')
-            db.session.commit()
-
-            # add all checked posts to posts_tags
-            tag.posttags.extend([
-                PostTag(post_id=post_id, tag_id=tag.id)
-                for post_id in post_ids
-            ])
+            # the posts are part of the edit: bump the version even when
+            # only they changed
+            flag_modified(tag, 'name')
             db.session.add(tag)
+            if len(added) + len(removed) > current_app.config['JOB_INLINE_MAX_ROWS']:
+                # many links change: rename now (the new tag version re-keys
+                # the cards showing it), relink posts in the background. The
+                # job gets the whole set, so a newer edit can supersede it.
+                current = {
+                    post_id for (post_id,) in
+                    db.session.query(PostTag.post_id).filter(PostTag.tag_id == tag_id)
+                }
+                enqueue('sync_tag_posts', {
+                    'tag_id': tag_id, 'post_ids': sorted((current | added) - removed)
+                }, key=f"tag:{tag_id}")
+                db.session.commit()
+                flash('Success: tag updated; its posts are being updated '
+                      'in the background', 'success')
+                return redirect(url_for('tag_detail_view', tag_id=tag_id))
+            db.session.flush()
+            link_tag_posts(tag_id, added)
+            unlink_tag_posts(tag_id, removed)
             db.session.commit()
-
             flash('Success: tag updated!', 'success')
-        except exc.SQLAlchemyError:
+        except StaleDataError:
+            return edit_conflict('tag', url_for('edit_tag_view', tag_id=tag_id))
+        except exc.SQLAlchemyError as err:
+            count_error(err)
             flash('Failed to update tag', 'danger')
             return redirect(url_for('edit_tag_view', tag_id=tag_id))
         return redirect(url_for('tag_detail_view', tag_id=tag_id))
     
-    tag = Tag.query.get(tag_id)
-    # extract list of posts under this tag
-    existing_post_ids = list(map(lambda item: item.id, tag.posts))
+    # the form shows a page of the tag's posts (checked) and a picker page
+    # of the others; only the posts shown on some page can change, so the
+    # rest keep their links however many the tag has
+    tag = Tag.query.get_or_404(tag_id)
     return render_template(
-        'edit_tag.html', tag=tag,
-        posts=Post.query.order_by(Post.title).all(),
-        checked_post_ids=existing_post_ids
+        'edit_tag.html', tag=tag, name=request.args.get('name', tag.name),
+        version=request.args.get('version', tag.version), **_picker_page(tag_id)
     )
 
 
-@app.route('/tags/<int:tag_id>/delete', methods=['POST'])
+@route('/tags/<int:tag_id>/delete', methods=['POST'])
 def delete_tag(tag_id):
     """
     Query and delete tag from db; redirect to tag_detail_view if succesful
@@ -389,7 +826,49 @@ def delete_tag(tag_id):
         db.session.delete(tag)
         db.session.commit()
         flash('Success: tag deleted!', 'success')
-    except exc.SQLAlchemyError:
+    except exc.SQLAlchemyError as err:
+        count_error(err)
         flash('Failed to delete tag', 'danger')
         return redirect(url_for('tag_detail_view', tag_id=tag_id))
     return redirect(url_for('tags_view'))
+
+
+def create_app(profile=None, **settings):
+    """
+    Build a Blogly app for profile ('production', 'dev', 'test' or 'bench';
+    default $BLOGLY_PROFILE, else 'production'; see config.profile_config),
+    with settings applied last.
+
+    Building the app does not touch the database: create the schema with
+    `flask blogly migrate`. Templates are compiled here (see templating.py).
+    The debug toolbar is only imported for dev.
+    The duration of each step is kept in app.extensions['startup'].
+    """
+    startup = StartupProfiler()
+    app = Flask(__name__)
+    with startup.phase('config'):
+        app.config.update(copy.deepcopy(SETTINGS))
+        profile = profile or os.environ.get('BLOGLY_PROFILE', 'production')
+        app.config.update(profile_config(profile))
+        app.config.update(settings)
+    with startup.phase('extensions'):
+        connect_db(app)
+        init_query_stats(app)
+        init_metrics(app)
+        fragment_cache.init_app(app)
+        init_http_cache(app)
+        init_jobs(app)
+    with startup.phase('views'):
+        for rule, view, options in ROUTES:
+            app.add_url_rule(rule, view_func=view, **options)
+        app.add_template_filter(format_datetime, 'datetime')
+        app.register_blueprint(api)
+        app.cli.add_command(blogly_cli)
+    with startup.phase('templates'):
+        init_templates(app)
+    if app.debug:
+        with startup.phase('debug toolbar'):
+            from flask_debugtoolbar import DebugToolbarExtension
+            DebugToolbarExtension(app)
+    app.extensions['startup'] = startup.report()
+    return app
@@ -0,0 +1,76 @@
+"""Set-based syncing of the posts_tags association."""
+from sqlalchemy.dialects.postgresql import insert
+
+from models import PostTag, db
+
+posts_tags = PostTag.__table__
+
+
+def _sync(owner_column, owner_id, member_column, member_ids, prune=True):
+    """
+    Make the members linked to owner_id exactly member_ids using one bulk
+    DELETE and one bulk INSERT ... ON CONFLICT DO NOTHING, so the database
+    computes the diff and unchanged links are never rewritten.
+
+    Runs in the current session transaction; the caller commits. Pass
+    prune=False for a freshly created owner to skip the no-op DELETE.
+    Returns (added, removed) member ids.
+    """
+    member_ids = set(member_ids)
+    db.session.flush()
+
+    removed = set()
+    if prune:
+        delete = posts_tags.delete().where(owner_column == owner_id)
+        if member_ids:
+            delete = delete.where(~member_column.in_(member_ids))
+        removed = {
+            member_id for (member_id,) in
+            db.session.execute(delete.returning(member_column))
+        }
+
+    added = set()
+    if member_ids:
+        rows = [
+            {owner_column.key: owner_id, member_column.key: member_id}
+            for member_id in member_ids
+        ]
+        added = {
+            member_id for (member_id,) in db.session.execute(
+                insert(posts_tags).values(rows)
+                .on_conflict_do_nothing().returning(member_column)
+            )
+        }
+    return added, removed
+
+
+def sync_post_tags(post_id, tag_ids, prune=True):
+    """Set the tags of post_id to tag_ids; return (added, removed) tag ids."""
+    return _sync(posts_tags.c.post_id, post_id, posts_tags.c.tag_id, tag_ids, prune)
+
+
+def sync_tag_posts(tag_id, post_ids, prune=True):
+    """Set the posts of tag_id to post_ids; return (added, removed) post ids."""
+    return _sync(posts_tags.c.tag_id, tag_id, posts_tags.c.post_id, post_ids, prune)
+
+
+def link_tag_posts(tag_id, post_ids):
+    """Add tag_id to post_ids, skipping existing links; return added post ids."""
+    if not post_ids:
+        return set()
+    return {
+        post_id for (post_id,) in db.session.execute(
+            insert(posts_tags).values([
+                {'tag_id': tag_id, 'post_id': post_id} for post_id in post_ids
+            ]).on_conflict_do_nothing().returning(posts_tags.c.post_id)
+        )
+    }
+
+
+def unlink_tag_posts(tag_id, post_ids):
+    """Remove tag_id from post_ids; return the number of links removed."""
+    if not post_ids:
+        return 0
+    return db.session.execute(posts_tags.delete().where(
+        (posts_tags.c.tag_id == tag_id) & posts_tags.c.post_id.in_(post_ids)
+    )).rowcount
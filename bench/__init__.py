@@ -0,0 +1 @@
+"""Benchmark suite for Blogly: synthetic data, endpoint scenarios, JSON results."""
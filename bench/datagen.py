@@ -0,0 +1,140 @@
+"""Deterministic synthetic data for benchmarks."""
+import bisect
+import datetime
+import random
+
+from cli import import_records, rebuild_post_summaries, reconcile_tag_counts
+from models import db
+
+EPOCH = datetime.datetime(2015, 1, 1)
+
+
+class Zipf:
+    """
+    Sample ranks 0..n-1 with P(k) proportional to 1 / (k + 1) ** s, using a
+    precomputed cumulative table so each draw is one bisect.
+    """
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        total = 0.0
+        self.cumulative = []
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** s
+            self.cumulative.append(total)
+        self.total = total
+
+    def __repr__(self):
+        return f"<Zipf: n={len(self.cumulative)}>"
+
+    def sample(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+    def sample_distinct(self, count):
+        """Return up to count distinct ranks (fewer if draws keep colliding)."""
+        picked = set()
+        for _ in range(count * 4):
+            if len(picked) == count:
+                break
+            picked.add(self.sample())
+        return sorted(picked)
+
+
+class DatasetSpec:
+    """Sizes and skew of a synthetic dataset; same spec + seed = same data."""
+
+    def __init__(self, users=1000, posts=10000, tags=200, tags_per_post=3,
+                 author_skew=1.1, tag_skew=1.2, content_words=80, seed=42):
+        self.users = users
+        self.posts = posts
+        self.tags = tags
+        self.tags_per_post = tags_per_post
+        self.author_skew = author_skew
+        self.tag_skew = tag_skew
+        self.content_words = content_words
+        self.seed = seed
+
+    def __repr__(self):
+        return (f"<DatasetSpec: users={self.users} posts={self.posts} "
+                f"tags={self.tags} seed={self.seed}>")
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+WORDS = (
+    "time space sorcery wealth secret batman strange cave bat tower city night "
+    "stone mirror dimension cape gadget detective magic ancient library watch "
+    "portal relic mask signal rooftop storm shadow light dark eye order chaos"
+).split()
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def generate_users(spec):
+    rng = random.Random(f"{spec.seed}-users")
+    for user_id in range(1, spec.users + 1):
+        yield {
+            'id': user_id,
+            'first_name': f"First{user_id}",
+            'last_name': f"Last{rng.randrange(spec.users)}",
+            'image_url': None,
+        }
+
+
+def generate_tags(spec):
+    for tag_id in range(1, spec.tags + 1):
+        yield {'id': tag_id, 'name': f"tag{tag_id}"}
+
+
+def generate_posts(spec):
+    """
+    Posts with Zipf-distributed authors (a few prolific users) and tags
+    (a few huge tags, a long tail), spread over the years since EPOCH.
+    """
+    rng = random.Random(f"{spec.seed}-posts")
+    authors = Zipf(spec.users, spec.author_skew, rng)
+    tags = Zipf(spec.tags, spec.tag_skew, rng)
+    span = (datetime.datetime(2020, 1, 1) - EPOCH).total_seconds()
+    for post_id in range(1, spec.posts + 1):
+        yield {
+            'id': post_id,
+            'title': _sentence(rng, rng.randint(3, 8))[:128],
+            'content': ' '.join(
+                _sentence(rng, 10) for _ in range(max(1, spec.content_words // 10))
+            ),
+            'created_at': EPOCH + datetime.timedelta(seconds=rng.random() * span),
+            'user_id': authors.sample() + 1,
+            'tags': [
+                f"tag{rank + 1}"
+                for rank in tags.sample_distinct(rng.randint(0, spec.tags_per_post * 2))
+            ],
+        }
+
+
+def load_dataset(spec, chunk_size=5000, reporter=None):
+    """Recreate the schema and load spec's dataset; returns row counts."""
+    db.drop_all()
+    db.create_all()
+    counts = {
+        'users': import_records('users', generate_users(spec), chunk_size, reporter),
+        'tags': import_records('tags', generate_tags(spec), chunk_size, reporter),
+        'posts': import_records('posts', generate_posts(spec), chunk_size, reporter),
+    }
+    # PostgreSQL keeps these with triggers; elsewhere rebuild them
+    if db.engine.dialect.name != 'postgresql':
+        reconcile_tag_counts()
+        rebuild_post_summaries()
+    return counts
+
+
+def sample_ids(spec, count, seed_suffix, skew=None, n=None):
+    """Deterministic request targets: Zipf-skewed (hot items) or uniform ids."""
+    rng = random.Random(f"{spec.seed}-{seed_suffix}")
+    n = n or spec.posts
+    if skew:
+        zipf = Zipf(n, skew, rng)
+        return [zipf.sample() + 1 for _ in range(count)]
+    return [rng.randrange(n) + 1 for _ in range(count)]
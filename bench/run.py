@@ -0,0 +1,359 @@
+"""
+Run Blogly endpoint benchmarks and write JSON results.
+
+    python -m bench.run --database-url postgresql:///blogly_bench \\
+        --users 100000 --posts 1000000 --output results.json
+    python -m bench.run --database-url sqlite:////tmp/bench.db --mode wsgi \\
+        --compare results.json
+
+--mode wsgi serves the app from the threaded development server in this
+process; --mode http sends the requests to a server already running on
+--url instead, such as the production setup against the same database:
+
+    BLOGLY_PROFILE=bench DATABASE_URL=postgresql:///blogly_bench \\
+        gunicorn -c gunicorn.conf.py wsgi:app &
+    python -m bench.run --database-url postgresql:///blogly_bench --skip-load \\
+        --mode http --url http://127.0.0.1:8000 --scenario home --scenario post_detail
+
+The dataset is regenerated unless --skip-load is given. The run exits with
+status 1 when an endpoint exceeds its SQL query budget or, with --compare,
+when a scenario's p95 latency regresses by more than --tolerance.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from bench.datagen import DatasetSpec, sample_ids
+
+
+class Scenario:
+    """One endpoint exercised with a deterministic sequence of paths."""
+
+    def __init__(self, name, endpoint, paths, postgres_only=False):
+        self.name = name
+        self.endpoint = endpoint
+        self.paths = paths
+        self.postgres_only = postgres_only
+
+    def __repr__(self):
+        return f"<Scenario: name='{self.name}' endpoint='{self.endpoint}'>"
+
+
+def build_scenarios(spec, requests):
+    """The benchmark scenarios; hot items are drawn from Zipf distributions."""
+    def each(template, ids):
+        return [template.format(item_id) for item_id in ids]
+
+    return [
+        Scenario('home', 'home_view', ['/home'] * requests),
+        Scenario('post_detail', 'post_detail_view', each(
+            '/posts/{}', sample_ids(spec, requests, 'post_detail', skew=1.1)
+        )),
+        Scenario('user_detail', 'user_detail_view', each(
+            '/users/{}', sample_ids(spec, requests, 'user_detail', skew=1.1, n=spec.users)
+        )),
+        Scenario('tag_detail', 'tag_detail_view', each(
+            '/tags/{}', sample_ids(spec, requests, 'tag_detail', skew=1.2, n=spec.tags)
+        )),
+        Scenario('tags', 'tags_view', ['/tags'] * requests),
+        Scenario('new_post_form', 'new_post_view', each(
+            '/users/{}/posts/new', sample_ids(spec, requests, 'new_post', skew=1.1, n=spec.users)
+        )),
+        Scenario('edit_tag_form', 'edit_tag_view', each(
+            '/tags/{}/edit', sample_ids(spec, requests, 'edit_tag', skew=1.2, n=spec.tags)
+        )),
+        Scenario('post_picker', 'post_picker_view', each(
+            '/posts/picker?q={}', ['a', 'ba', 'sorc', 'portal+s'] * (requests // 4 + 1)
+        )[:requests]),
+        Scenario('users', 'users_view', ['/users'] * max(1, requests // 10)),
+        Scenario('api_posts', 'api.list_resources',
+                 ['/api/v1/posts?include=tags,user'] * requests),
+        Scenario('search', 'search_view', each(
+            '/search?q={}', ['sorcery', 'bat+cave', 'ancient+relic', 'portal+-magic'] *
+            (requests // 4 + 1)
+        )[:requests], postgres_only=True),
+    ]
+
+
+class QueryLog(logging.Handler):
+    """
+    Query counts of the requests this process serves, from their sql_stats
+    log lines. Unlike the X-DB-Query-Count header, these are also written
+    for streamed responses, once their last chunk is sent.
+    """
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.counts = []
+
+    def __repr__(self):
+        return f"<QueryLog: requests={len(self.counts)}>"
+
+    def emit(self, record):
+        event = json.loads(record.getMessage())
+        if event.get('event') == 'sql_stats':
+            self.counts.append(event['queries'])
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, query_counts, errors, elapsed, budget):
+    """
+    Sum up a run. A None query count (a streamed response seen over HTTP,
+    without the header) is left out of the budget check and reported as
+    unmeasured.
+    """
+    latencies_ms = [latency * 1000 for latency in latencies] or [0.0]
+    measured = [count for count in query_counts if count is not None]
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(statistics.mean(latencies_ms), 3),
+        'p50_ms': round(_percentile(latencies_ms, 0.50), 3),
+        'p95_ms': round(_percentile(latencies_ms, 0.95), 3),
+        'p99_ms': round(_percentile(latencies_ms, 0.99), 3),
+        'max_queries': max(measured, default=0),
+        'unmeasured_queries': len(query_counts) - len(measured),
+        'query_budget': budget,
+        'over_budget': budget is not None and max(measured, default=0) > budget,
+    }
+
+
+def run_client(app, scenario, query_log):
+    """
+    Drive scenario sequentially through the Flask test client; query_log
+    (a QueryLog) collects the query counts.
+    """
+    latencies, errors = [], 0
+    with app.test_client() as client:
+        client.get(scenario.paths[0]).get_data()  # warm up templates and caches
+        del query_log.counts[:]
+        started = time.perf_counter()
+        for path in scenario.paths:
+            start = time.perf_counter()
+            resp = client.get(path)
+            resp.get_data()
+            latencies.append(time.perf_counter() - start)
+            errors += resp.status_code >= 400
+    return latencies, list(query_log.counts), errors, time.perf_counter() - started
+
+
+def _header_count(resp):
+    count = resp.getheader('X-DB-Query-Count')
+    return int(count) if count is not None else None
+
+
+def run_http(host, port, scenario, concurrency, query_log=None):
+    """
+    Drive scenario against the server at host:port over keep-alive HTTP.
+    Query counts come from query_log when the server runs in this process,
+    else from the X-DB-Query-Count headers, which streamed responses lack.
+    """
+    lock = threading.Lock()
+    latencies, query_counts, errors = [], [], [0]
+    paths = iter(scenario.paths)
+
+    def worker():
+        connection = http.client.HTTPConnection(host, port)
+        while True:
+            with lock:
+                path = next(paths, None)
+            if path is None:
+                break
+            start = time.perf_counter()
+            connection.request('GET', path)
+            resp = connection.getresponse()
+            resp.read()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += resp.status >= 400
+                query_counts.append(_header_count(resp))
+        connection.close()
+
+    # one request per client thread first, so a preforked server has warmed
+    # up its workers too
+    for _ in range(concurrency):
+        warmup = http.client.HTTPConnection(host, port)
+        warmup.request('GET', scenario.paths[0])
+        warmup.getresponse().read()
+        warmup.close()
+    if query_log is not None:
+        del query_log.counts[:]
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for each in workers:
+        each.start()
+    for each in workers:
+        each.join()
+    if query_log is not None:
+        query_counts = list(query_log.counts)
+    return latencies, query_counts, errors[0], time.perf_counter() - started
+
+
+def run_wsgi(app, scenario, concurrency, query_log):
+    """Drive scenario through the threaded development server, in process."""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        return run_http('127.0.0.1', server.port, scenario, concurrency, query_log)
+    finally:
+        server.shutdown()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print p95 deltas against baseline; return the regressed scenario names."""
+    regressed = []
+    for key in ('dialect', 'mode', 'concurrency', 'dataset'):
+        if results['meta'][key] != baseline['meta'].get(key):
+            print(f"warning: {key} differs from the baseline", file=sys.stderr)
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or not previous['p95_ms']:
+            continue
+        change = current['p95_ms'] / previous['p95_ms'] - 1
+        flag = ''
+        if change > tolerance:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:12} p95 {previous['p95_ms']:9.2f}ms -> "
+              f"{current['p95_ms']:9.2f}ms ({change:+.1%}){flag}")
+    return regressed
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                        help='postgresql:///... or a sqlite:///... stand-in')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--tags-per-post', type=int, default=3)
+    parser.add_argument('--author-skew', type=float, default=1.1)
+    parser.add_argument('--tag-skew', type=float, default=1.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-load', action='store_true',
+                        help='reuse the dataset already in the database')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario')
+    parser.add_argument('--mode', choices=('client', 'wsgi', 'http'), default='client')
+    parser.add_argument('--url', default='http://127.0.0.1:8000',
+                        help='server to send requests to in http mode')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='client threads in wsgi and http modes')
+    parser.add_argument('--scenario', action='append',
+                        help='only run the named scenario(s)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', help='baseline JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 regression against --compare')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    # imported late: the app reads its database settings from the environment
+    from app import create_app
+    from bench.datagen import load_dataset
+    from cli import RateReporter
+    from models import db
+
+    app = create_app('bench')
+    app.app_context().push()
+    # the per-request SQL stats are collected, not printed
+    query_log = QueryLog()
+    sql_logger = logging.getLogger('blogly.sql')
+    sql_logger.setLevel(logging.INFO)
+    sql_logger.propagate = False
+    sql_logger.addHandler(query_log)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    spec = DatasetSpec(
+        users=args.users, posts=args.posts, tags=args.tags,
+        tags_per_post=args.tags_per_post, author_skew=args.author_skew,
+        tag_skew=args.tag_skew, seed=args.seed
+    )
+    dialect = db.engine.dialect.name
+    load_seconds = None
+    if not args.skip_load:
+        started = time.perf_counter()
+        load_dataset(spec, reporter=RateReporter('load'))
+        load_seconds = round(time.perf_counter() - started, 2)
+        print(f"loaded {spec!r} in {load_seconds}s", file=sys.stderr)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'dialect': dialect,
+            'mode': args.mode,
+            'concurrency': args.concurrency if args.mode != 'client' else 1,
+            'requests_per_scenario': args.requests,
+            'dataset': spec.as_dict(),
+            'load_seconds': load_seconds,
+        },
+        'scenarios': {},
+    }
+    budgets = app.config['SQL_QUERY_BUDGETS']
+    for scenario in build_scenarios(spec, args.requests):
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+        if scenario.postgres_only and dialect != 'postgresql':
+            continue
+        if args.mode == 'http':
+            url = urlsplit(args.url)
+            measured = run_http(url.hostname, url.port or 80, scenario, args.concurrency)
+        elif args.mode == 'wsgi':
+            measured = run_wsgi(app, scenario, args.concurrency, query_log)
+        else:
+            measured = run_client(app, scenario, query_log)
+        summary = summarize(*measured, budgets.get(scenario.endpoint))
+        results['scenarios'][scenario.name] = summary
+        print(f"{scenario.name:12} {summary['rps']:>9} req/s  p50 {summary['p50_ms']:8.2f}ms  "
+              f"p95 {summary['p95_ms']:8.2f}ms  queries {summary['max_queries']}"
+              f"{'  OVER BUDGET' if summary['over_budget'] else ''}")
+        if summary['unmeasured_queries']:
+            print(f"{'':12} {summary['unmeasured_queries']} streamed responses carried no "
+                  "X-DB-Query-Count header; their queries are not checked against the budget")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = [name for name, summary in results['scenarios'].items() if summary['over_budget']]
+    if args.compare:
+        with open(args.compare) as f:
+            failed += compare(results, json.load(f), args.tolerance)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
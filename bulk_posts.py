@@ -0,0 +1,103 @@
+"""
+Bulk post creation for integrations: many posts, with tag names, in a fixed
+number of statements instead of a unit of work per post.
+"""
+import datetime
+
+from sqlalchemy.dialects.postgresql import insert
+
+from associations import posts_tags
+from jobs import enqueue
+from models import Post, Tag, User, db
+
+posts = Post.__table__
+tags = Tag.__table__
+
+TITLE_LENGTH = posts.c.title.type.length
+TAG_NAME_LENGTH = tags.c.name.type.length
+
+
+class InvalidPosts(Exception):
+    """A post of the batch is malformed or names an unknown user."""
+
+
+def _clean(index, item):
+    """Check one post of the batch; return (row, tag names)."""
+    if not isinstance(item, dict):
+        raise InvalidPosts(f"data[{index}]: expected an object")
+    unknown = set(item) - {'title', 'content', 'user_id', 'tags'}
+    if unknown:
+        raise InvalidPosts(f"data[{index}]: unknown fields: {', '.join(sorted(unknown))}")
+    title, content, user_id = item.get('title'), item.get('content'), item.get('user_id')
+    if not isinstance(title, str) or not title.strip() or len(title) > TITLE_LENGTH:
+        raise InvalidPosts(f"data[{index}]: title must be 1 to {TITLE_LENGTH} characters")
+    if not isinstance(content, str):
+        raise InvalidPosts(f"data[{index}]: content is required")
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        raise InvalidPosts(f"data[{index}]: user_id must be an integer")
+    names = item.get('tags') or []
+    if not isinstance(names, list) or not all(
+        isinstance(name, str) and 0 < len(name) <= TAG_NAME_LENGTH for name in names
+    ):
+        raise InvalidPosts(
+            f"data[{index}]: tags must be a list of 1 to {TAG_NAME_LENGTH} character names"
+        )
+    return {'title': title, 'content': content, 'user_id': user_id}, sorted(set(names))
+
+
+def _tag_ids(names):
+    """Map tag names to ids, creating the missing tags."""
+    if not names:
+        return {}
+    # sorted, so concurrent batches lock new names in the same order
+    tag_ids = dict(db.session.execute(
+        insert(tags).values([{'name': name} for name in sorted(names)])
+        .on_conflict_do_nothing(index_elements=[tags.c.name])
+        .returning(tags.c.name, tags.c.id)
+    ).fetchall())
+    existing = names - set(tag_ids)
+    if existing:
+        tag_ids.update(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(existing)))
+    return tag_ids
+
+
+def create_posts(items):
+    """
+    Insert the posts described by items (dicts of title, content, user_id
+    and optional tag names) and their posts_tags links, creating missing
+    tags, and queue their related-posts refresh. Runs in the session
+    transaction (the caller commits). Returns the new posts as dicts, in
+    order of items.
+    """
+    cleaned = [_clean(index, item) for index, item in enumerate(items)]
+    user_ids = {row['user_id'] for row, names in cleaned}
+    found = {user_id for (user_id,) in db.session.query(User.id).filter(
+        User.id.in_(user_ids), User.deleted_at.is_(None)
+    )}
+    if user_ids - found:
+        raise InvalidPosts(
+            f"unknown users: {', '.join(map(str, sorted(user_ids - found)))}"
+        )
+
+    tag_ids = _tag_ids({name for row, names in cleaned for name in names})
+    created_at = datetime.datetime.utcnow()
+    # a multi-row INSERT returns the ids in the order of its rows
+    post_ids = [post_id for (post_id,) in db.session.execute(
+        posts.insert().values([
+            {**row, 'created_at': created_at} for row, names in cleaned
+        ]).returning(posts.c.id)
+    )]
+    links = [
+        {'post_id': post_id, 'tag_id': tag_ids[name]}
+        for post_id, (row, names) in zip(post_ids, cleaned) for name in names
+    ]
+    if links:
+        db.session.execute(insert(posts_tags).values(links))
+        enqueue('refresh_related_posts', {
+            'post_ids': sorted({link['post_id'] for link in links})
+        })
+    return [
+        {'id': post_id, **row, 'created_at': created_at.isoformat(),
+         'tags': [{'id': tag_ids[name], 'name': name} for name in names]}
+        for post_id, (row, names) in zip(post_ids, cleaned)
+    ]
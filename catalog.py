@@ -0,0 +1,132 @@
+"""Lightweight lookups: the tag catalog, the post picker and the user directory."""
+import collections
+
+from flask import current_app
+from sqlalchemy import exists, func
+
+from http_cache import table_versions
+from models import TAG_CATALOG_VERSION, Post, PostTag, Tag, User, db
+from pagination import keyset_paginate
+
+TagEntry = collections.namedtuple('TagEntry', 'id name')
+
+
+class TagCatalog:
+    """
+    (id, name) of every tag sorted by name, kept in process memory.
+
+    Each lookup reads the tag_catalog version, which triggers move whenever
+    a tag is created, renamed or deleted in any process, and only reloads
+    the catalog when it moved. Without the counter (SQLite) every
+    lookup loads the tags.
+    """
+
+    def __init__(self):
+        # (version, tags), replaced as a whole so readers need no lock
+        self._state = (None, ())
+
+    def __repr__(self):
+        version, tags = self._state
+        return f"<TagCatalog: version={version} tags={len(tags)}>"
+
+    def tags(self):
+        """Return the catalog as a tuple of TagEntry."""
+        versions = table_versions((TAG_CATALOG_VERSION,))
+        version = versions and versions[TAG_CATALOG_VERSION]
+        cached_version, tags = self._state
+        if version is None or version != cached_version:
+            tags = tuple(
+                TagEntry(*row) for row in
+                db.session.query(Tag.id, Tag.name).order_by(Tag.name)
+            )
+            self._state = (version, tags)
+        return tags
+
+    def clear(self):
+        self._state = (None, ())
+
+
+tag_catalog = TagCatalog()
+
+
+def title_key():
+    """
+    lower(title) as sorted and prefix-matched by the post picker; on
+    PostgreSQL it is compared byte-wise to use ix_posts_title_key.
+    """
+    key = func.lower(Post.title, type_=Post.title.type)
+    if db.engine.dialect.name == 'postgresql':
+        key = key.collate('C')
+    return key.label('title_key')
+
+
+def post_picker(prefix='', after=None, limit=None, exclude_tag_id=None, tag_id=None):
+    """
+    Return a keyset Page of (id, title, title_key) rows of posts whose title
+    starts with prefix (case-insensitively), by title; after is the
+    next_cursor of the previous page. Only the two columns are read, so a
+    page costs one index range scan however many posts there are.
+    exclude_tag_id leaves out the posts already tagged with it; tag_id
+    keeps only those.
+
+    Raises pagination.InvalidCursor for a malformed after.
+    """
+    key = title_key()
+    query = db.session.query(Post.id, Post.title, key)
+    prefix = prefix.strip().lower()
+    if prefix:
+        query = query.filter(key.element.startswith(prefix, autoescape=True))
+    if exclude_tag_id is not None:
+        query = query.filter(~exists().where(
+            (PostTag.post_id == Post.id) & (PostTag.tag_id == exclude_tag_id)
+        ))
+    if tag_id is not None:
+        query = query.filter(exists().where(
+            (PostTag.post_id == Post.id) & (PostTag.tag_id == tag_id)
+        ))
+    return keyset_paginate(
+        query, (key, Post.id), cursor=after,
+        limit=limit or current_app.config['POST_PICKER_PAGE_SIZE']
+    )
+
+
+def name_keys():
+    """
+    lower(last_name) and lower(first_name) as prefix-matched and sorted by
+    the user directory; on PostgreSQL they are compared byte-wise to use
+    ix_users_name_key.
+    """
+    keys = []
+    for column in (User.last_name, User.first_name):
+        key = func.lower(column, type_=column.type)
+        if db.engine.dialect.name == 'postgresql':
+            key = key.collate('C')
+        keys.append(key.label(f"{column.key}_key"))
+    return keys
+
+
+def user_directory(prefix='', after=None, limit=None):
+    """
+    Return a keyset Page of (id, first_name, last_name) rows of the users
+    not pending deletion, by last and first name (ix_users_name); with
+    prefix, only those whose last name starts with it (case-insensitively),
+    by the same names lower-cased (ix_users_name_key). after is the
+    next_cursor of the previous page.
+
+    Raises pagination.InvalidCursor for a malformed after.
+    """
+    query = db.session.query(User.id, User.first_name, User.last_name).filter(
+        User.deleted_at.is_(None)
+    )
+    prefix = prefix.strip().lower()
+    if prefix:
+        last_key, first_key = name_keys()
+        query = query.add_columns(last_key, first_key).filter(
+            last_key.element.startswith(prefix, autoescape=True)
+        )
+        columns = (last_key, first_key, User.id)
+    else:
+        columns = (User.last_name, User.first_name, User.id)
+    return keyset_paginate(
+        query, columns, cursor=after, limit=limit or current_app.config['USERS_PER_PAGE']
+    )
@@ -0,0 +1,583 @@
+"""Flask CLI commands for Blogly: `flask blogly ...`."""
+import csv
+import datetime
+import io
+import itertools
+import json
+import multiprocessing
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+import jobs
+from http_cache import compact_table_changes
+from idempotency import purge_expired
+from models import SCHEMA_DDL, Post, PostTag, Tag, User, UserPostSummary, db
+from related import rank_common_tags, refresh_related_posts
+from startup import profile_startup
+
+blogly_cli = AppGroup('blogly', help='Blogly maintenance commands.')
+
+# importable tables and the columns each record may carry
+TABLES = {
+    'users': (User.__table__, ('id', 'first_name', 'last_name', 'image_url')),
+    'tags': (Tag.__table__, ('id', 'name')),
+    'posts': (Post.__table__, ('id', 'title', 'content', 'created_at', 'user_id')),
+}
+FORMATS = ('ndjson', 'csv')
+# separator for the tag names of a post in CSV files
+CSV_TAG_SEPARATOR = '|'
+COPY_NULL = r'\N'
+# TOAST compression methods of PostgreSQL 14+
+CONTENT_COMPRESSION = ('pglz', 'lz4')
+# fill the columns an upgrade adds from the existing data (the triggers
+# keep them up to date from then on)
+COLUMN_BACKFILLS = {
+    ('posts', 'author_name'): """
+        UPDATE posts AS p SET author_name = u.first_name || ' ' || u.last_name
+        FROM users AS u WHERE u.id = p.user_id
+    """,
+    ('tags', 'post_count'): """
+        UPDATE tags SET post_count = c.n
+        FROM (SELECT tag_id, count(*) AS n FROM posts_tags GROUP BY tag_id) AS c
+        WHERE tags.id = c.tag_id
+    """,
+}
+
+
+def _chunks(iterable, size):
+    """Yield lists of at most size items without materializing iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _read_records(stream, fmt):
+    """Yield one dict per NDJSON line / CSV row of stream."""
+    if fmt == 'ndjson':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        for row in csv.DictReader(stream):
+            record = {key: (value if value != '' else None) for key, value in row.items()}
+            if 'tags' in record:
+                record['tags'] = (
+                    record['tags'].split(CSV_TAG_SEPARATOR) if record['tags'] else []
+                )
+            yield record
+
+
+def _clean(record, columns):
+    """
+    Keep the known columns of record, parse timestamps and fill the column
+    defaults the ORM would normally supply (COPY bypasses them).
+    """
+    row = {column: record.get(column) for column in columns if column in record}
+    if 'created_at' in columns:
+        if isinstance(row.get('created_at'), str):
+            row['created_at'] = datetime.datetime.fromisoformat(row['created_at'])
+        row['created_at'] = row.get('created_at') or datetime.datetime.utcnow()
+        row['title'] = row.get('title') or Post.title.default.arg
+    if 'id' in row and row['id'] is not None:
+        row['id'] = int(row['id'])
+    return row
+
+
+class RateReporter:
+    """Print running rows/sec for a long import or export to stderr."""
+
+    def __init__(self, label, every=5.0):
+        self.label = label
+        self.every = every
+        self.rows = 0
+        self.started = self.last_report = time.perf_counter()
+
+    def add(self, count):
+        self.rows += count
+        now = time.perf_counter()
+        if now - self.last_report >= self.every:
+            self.last_report = now
+            click.echo(self.summary(), err=True)
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (f"{self.label}: {self.rows} rows in {elapsed:.1f}s "
+                f"({self.rows / elapsed:.0f} rows/sec)")
+
+
+def _is_postgres(connection):
+    return connection.dialect.name == 'postgresql'
+
+
+def _copy_rows(connection, table, columns, rows):
+    """
+    Load rows into table with a single PostgreSQL COPY ... FROM STDIN.
+
+    Every value is quoted, so None is written as the COPY_NULL marker and
+    matched with FORCE_NULL to keep it apart from the empty string.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for row in rows:
+        writer.writerow([
+            COPY_NULL if value is None else
+            value.isoformat() if isinstance(value, datetime.datetime) else value
+            for value in (row.get(column) for column in columns)
+        ])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    column_list = ', '.join(columns)
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({column_list}) FROM STDIN WITH "
+            f"(FORMAT csv, NULL '{COPY_NULL}', FORCE_NULL ({column_list}))",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_rows(connection, table, rows, returning=False):
+    """
+    Insert rows into table in one multi-row INSERT (or executemany where the
+    dialect lacks RETURNING); return the new ids in order when returning.
+    """
+    if not rows:
+        return []
+    columns = sorted({column for row in rows for column in row})
+    rows = [{column: row.get(column) for column in columns} for row in rows]
+    if not returning:
+        connection.execute(table.insert(), rows)
+        return []
+    if _is_postgres(connection):
+        result = connection.execute(table.insert().values(rows).returning(table.c.id))
+        return [row_id for (row_id,) in result]
+    return [connection.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+def _load_rows(connection, table, columns, rows, returning=False):
+    """
+    Load rows into table: COPY on PostgreSQL when every row carries an
+    explicit id, otherwise batch-insert them. Returns the ids when returning.
+    """
+    if rows and all(row.get('id') for row in rows):
+        if _is_postgres(connection):
+            present = [column for column in columns if any(column in row for row in rows)]
+            _copy_rows(connection, table, present, rows)
+        else:
+            _insert_rows(connection, table, rows)
+        return [row['id'] for row in rows]
+    return _insert_rows(connection, table, rows, returning=returning)
+
+
+def _resolve_tag_ids(connection, tag_ids, names):
+    """
+    Map tag names to ids through the in-memory tag_ids dict, creating any
+    tags that do not exist yet in one batch.
+    """
+    missing = sorted({name for name in names if name not in tag_ids})
+    if missing:
+        new_ids = _insert_rows(
+            connection, Tag.__table__, [{'name': name} for name in missing],
+            returning=True
+        )
+        tag_ids.update(zip(missing, new_ids))
+    return [tag_ids[name] for name in names]
+
+
+def _reset_sequence(connection, table):
+    """Move the id sequence past explicitly imported ids (PostgreSQL only)."""
+    if _is_postgres(connection):
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table.name}), 1))"
+        ))
+
+
+def import_records(table_name, records, chunk_size=5000, reporter=None):
+    """
+    Import an iterable of record dicts into table_name, chunk_size rows per
+    transaction. Posts may carry a list of tag names under 'tags'; their
+    posts_tags links are loaded in the same chunk. Returns the row count.
+    """
+    table, columns = TABLES[table_name]
+    engine = db.engine
+    tag_ids = {}
+    if table_name == 'posts':
+        with engine.connect() as connection:
+            tag_ids = dict(connection.execute(select([Tag.name, Tag.id])).fetchall())
+
+    total = 0
+    for chunk in _chunks(records, chunk_size):
+        rows = [_clean(record, columns) for record in chunk]
+        with engine.begin() as connection:
+            ids = _load_rows(
+                connection, table, columns, rows,
+                returning=table_name == 'posts'
+            )
+            if table_name == 'posts':
+                _resolve_tag_ids(connection, tag_ids, [
+                    name for record in chunk for name in record.get('tags') or []
+                ])
+                links = [
+                    {'post_id': post_id, 'tag_id': tag_id}
+                    for post_id, record in zip(ids, chunk)
+                    for tag_id in {tag_ids[name] for name in record.get('tags') or []}
+                ]
+                if links and _is_postgres(connection):
+                    _copy_rows(connection, PostTag.__table__, ('post_id', 'tag_id'), links)
+                else:
+                    _insert_rows(connection, PostTag.__table__, links)
+        total += len(rows)
+        if reporter:
+            reporter.add(len(rows))
+
+    with engine.begin() as connection:
+        _reset_sequence(connection, table)
+        if table_name == 'posts':
+            _reset_sequence(connection, Tag.__table__)
+    return total
+
+
+def _export_query(table_name, dialect):
+    table, columns = TABLES[table_name]
+    query = select([table.c[column] for column in columns])
+    if table_name == 'posts':
+        if dialect == 'postgresql':
+            names = func.array_remove(func.array_agg(Tag.name), None)
+        else:
+            names = func.group_concat(Tag.name, CSV_TAG_SEPARATOR)
+        query = select([table.c[column] for column in columns] + [names.label('tags')]) \
+            .select_from(
+                table.outerjoin(PostTag.__table__).outerjoin(Tag.__table__)
+            ).group_by(table.c.id)
+    return query.order_by(table.c.id)
+
+
+def export_records(table_name, chunk_size=5000):
+    """
+    Yield table_name as record dicts, streamed through a server-side cursor
+    chunk_size rows at a time.
+    """
+    engine = db.engine
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            _export_query(table_name, engine.dialect.name)
+        )
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                record = dict(row)
+                if isinstance(record.get('tags'), str):
+                    record['tags'] = record['tags'].split(CSV_TAG_SEPARATOR)
+                yield record
+
+
+def _write_records(records, stream, fmt, columns):
+    if fmt == 'ndjson':
+        for record in records:
+            stream.write(json.dumps(record, default=_json_default) + '\n')
+            yield
+    else:
+        writer = csv.DictWriter(stream, fieldnames=columns)
+        writer.writeheader()
+        for record in records:
+            if 'tags' in record:
+                record['tags'] = CSV_TAG_SEPARATOR.join(record['tags'] or [])
+            writer.writerow(record)
+            yield
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+@blogly_cli.command('import')
+@click.argument('table_name', type=click.Choice(sorted(TABLES)))
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='ndjson')
+@click.option('--chunk-size', default=5000, show_default=True,
+              help='Rows per COPY/INSERT batch and transaction.')
+def import_command(table_name, source, fmt, chunk_size):
+    """Stream SOURCE (NDJSON or CSV) into TABLE_NAME in chunks."""
+    reporter = RateReporter(f"import {table_name}")
+    import_records(table_name, _read_records(source, fmt), chunk_size, reporter)
+    click.echo(reporter.summary(), err=True)
+
+
+@blogly_cli.command('export')
+@click.argument('table_name', type=click.Choice(sorted(TABLES)))
+@click.argument('target', type=click.File('w'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='ndjson')
+@click.option('--chunk-size', default=5000, show_default=True,
+              help='Rows fetched per round-trip from the server-side cursor.')
+def export_command(table_name, target, fmt, chunk_size):
+    """Stream TABLE_NAME to TARGET (NDJSON or CSV) from a server-side cursor."""
+    columns = list(TABLES[table_name][1]) + (['tags'] if table_name == 'posts' else [])
+    reporter = RateReporter(f"export {table_name}")
+    for _ in _write_records(export_records(table_name, chunk_size), target, fmt, columns):
+        reporter.add(1)
+    click.echo(reporter.summary(), err=True)
+
+
+def reconcile_tag_counts():
+    """
+    Rebuild tags.post_count from posts_tags in one aggregate UPDATE and
+    return the number of tags whose count was wrong.
+    """
+    tags = Tag.__table__
+    posts_tags = PostTag.__table__
+    with db.engine.begin() as connection:
+        if _is_postgres(connection):
+            actual = select([
+                tags.c.id, func.count(posts_tags.c.tag_id).label('post_count')
+            ]).select_from(tags.outerjoin(posts_tags)).group_by(tags.c.id).alias('actual')
+            update = tags.update() \
+                .where(tags.c.id == actual.c.id) \
+                .where(tags.c.post_count != actual.c.post_count) \
+                .values(post_count=actual.c.post_count)
+        else:
+            # no UPDATE ... FROM: fall back to a correlated count
+            actual = select([func.count()]).where(
+                posts_tags.c.tag_id == tags.c.id
+            ).as_scalar()
+            update = tags.update().where(tags.c.post_count != actual).values(post_count=actual)
+        return connection.execute(update).rowcount
+
+
+@blogly_cli.command('reconcile-tag-counts')
+def reconcile_tag_counts_command():
+    """Recompute every tag's denormalized post count."""
+    click.echo(f"corrected {reconcile_tag_counts()} tag counts")
+
+
+def rebuild_post_summaries(chunk_size=5000):
+    """
+    Rebuild user_post_summaries from posts, posts_tags and tags (e.g. after
+    adding the table to an existing database); returns the row count.
+    """
+    summaries = UserPostSummary.__table__
+    with db.engine.begin() as connection:
+        connection.execute(summaries.delete())
+        if _is_postgres(connection):
+            return connection.execute(text("""
+                INSERT INTO user_post_summaries (post_id, user_id, created_at, title, tag_names)
+                SELECT p.id, p.user_id, p.created_at, p.title,
+                       coalesce(array_agg(t.name ORDER BY t.name)
+                                FILTER (WHERE t.name IS NOT NULL), '{}')
+                FROM posts AS p
+                LEFT JOIN posts_tags AS pt ON pt.post_id = p.id
+                LEFT JOIN tags AS t ON t.id = pt.tag_id
+                GROUP BY p.id
+            """)).rowcount
+        # elsewhere: group the joined rows in Python
+        rows = connection.execution_options(stream_results=True).execute(
+            select([Post.id, Post.user_id, Post.created_at, Post.title, Tag.name])
+            .select_from(Post.__table__.outerjoin(PostTag.__table__).outerjoin(Tag.__table__))
+            .order_by(Post.id, Tag.name)
+        )
+        grouped = (
+            {'post_id': post_id, 'user_id': user_id, 'created_at': created_at,
+             'title': title, 'tag_names': [row.name for row in group if row.name]}
+            for (post_id, user_id, created_at, title), group in itertools.groupby(
+                rows, key=lambda row: tuple(row)[:4]
+            )
+        )
+        count = 0
+        for chunk in _chunks(grouped, chunk_size):
+            connection.execute(summaries.insert(), chunk)
+            count += len(chunk)
+        return count
+
+
+@blogly_cli.command('rebuild-post-summaries')
+def rebuild_post_summaries_command():
+    """Recompute the per-user post listing read model."""
+    click.echo(f"wrote {rebuild_post_summaries()} post summaries")
+
+
+def rebuild_related_posts(chunk_size=1000):
+    """
+    Rank the common tags, then recompute the related posts of every post,
+    committing chunk_size posts at a time so readers keep seeing complete
+    lists; returns the row count.
+    """
+    rank_common_tags()
+    db.session.commit()
+    post_ids = [post_id for (post_id,) in db.session.query(Post.id).order_by(Post.id)]
+    count = 0
+    for chunk in _chunks(post_ids, chunk_size):
+        count += refresh_related_posts(chunk)
+        db.session.commit()
+    return count
+
+
+@blogly_cli.command('rebuild-related-posts')
+@click.option('--chunk-size', default=1000, show_default=True, help='Posts per transaction.')
+def rebuild_related_posts_command(chunk_size):
+    """Recompute every post's related posts (run periodically)."""
+    start = time.perf_counter()
+    count = rebuild_related_posts(chunk_size)
+    click.echo(f"wrote {count} related posts in {time.perf_counter() - start:.1f}s")
+
+
+@blogly_cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Forget Idempotency-Keys older than IDEMPOTENCY_KEY_TTL (run periodically)."""
+    click.echo(f"purged {purge_expired()} idempotency keys")
+
+
+@blogly_cli.command('compact-table-changes')
+def compact_table_changes_command():
+    """Fold the change rows behind the page ETags (run periodically)."""
+    click.echo(f"compacted {compact_table_changes()} table change rows")
+
+
+def _worker_process(app, burst, poll_interval):
+    with app.app_context():
+        # never share the parent's pooled connections across processes
+        db.engine.dispose()
+        jobs.work(burst=burst, poll_interval=poll_interval)
+
+
+@blogly_cli.command('worker')
+@click.option('--processes', default=1, show_default=True,
+              help='Worker processes sharing the queue.')
+@click.option('--burst', is_flag=True, help='Exit once no job is runnable.')
+@click.option('--poll-interval', default=1.0, show_default=True,
+              help='Seconds to wait when the queue is empty.')
+def worker_command(processes, burst, poll_interval):
+    """Run background jobs from the jobs table."""
+    if processes == 1:
+        count = jobs.work(burst=burst, poll_interval=poll_interval)
+        click.echo(f"ran {count} jobs", err=True)
+        return
+    app = current_app._get_current_object()
+    children = [
+        multiprocessing.Process(target=_worker_process, args=(app, burst, poll_interval))
+        for _ in range(processes)
+    ]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+
+
+def set_content_compression(method):
+    """
+    Make PostgreSQL compress post bodies with method ('pglz', or 'lz4' when
+    the server is built with it). Bodies are compressed once a row passes
+    about 2kB; existing bodies keep their method until they are rewritten.
+    """
+    db.session.execute(text(
+        f"ALTER TABLE posts ALTER COLUMN content SET COMPRESSION {method}"
+    ))
+    db.session.commit()
+
+
+def upgrade_schema():
+    """
+    Create the missing tables and bring the existing ones up to date. On
+    PostgreSQL that means adding the columns and indexes of the models they
+    lack and replaying models.SCHEMA_DDL (triggers, expression indexes...),
+    which create_all skips for existing tables. Then the new columns
+    (COLUMN_BACKFILLS) and read models are filled from the existing data.
+    Every step is idempotent.
+    """
+    existing = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    if db.engine.dialect.name != 'postgresql':
+        return
+    columns = {tuple(row) for row in db.session.execute(text(
+        "SELECT table_name, column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema()"
+    ))}
+    indexes = {name for (name,) in db.session.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()"
+    ))}
+    added = set()
+    for table in db.metadata.sorted_tables:
+        for column in table.columns:
+            if (table.name, column.name) not in columns:
+                spec = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {spec}"
+                ))
+                added.add((table.name, column.name))
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(db.session.connection())
+    for table, ddl in SCHEMA_DDL:
+        db.session.execute(ddl.against(table))
+    for column in sorted(added & COLUMN_BACKFILLS.keys()):
+        db.session.execute(text(COLUMN_BACKFILLS[column]))
+    db.session.commit()
+    if 'posts' in existing:
+        if 'user_post_summaries' not in existing:
+            rebuild_post_summaries()
+        if 'related_posts' not in existing:
+            rebuild_related_posts()
+        elif 'related_leaders' not in existing:
+            rank_common_tags()
+            db.session.commit()
+
+
+@blogly_cli.command('migrate')
+@click.option('--reset', is_flag=True, help='Drop all tables first (destroys data).')
+@click.option('--content-compression', type=click.Choice(CONTENT_COMPRESSION),
+              help='PostgreSQL compression method of post bodies.')
+def migrate_command(reset, content_compression):
+    """Create the missing tables, indexes and triggers, and upgrade the rest."""
+    if reset:
+        db.drop_all()
+    upgrade_schema()
+    if content_compression:
+        if db.engine.dialect.name != 'postgresql':
+            raise click.UsageError('--content-compression needs PostgreSQL')
+        set_content_compression(content_compression)
+    click.echo(f"schema ready on {db.engine.url!r}", err=True)
+
+
+@blogly_cli.command('seed')
+def seed_command():
+    """Recreate the schema with the sample users, posts and tags."""
+    from seed import seed
+    db.drop_all()
+    db.create_all()
+    seed()
+
+
+@blogly_cli.command('profile-startup')
+@click.option('--profile', default='production', show_default=True)
+@click.option('--top', default=15, show_default=True, help='Slowest imports to list.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the full report as JSON.')
+def profile_startup_command(profile, top, as_json):
+    """Measure a cold start: imports and create_app in a fresh interpreter."""
+    report = profile_startup(profile)
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    click.echo(f"import app:   {report['import_seconds'] * 1000:8.1f} ms")
+    click.echo(f"create_app(): {report['create_app']['total_seconds'] * 1000:8.1f} ms")
+    for name, seconds in report['create_app']['phases'].items():
+        click.echo(f"  {name:16} {seconds * 1000:8.1f} ms")
+    # depth 1: the modules app.py (and startup.py) import directly
+    click.echo("slowest direct imports (cumulative):")
+    direct = sorted(
+        (imported for imported in report['imports'] if imported[3] == 1),
+        key=lambda imported: imported[2], reverse=True
+    )
+    for module, _, cumulative, _ in direct[:top]:
+        click.echo(f"  {module:32} {cumulative * 1000:8.1f} ms")
@@ -0,0 +1,108 @@
+"""Environment-driven database configuration for Blogly."""
+import os
+
+from pool_metrics import InstrumentedQueuePool
+
+DEFAULT_DATABASE_URL = 'postgres:///blogly'
+DEFAULT_TEST_DATABASE_URL = 'postgresql:///blogly_test'
+PROFILES = ('production', 'dev', 'test', 'bench')
+
+
+def _env_int(environ, name, default):
+    value = environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_bool(environ, name, default):
+    value = environ.get(name)
+    if value in (None, ''):
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_config(environ=os.environ):
+    """
+    Build the Flask-SQLAlchemy settings for the db object from environment
+    variables:
+
+        DATABASE_URL              primary database (default postgres:///blogly)
+        DATABASE_REPLICA_URLS     comma-separated read replicas (optional)
+        DB_POOL_SIZE              connections kept open per worker (default 5)
+        DB_MAX_OVERFLOW           extra connections allowed under load (default 10)
+        DB_POOL_TIMEOUT           seconds to wait for a free connection (default 30)
+        DB_POOL_RECYCLE           seconds before a connection is replaced (default 1800)
+        DB_POOL_PRE_PING          test connections on checkout (default true)
+        DB_STATEMENT_TIMEOUT_MS   PostgreSQL statement_timeout (default: none)
+        DB_REPLICA_STICKY_SECONDS keep a client on the primary after it writes (default 5)
+        SQLALCHEMY_ECHO           log every statement (default false)
+    """
+    uri = environ.get('DATABASE_URL') or DEFAULT_DATABASE_URL
+    replicas = [
+        url.strip() for url in environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if url.strip()
+    ]
+
+    engine_options = {'pool_pre_ping': _env_bool(environ, 'DB_POOL_PRE_PING', True)}
+    if not uri.startswith('sqlite'):
+        engine_options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=_env_int(environ, 'DB_POOL_SIZE', 5),
+            max_overflow=_env_int(environ, 'DB_MAX_OVERFLOW', 10),
+            pool_timeout=_env_int(environ, 'DB_POOL_TIMEOUT', 30),
+            pool_recycle=_env_int(environ, 'DB_POOL_RECYCLE', 1800),
+        )
+    statement_timeout = _env_int(environ, 'DB_STATEMENT_TIMEOUT_MS', None)
+    if statement_timeout and uri.startswith('postgres'):
+        engine_options['connect_args'] = {
+            'options': f"-c statement_timeout={statement_timeout}"
+        }
+
+    return {
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'SQLALCHEMY_BINDS': {
+            f"replica_{index}": url for index, url in enumerate(replicas)
+        },
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options,
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_ECHO': _env_bool(environ, 'SQLALCHEMY_ECHO', False),
+        'DB_REPLICA_STICKY_SECONDS': _env_int(environ, 'DB_REPLICA_STICKY_SECONDS', 5),
+    }
+
+
+def profile_config(profile, environ=os.environ):
+    """
+    Build the settings of an application profile:
+
+        production  DATABASE_URL etc.; SECRET_KEY must be set; templates
+                    are cached compiled in TEMPLATE_CACHE_DIR
+        dev         debug mode with the debug toolbar
+        test        TESTING against TEST_DATABASE_URL (default blogly_test),
+                    no replicas; query budgets are enforced
+        bench       production settings; SECRET_KEY is optional
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"unknown profile {profile!r}; expected one of {PROFILES}")
+    if profile == 'test':
+        environ = {
+            **environ,
+            'DATABASE_URL': environ.get('TEST_DATABASE_URL') or DEFAULT_TEST_DATABASE_URL,
+            'DATABASE_REPLICA_URLS': '',
+            'SQLALCHEMY_ECHO': '',
+        }
+    settings = database_config(environ)
+    settings.update(
+        BLOGLY_PROFILE=profile,
+        DEBUG=profile == 'dev',
+        TESTING=profile == 'test',
+        SECRET_KEY=environ.get('SECRET_KEY'),
+        # shared directory for multi-process metrics (see metrics.py)
+        METRICS_DIR=environ.get('METRICS_DIR') or None,
+        # compiled templates kept on disk across restarts (see templating.py)
+        TEMPLATE_BYTECODE_CACHE=profile in ('production', 'bench'),
+        TEMPLATE_CACHE_DIR=environ.get('TEMPLATE_CACHE_DIR') or None,
+    )
+    if not settings['SECRET_KEY']:
+        if profile == 'production':
+            raise RuntimeError("SECRET_KEY must be set for the production profile")
+        settings['SECRET_KEY'] = 'test'
+    return settings
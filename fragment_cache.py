@@ -0,0 +1,142 @@
+"""Rendered-fragment cache for post cards."""
+import collections
+import hashlib
+import threading
+
+from flask import render_template
+from markupsafe import Markup
+
+
+class LRUBackend:
+    """Bounded in-process least-recently-used cache."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<LRUBackend: size={len(self._data)} maxsize={self.maxsize}>"
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = self._data[key]
+        return found
+
+    def set_many(self, mapping):
+        with self._lock:
+            for key, value in mapping.items():
+                self._data[key] = value
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ClientBackend:
+    """
+    Shared backend wrapping a memcached/redis style client so every worker
+    sees the same fragments and invalidations. The client needs get(key) and
+    set(key, value); get_many/set_many are used when it provides them.
+    """
+
+    def __init__(self, client, prefix='blogly:', timeout=None):
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"<ClientBackend: client={self.client!r} prefix='{self.prefix}'>"
+
+    def get_many(self, keys):
+        prefixed = [self.prefix + key for key in keys]
+        if hasattr(self.client, 'get_many'):
+            values = self.client.get_many(prefixed)
+        else:
+            values = {key: self.client.get(key) for key in prefixed}
+        return {
+            key[len(self.prefix):]: value
+            for key, value in values.items() if value is not None
+        }
+
+    def set_many(self, mapping):
+        prefixed = {self.prefix + key: value for key, value in mapping.items()}
+        args = {} if self.timeout is None else {'timeout': self.timeout}
+        if hasattr(self.client, 'set_many'):
+            self.client.set_many(prefixed, **args)
+        else:
+            for key, value in prefixed.items():
+                self.client.set(key, value, **args)
+
+    def clear(self):
+        self.client.clear()
+
+
+def card_version(post):
+    """
+    Digest of everything a post card shows that can change: the post's
+    version (its title and excerpt), its author's name and its tags with
+    their versions (their names).
+    """
+    return hashlib.sha1(repr((
+        post.version, post.author_name,
+        [(tag.id, tag.version) for tag in post.tags],
+    )).encode()).hexdigest()
+
+
+class FragmentCache:
+    """
+    Cache rendered post card partials keyed by (template, post id,
+    card_version).
+
+    The version is computed from the rows the page loads anyway, so a card
+    changes key as soon as the change commits, in every process, whichever
+    process (or job worker) made it: nothing has to be invalidated. Stale
+    entries simply age out of the LRU.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_BACKEND', None)
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+        self.backend = (
+            app.config['FRAGMENT_CACHE_BACKEND']
+            or LRUBackend(app.config['FRAGMENT_CACHE_SIZE'])
+        )
+        app.extensions['fragment_cache'] = self
+
+    def render_posts(self, template_name, posts):
+        """
+        Return the rendered template_name partial for each post, in order,
+        rendering and storing only the cards missing from the cache. The
+        posts need their tags loaded.
+        """
+        keys = [
+            f"post-card:{template_name}:{post.id}:{card_version(post)}"
+            for post in posts
+        ]
+        cached = self.backend.get_many(keys)
+
+        rendered = {}
+        cards = []
+        for key, post in zip(keys, posts):
+            if key not in cached:
+                rendered[key] = render_template(template_name, post=post)
+            cards.append(Markup(cached.get(key) or rendered[key]))
+        if rendered:
+            self.backend.set_many(rendered)
+        return cards
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,25 @@
+"""gunicorn settings for Blogly (see serving.py)."""
+import os
+import tempfile
+
+from serving import dispose_engines, thread_count, worker_count
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = worker_count()
+threads = thread_count()
+worker_class = 'gthread'
+# build the app once in the master; workers share its memory copy-on-write
+preload_app = True
+keepalive = 5
+timeout = 30
+accesslog = '-'
+
+# every worker reports its request metrics to a shared directory, so any
+# of them can answer a /metrics scrape for all (see metrics.py)
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='blogly-metrics-'))
+
+
+def post_fork(server, worker):
+    # the master never serves requests, so this only drops connections the
+    # preload itself may have opened, which the worker must not share
+    dispose_engines(server.app.wsgi())
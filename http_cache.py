@@ -0,0 +1,102 @@
+"""HTTP validators (ETags) for read pages."""
+import functools
+import hashlib
+
+from flask import current_app, request, session
+from sqlalchemy import func, text
+from werkzeug.http import is_resource_modified
+
+from models import TableChange, db
+
+_COMPACT = text("""
+    WITH gone AS (DELETE FROM table_changes RETURNING name, changes)
+    INSERT INTO table_changes (name, changes)
+    SELECT name, sum(changes) FROM gone GROUP BY name
+""")
+
+
+def table_versions(tables):
+    """
+    Return {table: version} for tables in one query, or None when any of
+    them has no rows (the database does not track changes).
+    """
+    rows = db.session.query(
+        TableChange.name, func.sum(TableChange.changes)
+    ).filter(TableChange.name.in_(tables)).group_by(TableChange.name).all()
+    versions = {name: int(version) for name, version in rows}
+    return versions if len(versions) == len(tables) else None
+
+
+def compact_table_changes():
+    """
+    Fold the change rows of every table into one, keeping the versions;
+    returns the number of rows removed. Rows of transactions that have
+    not committed yet are left alone.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return 0
+    before = TableChange.query.count()
+    db.session.execute(_COMPACT)
+    db.session.commit()
+    return before - TableChange.query.count()
+
+
+def _etag(tables):
+    versions = table_versions(tables)
+    if versions is None:
+        return None
+    return hashlib.sha1(repr((
+        request.endpoint, sorted(request.view_args.items()),
+        sorted(request.args.items(multi=True)),
+        [versions[table] for table in tables],
+    )).encode()).hexdigest()
+
+
+def conditional(*tables):
+    """
+    Make a GET view answer If-None-Match with 304 before it runs, using the
+    versions of the tables its page is built from.
+
+    There is no Last-Modified: a change is only visible once its transaction
+    commits, which can be later than any timestamp it could record, so a
+    date comparison could call a changed page unmodified.
+
+    Full responses carry the ETag and a Cache-Control header
+    that lets shared caches keep the page for HTTP_CACHE_S_MAXAGE seconds
+    while browsers revalidate every time. Pages that will show a flashed
+    message are personal, so they are sent uncached and without validators.
+    """
+    tables = tuple(sorted(tables))
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # 'in' does not mark the session accessed, so no Vary: Cookie
+            if '_flashes' in session:
+                response = current_app.make_response(view(*args, **kwargs))
+                response.cache_control.private = True
+                response.cache_control.no_store = True
+                return response
+
+            etag = _etag(tables)
+            if etag is None:
+                return view(*args, **kwargs)
+            if not is_resource_modified(request.environ, etag=etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config['HTTP_CACHE_MAX_AGE']
+            response.cache_control.s_maxage = current_app.config['HTTP_CACHE_S_MAXAGE']
+            return response
+        return wrapper
+    return decorator
+
+
+def init_http_cache(app):
+    """Set the Cache-Control defaults used by conditional views."""
+    app.config.setdefault('HTTP_CACHE_MAX_AGE', 0)
+    app.config.setdefault('HTTP_CACHE_S_MAXAGE', 30)
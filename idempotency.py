@@ -0,0 +1,65 @@
+"""
+Idempotency keys: a client that may retry a write (after a timeout, say)
+sends an Idempotency-Key header, and a retry with the same key gets the
+first response back instead of writing again.
+
+The key is claimed with an INSERT ... ON CONFLICT DO NOTHING in the
+transaction of the write and given its response before the commit. A
+concurrent retry waits on the claim until that transaction ends, then
+either finds the stored response or, if the first attempt rolled back,
+claims the key itself. Keys older than IDEMPOTENCY_KEY_TTL seconds are
+removed by `flask blogly purge-idempotency-keys`.
+"""
+import datetime
+import hashlib
+
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+
+from models import IdempotencyKey, db
+
+idempotency_keys = IdempotencyKey.__table__
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used with a different request body."""
+
+
+def claim(scope, key, body):
+    """
+    Claim key for a request with body (bytes) in the current transaction.
+    Returns None when claimed (the caller does the work, then calls save),
+    or the IdempotencyKey holding the response of the earlier request.
+    """
+    request_hash = hashlib.sha256(body).hexdigest()
+    claimed = db.session.execute(
+        insert(idempotency_keys).values(
+            scope=scope, key=key, request_hash=request_hash,
+            created_at=datetime.datetime.utcnow()
+        ).on_conflict_do_nothing().returning(idempotency_keys.c.key)
+    ).first()
+    if claimed is not None:
+        return None
+    stored = IdempotencyKey.query.get((scope, key))
+    if stored.request_hash != request_hash:
+        raise IdempotencyKeyReused(f"Idempotency-Key {key!r} was used for another request")
+    return stored
+
+
+def save(scope, key, status_code, response):
+    """Store the response to the request that claimed key (the caller commits)."""
+    db.session.execute(idempotency_keys.update().where(
+        (idempotency_keys.c.scope == scope) & (idempotency_keys.c.key == key)
+    ).values(status_code=status_code, response=response))
+
+
+def purge_expired():
+    """Delete the keys older than IDEMPOTENCY_KEY_TTL; return how many."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=current_app.config['IDEMPOTENCY_KEY_TTL']
+    )
+    count = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    return count
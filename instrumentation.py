@@ -0,0 +1,178 @@
+"""Per-request SQL instrumentation: query counts, DB time and N+1 detection."""
+import collections
+import json
+import logging
+import re
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from streaming import on_stream_end
+
+logger = logging.getLogger('blogly.sql')
+
+# bound parameters (psycopg2 and qmark styles) and inline literals
+_PARAM_RE = re.compile(r"%\(\w+\)s|\?|'(?:[^']|'')*'|\b\d+\b")
+# expanded IN lists: (?, ?, ?) -> (?...)
+_PARAM_LIST_RE = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when an endpoint issues more queries than its configured budget."""
+
+
+def statement_shape(statement):
+    """
+    Normalize a SQL statement so that executions differing only in their
+    parameters (e.g. one lazy load per row) share the same shape.
+    """
+    shape = _PARAM_RE.sub('?', statement)
+    shape = _PARAM_LIST_RE.sub('?...', shape)
+    return _WHITESPACE_RE.sub(' ', shape).strip()
+
+
+class QueryStats:
+    """Statements executed while serving a single request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = collections.Counter()
+
+    def __repr__(self):
+        return (f"<QueryStats: count={self.count} "
+                f"duration={self.duration * 1000:.2f}ms "
+                f"repeated={len(self.repeated())}>")
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold=2):
+        """
+        Return {shape: count} for every statement shape executed at least
+        threshold times; these are the usual signature of an N+1 fan-out.
+        """
+        return {
+            shape: count for shape, count in self.shapes.items()
+            if count >= threshold
+        }
+
+
+def current_query_stats():
+    """Return the QueryStats of the active request, or None outside one."""
+    if has_request_context():
+        return g.get('query_stats')
+    return None
+
+
+# start times are keyed by statement (its execution context, else its
+# cursor), so one that raises cannot lend its start to the next statement
+# run on the pooled connection; handle_error drops it
+def _statement_key(cursor, context):
+    return id(context) if context is not None else id(cursor)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', {})[_statement_key(cursor, context)] = \
+        time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start_time'].pop(_statement_key(cursor, context))
+    stats = current_query_stats()
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - start)
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None:
+        connection.info.get('query_start_time', {}).pop(_statement_key(
+            exception_context.cursor, exception_context.execution_context
+        ), None)
+
+
+def _install_engine_listeners():
+    # listening on the Engine class covers every engine the db object creates
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+def init_query_stats(app):
+    """
+    Count statements, DB time and repeated statement shapes for every request.
+
+    Results are reported in X-DB-* response headers and one structured log
+    line per request on the 'blogly.sql' logger. SQL_QUERY_BUDGETS maps
+    endpoint names to the maximum number of queries they may issue (with
+    SQL_QUERY_BUDGET_DEFAULT for the rest); when SQL_QUERY_BUDGET_STRICT is
+    set (defaults to app.testing) exceeding a budget raises
+    QueryBudgetExceeded, otherwise it is logged as a warning. Streamed
+    responses get no headers: they are logged and checked once sent.
+    """
+    app.config.setdefault('SQL_QUERY_BUDGETS', {})
+    app.config.setdefault('SQL_QUERY_BUDGET_DEFAULT', None)
+    app.config.setdefault('SQL_QUERY_BUDGET_STRICT', None)
+    app.config.setdefault('SQL_REPEATED_QUERY_THRESHOLD', 3)
+    _install_engine_listeners()
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+
+    def report(stats, endpoint, method, path, status):
+        """Log stats, enforce the endpoint's budget; return the repeated shapes."""
+        repeated = stats.repeated(app.config['SQL_REPEATED_QUERY_THRESHOLD'])
+        budget = app.config['SQL_QUERY_BUDGETS'].get(
+            endpoint, app.config['SQL_QUERY_BUDGET_DEFAULT']
+        )
+        over_budget = budget is not None and stats.count > budget
+        log = logger.warning if over_budget or repeated else logger.info
+        log(json.dumps({
+            'event': 'sql_stats',
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 2),
+            'budget': budget,
+            'repeated': repeated,
+        }))
+
+        strict = app.config['SQL_QUERY_BUDGET_STRICT']
+        if strict is None:
+            strict = app.testing
+        if over_budget and strict:
+            raise QueryBudgetExceeded(
+                f"{endpoint} issued {stats.count} queries (budget {budget}); "
+                f"repeated statements: {repeated}"
+            )
+        return repeated
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+
+        args = (stats, request.endpoint, request.method, request.path,
+                response.status_code)
+        if response.is_streamed:
+            # keep counting while the body is sent (its rows are fetched
+            # then), and report once it is out
+            return on_stream_end(response, lambda: report(*args))
+
+        g.pop('query_stats')
+        repeated = report(*args)
+        response.headers['X-DB-Query-Count'] = str(stats.count)
+        response.headers['X-DB-Time-Ms'] = f"{stats.duration * 1000:.2f}"
+        response.headers['X-DB-Repeated-Queries'] = str(len(repeated))
+        return response
@@ -0,0 +1,208 @@
+"""
+Database-backed background jobs: no broker, just the jobs table.
+
+Requests enqueue a Job row in their own transaction; `flask blogly worker`
+processes claim runnable jobs with SELECT ... FOR UPDATE SKIP LOCKED, so
+any number of workers can share the queue. Handlers do their work in
+chunks, committing each chunk together with the job's progress, which keeps
+locks short and lets a retried job resume where the failed attempt stopped.
+"""
+import datetime
+import os
+import socket
+import time
+import traceback
+
+from flask import current_app
+from sqlalchemy import exists, select
+from sqlalchemy.orm import aliased
+
+from associations import link_tag_posts, posts_tags, unlink_tag_posts
+from models import Job, Post, Tag, User, db
+from related import affected_by, refresh_related_posts, track_leaders
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function as the handler of kind jobs."""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload, key=None, total=None):
+    """
+    Add a kind job to the session (the caller commits). Pending jobs with
+    the same key are cancelled: the new job supersedes them.
+    """
+    if key is not None:
+        Job.query.filter_by(key=key, status='pending').update(
+            {'status': 'cancelled'}, synchronize_session=False
+        )
+    job = Job(kind=kind, key=key, payload=payload, progress_total=total)
+    db.session.add(job)
+    return job
+
+
+def claim(worker_id):
+    """
+    Lock and mark running the next runnable job and return it, or None.
+    Jobs whose worker stopped heartbeating for JOB_LOCK_TIMEOUT seconds are
+    runnable again.
+    """
+    now = datetime.datetime.utcnow()
+    stale = now - datetime.timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT'])
+    running = aliased(Job)
+    job = Job.query.filter(
+        db.or_(
+            (Job.status == 'pending') & (Job.run_at <= now),
+            (Job.status == 'running') & (Job.locked_at < stale),
+        ),
+        ~exists().where(
+            (running.key == Job.key) & (running.status == 'running')
+            & (running.id != Job.id) & (running.locked_at >= stale)
+        ),
+    ).order_by(Job.run_at, Job.id).with_for_update(skip_locked=True).first()
+    if job is None:
+        db.session.rollback()
+        return None
+    job.status = 'running'
+    job.attempts += 1
+    job.locked_at = now
+    job.locked_by = worker_id
+    db.session.commit()
+    return job
+
+
+def progress(job, done):
+    """Record done more units of work and commit them with the chunk."""
+    job.progress_done += done
+    job.locked_at = datetime.datetime.utcnow()
+    db.session.commit()
+
+
+def run(job):
+    """Run a claimed job; on failure schedule a retry with backoff."""
+    try:
+        HANDLERS[job.kind](job, **job.payload)
+    except Exception:
+        db.session.rollback()
+        job.last_error = traceback.format_exc()
+        job.locked_at = job.locked_by = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.datetime.utcnow()
+        else:
+            job.status = 'pending'
+            job.run_at = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+            )
+        db.session.commit()
+        current_app.logger.exception('job %s failed (attempt %s)', job.id, job.attempts)
+        return False
+    job.status = 'done'
+    job.finished_at = datetime.datetime.utcnow()
+    job.locked_at = job.locked_by = None
+    db.session.commit()
+    return True
+
+
+def work(burst=False, poll_interval=1.0, worker_id=None):
+    """
+    Claim and run jobs until interrupted, or until the queue has no
+    runnable job when burst is set. Returns the number of jobs run.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    count = 0
+    while True:
+        job = claim(worker_id)
+        if job is None:
+            if burst:
+                return count
+            time.sleep(poll_interval)
+            continue
+        run(job)
+        count += 1
+
+
+def _chunk_size():
+    return current_app.config['JOB_CHUNK_SIZE']
+
+
+def _chunks(ids):
+    size = _chunk_size()
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+@handler('delete_user')
+def delete_user(job, user_id):
+    """
+    Delete a (hidden) user's posts a chunk at a time, then the user.
+    The posts_tags rows go with each chunk through ON DELETE CASCADE.
+    """
+    posts = Post.__table__
+    while True:
+        chunk = select([posts.c.id]).where(posts.c.user_id == user_id).limit(_chunk_size())
+        deleted = db.session.execute(posts.delete().where(posts.c.id.in_(chunk))).rowcount
+        if not deleted:
+            break
+        progress(job, deleted)
+    User.query.filter_by(id=user_id).delete()
+    progress(job, 1)
+
+
+@handler('sync_tag_posts')
+def sync_tag_posts(job, tag_id, post_ids):
+    """
+    Make tag_id's posts exactly post_ids, unlinking and linking a chunk at
+    a time. The diff is recomputed on every attempt, so retries only redo
+    what is left.
+    """
+    if Tag.query.get(tag_id) is None:
+        return
+    wanted = set(post_ids)
+    current = {
+        post_id for (post_id,) in
+        db.session.query(posts_tags.c.post_id).filter(posts_tags.c.tag_id == tag_id)
+    }
+    job.progress_total = job.progress_done + len(wanted ^ current)
+    db.session.commit()
+    # only posts that still exist can be linked
+    for chunk in _chunks(sorted(wanted - current)):
+        existing = [
+            post_id for (post_id,) in
+            db.session.query(Post.id).filter(Post.id.in_(chunk))
+        ]
+        link_tag_posts(tag_id, existing)
+        progress(job, len(chunk))
+    for chunk in _chunks(sorted(current - wanted)):
+        unlink_tag_posts(tag_id, chunk)
+        progress(job, len(chunk))
+
+
+@handler('refresh_related_posts')
+def refresh_related(job, post_ids):
+    """
+    Recompute the related posts of post_ids, whose tags changed, and of the
+    posts whose lists the change can affect, a chunk at a time.
+    """
+    track_leaders(post_ids)
+    post_ids = sorted(affected_by(post_ids) | set(post_ids))
+    job.progress_total = job.progress_done + len(post_ids)
+    db.session.commit()
+    for chunk in _chunks(post_ids):
+        refresh_related_posts(chunk)
+        progress(job, len(chunk))
+
+
+def init_jobs(app):
+    """Set the job queue defaults."""
+    # work above this many rows is queued instead of done in the request
+    app.config.setdefault('JOB_INLINE_MAX_ROWS', 500)
+    app.config.setdefault('JOB_CHUNK_SIZE', 1000)
+    # retry n waits JOB_RETRY_DELAY * 2 ** (n - 1) seconds
+    app.config.setdefault('JOB_RETRY_DELAY', 5)
+    app.config.setdefault('JOB_LOCK_TIMEOUT', 300)
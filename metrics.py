@@ -0,0 +1,295 @@
+"""Prometheus-format request metrics, aggregated across worker processes."""
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+from flask.signals import before_render_template, template_rendered
+
+from streaming import on_stream_end
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   float('inf'))
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, float('inf'))
+
+# name: (type, help, buckets)
+FAMILIES = {
+    'blogly_http_requests_total': (
+        'counter', 'Requests served, by endpoint, method and status.', None),
+    'blogly_http_request_duration_seconds': (
+        'histogram', 'Time spent serving a request.', LATENCY_BUCKETS),
+    'blogly_http_request_db_seconds': (
+        'histogram', 'Time a request spent executing SQL.', LATENCY_BUCKETS),
+    'blogly_http_request_template_seconds': (
+        'histogram', 'Time a request spent rendering templates '
+        '(including queries issued while rendering).', LATENCY_BUCKETS),
+    'blogly_template_render_seconds': (
+        'histogram', 'Time spent rendering each template, by name '
+        '(including queries issued while rendering).', LATENCY_BUCKETS),
+    'blogly_http_response_size_bytes': (
+        'histogram', 'Response body sizes, when known up front.', SIZE_BUCKETS),
+    'blogly_http_requests_in_flight': (
+        'gauge', 'Requests being served.', None),
+    'blogly_handled_errors_total': (
+        'counter', 'Database errors a view caught and reported to the user.', None),
+}
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of one process, keyed by (name, labels).
+
+    With a directory set, each process also writes its values to
+    <directory>/<pid>.json (at most every flush_interval seconds, and
+    before exposing), and expose() sums the files of all processes, so any
+    worker can answer a scrape for the whole deployment. Gauges of processes
+    that have exited are dropped; their counters and histograms are kept.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def __repr__(self):
+        return (f"<Metrics: series={len(self._values) + len(self._histograms)} "
+                f"directory={self.directory!r}>")
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._values = {}
+        self._histograms = {}
+        self._flushed_at = 0.0
+
+    def _check_fork(self):
+        # a forked worker must not report its parent's values as its own
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, labels=(), amount=1):
+        """Add amount to a counter or gauge."""
+        key = (name, tuple(labels))
+        with self._lock:
+            self._check_fork()
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        """Record value in a histogram."""
+        buckets = FAMILIES[name][2]
+        key = (name, tuple(labels))
+        with self._lock:
+            self._check_fork()
+            counts = self._histograms.get(key)
+            if counts is None:
+                # bucket counts, then sum and count
+                counts = self._histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'pid': self._pid,
+                'values': [[name, labels, value]
+                           for (name, labels), value in self._values.items()],
+                'histograms': [[name, labels, counts[:]]
+                               for (name, labels), counts in self._histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """Write this process's values to its file in directory."""
+        if self.directory is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        snapshot = self._snapshot()
+        path = os.path.join(self.directory, f"{snapshot['pid']}.json")
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, path)
+
+    def _snapshots(self):
+        if self.directory is None:
+            return [self._snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def collect(self):
+        """
+        Return ({(name, labels): value}, {(name, labels): counts}) summed
+        over all processes.
+        """
+        values, histograms = {}, {}
+        for snapshot in self._snapshots():
+            alive = _process_alive(snapshot['pid'])
+            for name, labels, value in snapshot['values']:
+                if FAMILIES[name][0] == 'gauge' and not alive:
+                    continue
+                key = (name, tuple(map(tuple, labels)))
+                values[key] = values.get(key, 0) + value
+            for name, labels, counts in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(counts))
+                for index, count in enumerate(counts):
+                    total[index] += count
+        return values, histograms
+
+    def expose(self):
+        """Render every metric in the Prometheus text exposition format."""
+        values, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in FAMILIES.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (series, labels), value in sorted(values.items()):
+                if series == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (series, labels), counts in sorted(histograms.items()):
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    bucket_labels = labels + (('le', _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(counts[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {counts[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+metrics = Metrics()
+
+
+def _endpoint():
+    # unmatched urls share one label so scanners cannot blow up cardinality
+    return request.endpoint or 'unmatched'
+
+
+def count_error(error):
+    """Count a database error a view caught instead of failing the request."""
+    metrics.inc('blogly_handled_errors_total',
+                (('endpoint', _endpoint()), ('error', type(error).__name__)))
+
+
+def _template_started(app, template, context, **extra):
+    g.setdefault('template_starts', []).append(time.perf_counter())
+
+
+def _template_finished(app, template, context, **extra):
+    starts = g.get('template_starts')
+    if starts:
+        seconds = time.perf_counter() - starts.pop()
+        g.template_seconds = g.get('template_seconds', 0.0) + seconds
+        metrics.observe('blogly_template_render_seconds', seconds,
+                        (('template', template.name),))
+
+
+def init_metrics(app):
+    """
+    Record latency, DB and template time, response size and status of every
+    request, and the render time of every template (app.metrics_view
+    exposes them).
+
+    METRICS_DIR switches to multi-process mode (one file per worker process
+    in that directory, which should be emptied when the server starts);
+    METRICS_FLUSH_INTERVAL bounds how often a worker rewrites its file.
+    Register after init_query_stats: the DB time comes from its per-request
+    stats, which its own after_request hook (run later) discards.
+    """
+    app.config.setdefault('METRICS_DIR', None)
+    app.config.setdefault('METRICS_FLUSH_INTERVAL', 1.0)
+    metrics.directory = app.config['METRICS_DIR']
+    metrics.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+    if metrics.directory:
+        os.makedirs(metrics.directory, exist_ok=True)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.template_seconds = 0.0
+        g.in_flight = True
+        metrics.inc('blogly_http_requests_in_flight')
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        endpoint = (('endpoint', _endpoint()),)
+        metrics.inc('blogly_http_requests_total', endpoint + (
+            ('method', request.method), ('status', str(response.status_code))
+        ))
+        stats = g.get('query_stats')
+        template_seconds = g.get('template_seconds', 0.0)
+
+        def observe():
+            metrics.observe('blogly_http_request_duration_seconds',
+                            time.perf_counter() - started, endpoint)
+            if stats is not None:
+                metrics.observe('blogly_http_request_db_seconds', stats.duration, endpoint)
+            metrics.observe('blogly_http_request_template_seconds',
+                            template_seconds, endpoint)
+
+        if response.is_streamed:
+            # the body (and the queries behind it) is produced as it is sent
+            return on_stream_end(response, observe)
+        observe()
+        if response.content_length is not None:
+            metrics.observe('blogly_http_response_size_bytes',
+                            response.content_length, endpoint)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(error):
+        if g.pop('in_flight', False):
+            metrics.inc('blogly_http_requests_in_flight', amount=-1)
+        metrics.flush()
@@ -1,9 +1,12 @@
 """Models for Blogly."""
 import datetime
 
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, exists
+from sqlalchemy.orm.exc import StaleDataError
 
-db = SQLAlchemy()
+from routing import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 def connect_db(app):
     """Connect to database."""
@@ -11,6 +14,34 @@ def connect_db(app):
     db.init_app(app)
 
 
+# PostgreSQL DDL run after a table is created, in order. `flask blogly
+# migrate` replays all of it on existing databases, so every statement must
+# be idempotent: CREATE OR REPLACE, IF NOT EXISTS, DROP TRIGGER IF EXISTS
+# before CREATE TRIGGER.
+SCHEMA_DDL = []
+
+
+def _on_create(table, statement):
+    ddl = DDL(statement).execute_if(dialect='postgresql')
+    SCHEMA_DDL.append((table, ddl))
+    event.listen(table, 'after_create', ddl)
+
+
+def check_version(obj, version):
+    """
+    Raise StaleDataError when an edit based on version of obj (from a form
+    or API request) no longer matches the stored row. None skips the check.
+
+    Between this check and the commit, version_id_col guards the UPDATE
+    itself, which matches and bumps the version the object was loaded at.
+    """
+    if version is not None and version != obj.version:
+        raise StaleDataError(
+            f"{type(obj).__name__} {obj.id} is at version {obj.version}, "
+            f"the edit was based on version {version}"
+        )
+
+
 class User(db.Model):
     """User"""
 
@@ -20,11 +51,20 @@ class User(db.Model):
     first_name = db.Column(db.String(32), nullable=False)
     last_name = db.Column(db.String(32), nullable=False)
     image_url = db.Column(db.Text)
+    # set while a delete_user job removes the user's posts; hides the user
+    deleted_at = db.Column(db.DateTime)
+    # optimistic concurrency: every ORM UPDATE matches and bumps it
+    version = db.Column(db.Integer, nullable=False, server_default='1')
 
     __table_args__ = (
         db.CheckConstraint("image_url LIKE 'http%'"),
         # db.UniqueConstraint('first_name', 'last_name', name='unique_person'),
+        # backs the keyset-paginated user directory
+        db.Index('ix_users_name', last_name, first_name, id),
+        # the few users pending deletion, which hide their posts
+        db.Index('ix_users_pending_deletion', id, postgresql_where=deleted_at.isnot(None)),
     )
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return (f"<User: first_name='{self.first_name}' "
@@ -39,6 +79,20 @@ class User(db.Model):
         return f"{self.first_name} {self.last_name}"
 
 
+# Backs the prefix search of the user directory (catalog.user_directory):
+# lower(last_name), then lower(first_name), compared byte-wise, which the
+# "C" collation makes index-friendly.
+_on_create(User.__table__, """
+    CREATE INDEX IF NOT EXISTS ix_users_name_key ON users (
+        (lower(last_name) COLLATE "C"), (lower(first_name) COLLATE "C"), id
+    );
+""")
+
+
+# length of Post.excerpt, the card text of feeds, including the ellipsis
+EXCERPT_LENGTH = 280
+
+
 class Post(db.Model):
     """Post"""
 
@@ -49,6 +103,27 @@ class Post(db.Model):
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    # the author's full name, copied by the triggers below so feeds render
+    # without loading users
+    author_name = db.Column(db.String(65), server_default=db.FetchedValue(),
+                            server_onupdate=db.FetchedValue())
+    # start of content, computed by the database on every write (imports
+    # included), so list pages can leave the full content unloaded
+    excerpt = db.Column(db.Text, db.Computed(
+        f"CASE WHEN length(content) > {EXCERPT_LENGTH} "
+        f"THEN rtrim(substr(content, 1, {EXCERPT_LENGTH - 1})) || '\u2026' "
+        "ELSE content END",
+        persisted=True
+    ))
+
+    # optimistic concurrency: every ORM UPDATE matches and bumps it
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __table_args__ = (
+        # backs the keyset-paginated home feed: ORDER BY created_at DESC, id DESC
+        db.Index('ix_posts_created_at_id', created_at.desc(), id.desc()),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
     user = db.relationship('User', backref=db.backref('posts', passive_deletes=True))
 
@@ -64,6 +139,59 @@ class Post(db.Model):
                 f"tags={[(tag.id, tag.name) for tag in self.tags]}>")
 
 
+# Full-text search vector over title (weight A) and content (weight B).
+# It is a generated column, so PostgreSQL keeps it in sync on every write.
+# It is deliberately left unmapped so regular Post loads never fetch it;
+# search.py references it by name.
+_on_create(Post.__table__, """
+    ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED;
+    CREATE INDEX IF NOT EXISTS ix_posts_search_vector ON posts USING gin (search_vector);
+""")
+
+# Backs the post picker (catalog.post_picker): prefix match and keyset order
+# on lower(title) byte-wise, which the "C" collation makes index-friendly.
+_on_create(Post.__table__, """
+    CREATE INDEX IF NOT EXISTS ix_posts_title_key ON posts ((lower(title) COLLATE "C"), id);
+""")
+
+
+# Copy the author's name into new posts (and moved ones), and into every
+# post of a user whose name changes, in the writing transaction.
+_on_create(Post.__table__, """
+    CREATE OR REPLACE FUNCTION posts_author_name() RETURNS trigger AS $$
+    BEGIN
+        NEW.author_name := (
+            SELECT first_name || ' ' || last_name FROM users WHERE id = NEW.user_id
+        );
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION users_rename_posts() RETURNS trigger AS $$
+    BEGIN
+        UPDATE posts AS p SET author_name = n.first_name || ' ' || n.last_name
+        FROM new_rows AS n JOIN old_rows AS o ON o.id = n.id
+        WHERE p.user_id = n.id
+          AND (n.first_name, n.last_name) IS DISTINCT FROM (o.first_name, o.last_name);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS posts_author_name ON posts;
+    CREATE TRIGGER posts_author_name BEFORE INSERT OR UPDATE OF user_id ON posts
+        FOR EACH ROW EXECUTE FUNCTION posts_author_name();
+    DROP TRIGGER IF EXISTS users_rename_posts ON users;
+    CREATE TRIGGER users_rename_posts AFTER UPDATE ON users
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION users_rename_posts();
+""")
+
+# Posts of users pending deletion (see jobs.py) are hidden. The anti-join
+# only reads ix_users_pending_deletion, so post queries need not join users.
+AUTHOR_VISIBLE = ~exists().where((User.id == Post.user_id) & User.deleted_at.isnot(None))
+
+
 class Tag(db.Model):
     """Tag"""
 
@@ -71,6 +199,17 @@ class Tag(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(32), nullable=False, unique=True)
+    # denormalized number of posts_tags rows; maintained by triggers below
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # optimistic concurrency: every ORM UPDATE matches and bumps it (the
+    # post_count triggers leave it alone)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __table_args__ = (
+        # backs the tag cloud and "top tags" listings
+        db.Index('ix_tags_post_count', post_count.desc(), id),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
     posttags = db.relationship('PostTag', backref='tag', passive_deletes=True)
     posts = db.relationship('Post', secondary='posts_tags', backref='tags')
@@ -78,6 +217,7 @@ class Tag(db.Model):
     def __repr__(self):
         return (f"<Tag: id={self.id} "
                 f"name='{self.name}' "
+                f"post_count={self.post_count} "
                 f"posts={[ (post.id, post.title) for post in self.posts]}>")
 
 
@@ -91,6 +231,365 @@ class PostTag(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
     tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True)
 
+    __table_args__ = (
+        # the primary key only serves post_id lookups; this serves tag_id ones
+        # (tag pages, ON DELETE CASCADE from tags, count reconciliation)
+        db.Index('ix_posts_tags_tag_id', tag_id, post_id),
+    )
+
     def __repr__(self):
         return (f"<Post-Tag: post_id={self.post_id} "
-                f"tag_id={self.tag_id}>")
\ No newline at end of file
+                f"tag_id={self.tag_id}>")
+
+
+# Keep tags.post_count in step with posts_tags inside the writing transaction.
+# Statement-level triggers with transition tables apply one aggregated UPDATE
+# per statement, so bulk inserts/COPY and ON DELETE CASCADE from posts, users
+# and tags are all covered without per-row overhead.
+_on_create(PostTag.__table__, """
+    CREATE OR REPLACE FUNCTION posts_tags_count_insert() RETURNS trigger AS $$
+    BEGIN
+        UPDATE tags SET post_count = post_count + delta.n
+        FROM (SELECT tag_id, count(*) AS n FROM new_rows GROUP BY tag_id) AS delta
+        WHERE tags.id = delta.tag_id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION posts_tags_count_delete() RETURNS trigger AS $$
+    BEGIN
+        UPDATE tags SET post_count = post_count - delta.n
+        FROM (SELECT tag_id, count(*) AS n FROM old_rows GROUP BY tag_id) AS delta
+        WHERE tags.id = delta.tag_id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS posts_tags_count_insert ON posts_tags;
+    CREATE TRIGGER posts_tags_count_insert AFTER INSERT ON posts_tags
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION posts_tags_count_insert();
+    DROP TRIGGER IF EXISTS posts_tags_count_delete ON posts_tags;
+    CREATE TRIGGER posts_tags_count_delete AFTER DELETE ON posts_tags
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION posts_tags_count_delete();
+""")
+
+
+class UserPostSummary(db.Model):
+    """
+    Read model of a user's posts for the profile page: one row per post
+    with its tag names, kept in sync with posts, posts_tags and tags by the
+    triggers below, so a profile page is one range read of the index.
+    """
+
+    __tablename__ = "user_post_summaries"
+
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    created_at = db.Column(db.DateTime, nullable=False)
+    title = db.Column(db.String(128), nullable=False)
+    tag_names = db.Column(db.ARRAY(db.Text).with_variant(db.JSON, 'sqlite'),
+                          nullable=False, default=list)
+
+    __table_args__ = (
+        db.Index('ix_user_post_summaries_user_created', user_id,
+                 created_at.desc(), post_id.desc()),
+    )
+
+    def __repr__(self):
+        return (f"<UserPostSummary: post_id={self.post_id} "
+                f"user_id={self.user_id} "
+                f"title='{self.title}' "
+                f"tag_names={self.tag_names}>")
+
+
+# sorted tag names of the summary row s, for the trigger functions below
+_SUMMARY_TAG_NAMES = """coalesce((
+    SELECT array_agg(t.name ORDER BY t.name) FROM posts_tags AS pt
+    JOIN tags AS t ON t.id = pt.tag_id WHERE pt.post_id = s.post_id
+), '{}')"""
+
+# Maintain user_post_summaries with statement-level triggers: new and
+# edited posts copy their columns, link changes and tag renames recompute
+# the tag names of the affected posts only. Deleted posts and users take
+# their rows with them through ON DELETE CASCADE.
+_on_create(Post.__table__, """
+    CREATE OR REPLACE FUNCTION post_summaries_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO user_post_summaries (post_id, user_id, created_at, title, tag_names)
+        SELECT id, user_id, created_at, title, '{}' FROM new_rows;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION post_summaries_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE user_post_summaries AS s
+        SET user_id = n.user_id, created_at = n.created_at, title = n.title
+        FROM new_rows AS n
+        WHERE s.post_id = n.id
+          AND (s.user_id, s.created_at, s.title)
+              IS DISTINCT FROM (n.user_id, n.created_at, n.title);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS post_summaries_insert ON posts;
+    CREATE TRIGGER post_summaries_insert AFTER INSERT ON posts
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION post_summaries_insert();
+    DROP TRIGGER IF EXISTS post_summaries_update ON posts;
+    CREATE TRIGGER post_summaries_update AFTER UPDATE ON posts
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION post_summaries_update();
+""")
+
+_on_create(PostTag.__table__, f"""
+    CREATE OR REPLACE FUNCTION post_summaries_retag() RETURNS trigger AS $$
+    BEGIN
+        UPDATE user_post_summaries AS s SET tag_names = {_SUMMARY_TAG_NAMES}
+        WHERE s.post_id IN (SELECT post_id FROM changed_rows);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS post_summaries_link ON posts_tags;
+    CREATE TRIGGER post_summaries_link AFTER INSERT ON posts_tags
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION post_summaries_retag();
+    DROP TRIGGER IF EXISTS post_summaries_unlink ON posts_tags;
+    CREATE TRIGGER post_summaries_unlink AFTER DELETE ON posts_tags
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION post_summaries_retag();
+""")
+
+_on_create(Tag.__table__, f"""
+    CREATE OR REPLACE FUNCTION post_summaries_rename_tag() RETURNS trigger AS $$
+    BEGIN
+        UPDATE user_post_summaries AS s SET tag_names = {_SUMMARY_TAG_NAMES}
+        WHERE s.post_id IN (
+            SELECT pt.post_id FROM posts_tags AS pt
+            JOIN new_rows AS n ON n.id = pt.tag_id
+            JOIN old_rows AS o ON o.id = n.id
+            WHERE n.name <> o.name
+        );
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS post_summaries_rename_tag ON tags;
+    CREATE TRIGGER post_summaries_rename_tag AFTER UPDATE ON tags
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION post_summaries_rename_tag();
+""")
+
+
+class RelatedPost(db.Model):
+    """
+    One of the top related posts of a post, by tag overlap; computed by
+    related.py (batch rebuild, refreshed after tag edits), so reading a
+    post's related posts is one range read of the primary key.
+    """
+
+    __tablename__ = "related_posts"
+
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                           nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        # finds the lists a post appears in (and backs the cascade)
+        db.Index('ix_related_posts_related_id', related_id),
+    )
+
+    def __repr__(self):
+        return (f"<RelatedPost: post_id={self.post_id} "
+                f"rank={self.rank} "
+                f"related_id={self.related_id} "
+                f"score={self.score:.4f}>")
+
+
+class CommonTag(db.Model):
+    """
+    One of the most used tags, with its bit of the common tags masks;
+    ranked by `flask blogly rebuild-related-posts` (see related.py).
+    """
+
+    __tablename__ = "common_tags"
+
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'),
+                       primary_key=True)
+    bit = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<CommonTag: tag_id={self.tag_id} bit={self.bit}>"
+
+
+class RelatedLeader(db.Model):
+    """
+    A post among the lightest of its common tags mask, so a candidate for
+    posts sharing only common tags with it (see related.py); ranked by the
+    batch rebuild, and posts whose tags change are added until the next.
+    """
+
+    __tablename__ = "related_leaders"
+
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        primary_key=True)
+    mask = db.Column(db.BigInteger, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_related_leaders_mask', mask, total),
+    )
+
+    def __repr__(self):
+        return (f"<RelatedLeader: post_id={self.post_id} "
+                f"mask={self.mask} "
+                f"total={self.total:.4f}>")
+
+
+class Job(db.Model):
+    """Background job; see jobs.py for the queue and worker."""
+
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(32), nullable=False)
+    # jobs sharing a key (e.g. 'tag:3') never run concurrently
+    key = db.Column(db.String(64))
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(64))
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # backs the claim query: the next runnable pending job
+        db.Index('ix_jobs_status_run_at', status, run_at),
+        db.Index('ix_jobs_key', key),
+    )
+
+    def __repr__(self):
+        return (f"<Job: id={self.id} "
+                f"kind='{self.kind}' "
+                f"status='{self.status}' "
+                f"progress={self.progress_done}/{self.progress_total}>")
+
+
+class IdempotencyKey(db.Model):
+    """
+    Response to a request sent with an Idempotency-Key header, written in
+    the transaction of the request's changes, so a retry is answered from
+    here instead of repeating them (see idempotency.py).
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    # the endpoint the key was used on, e.g. 'posts'
+    scope = db.Column(db.String(32), primary_key=True)
+    key = db.Column(db.String(128), primary_key=True)
+    # sha256 of the request body; a retry must send the same one
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.SmallInteger)
+    response = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # backs the purge of expired keys
+        db.Index('ix_idempotency_keys_created_at', created_at),
+    )
+
+    def __repr__(self):
+        return (f"<IdempotencyKey: scope='{self.scope}' "
+                f"key='{self.key}' "
+                f"status_code={self.status_code}>")
+
+
+class TableChange(db.Model):
+    """
+    Changes to one table, counted by statement; a table's version is the
+    sum of the changes of its rows. Backs HTTP validators (see http_cache).
+    """
+
+    __tablename__ = "table_changes"
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    name = db.Column(db.Text, nullable=False)
+    changes = db.Column(db.BigInteger, nullable=False, server_default='1')
+
+    __table_args__ = (
+        # covers the sums of http_cache.table_versions
+        db.Index('ix_table_changes_name', name, changes),
+    )
+
+    def __repr__(self):
+        return (f"<TableChange: name='{self.name}' "
+                f"changes={self.changes}>")
+
+
+VERSIONED_TABLES = ('users', 'posts', 'tags', 'posts_tags', 'related_posts')
+# counter of tag ids and names only (see catalog.TagCatalog)
+TAG_CATALOG_VERSION = 'tag_catalog'
+
+# Seed one row per versioned table. A table without rows (e.g. on
+# databases without the triggers below) is treated as unversioned.
+_on_create(TableChange.__table__, """
+    INSERT INTO table_changes (name, changes)
+    SELECT v.name, 0 FROM (VALUES %s) AS v (name)
+    WHERE NOT EXISTS (SELECT 1 FROM table_changes AS c WHERE c.name = v.name);
+""" % ", ".join(f"('{name}')" for name in VERSIONED_TABLES + (TAG_CATALOG_VERSION,)))
+
+# Count a change once per statement that changed at least one row,
+# including the cascaded deletes and the post_count updates of triggers.
+# Every change is a new row rather than an update of a shared counter, so
+# writers of a table never wait on each other, and it only counts once
+# its transaction commits. `flask blogly compact-table-changes` folds the
+# rows of each table into one.
+TABLE_CHANGE_FUNCTIONS = f"""
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM changed_rows) THEN
+            INSERT INTO table_changes (name) VALUES (TG_TABLE_NAME);
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION bump_tag_catalog_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO table_changes (name) VALUES ('{TAG_CATALOG_VERSION}');
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+"""
+
+for _table in (User.__table__, Post.__table__, Tag.__table__, PostTag.__table__,
+               RelatedPost.__table__):
+    _on_create(_table, TABLE_CHANGE_FUNCTIONS + """
+        DROP TRIGGER IF EXISTS %(table)s_version_insert ON %(table)s;
+        CREATE TRIGGER %(table)s_version_insert AFTER INSERT ON %(table)s
+            REFERENCING NEW TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+        DROP TRIGGER IF EXISTS %(table)s_version_update ON %(table)s;
+        CREATE TRIGGER %(table)s_version_update AFTER UPDATE ON %(table)s
+            REFERENCING NEW TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+        DROP TRIGGER IF EXISTS %(table)s_version_delete ON %(table)s;
+        CREATE TRIGGER %(table)s_version_delete AFTER DELETE ON %(table)s
+            REFERENCING OLD TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+    """)
+
+# The tags version also moves with every post_count update, i.e. whenever a
+# post is tagged; the catalog version only moves when a tag is created,
+# renamed or deleted.
+_on_create(Tag.__table__, """
+    DROP TRIGGER IF EXISTS tags_catalog_version ON tags;
+    CREATE TRIGGER tags_catalog_version AFTER INSERT OR DELETE OR UPDATE OF name
+        ON tags FOR EACH STATEMENT EXECUTE FUNCTION bump_tag_catalog_version();
+""")
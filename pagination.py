@@ -0,0 +1,98 @@
+"""Keyset (cursor) pagination helpers for Blogly."""
+import base64
+import binascii
+import datetime
+import json
+
+from sqlalchemy import tuple_
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+class Page:
+    """One page of results plus the cursor for the page after it (or None)."""
+
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f"<Page: items={len(self.items)} next_cursor={self.next_cursor!r}>"
+
+
+def encode_cursor(values):
+    """
+    Encode the sort-key values of the last row on a page as an opaque,
+    url-safe cursor string.
+    """
+    raw = json.dumps([
+        value.isoformat() if isinstance(value, datetime.datetime) else value
+        for value in values
+    ], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """
+    Decode a cursor produced by encode_cursor back into a tuple of values,
+    converting each one to the matching python type in types.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise InvalidCursor(cursor)
+        return tuple(
+            datetime.datetime.fromisoformat(value) if kind is datetime.datetime
+            else kind(value)
+            for kind, value in zip(types, values)
+        )
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as err:
+        raise InvalidCursor(cursor) from err
+
+
+def get_page_size(value, default, maximum):
+    """
+    Parse a requested page size (e.g. ?limit=) and clamp it to [1, maximum];
+    fall back to default when missing or malformed.
+    """
+    try:
+        size = int(value) if value is not None else default
+    except ValueError:
+        size = default
+    return max(1, min(size, maximum))
+
+
+def keyset_paginate(query, columns, cursor=None, limit=20, descending=False):
+    """
+    Return a Page of query ordered by columns, starting after cursor.
+
+    columns must uniquely identify a row (end them with the primary key) and
+    should be backed by a composite index in the same order, so each page is a
+    single index range scan no matter how deep the client has paged.
+    """
+    key = tuple_(*columns)
+    if cursor:
+        values = decode_cursor(
+            cursor, [column.type.python_type for column in columns]
+        )
+        bound = tuple_(*values)
+        query = query.filter(key < bound if descending else key > bound)
+
+    rows = query.order_by(
+        *[column.desc() if descending else column.asc() for column in columns]
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+    return Page(rows, next_cursor)
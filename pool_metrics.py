@@ -0,0 +1,96 @@
+"""Connection-pool telemetry: checkout waits, overflow usage and churn."""
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# upper bounds (seconds) of the checkout wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float('inf'))
+
+
+class PoolStats:
+    """Counters for one connection pool since it was created."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+
+    def __repr__(self):
+        return (f"<PoolStats: checkouts={self.checkouts} "
+                f"wait_total={self.wait_total:.3f}s connects={self.connects}>")
+
+    def record_checkout(self, wait, overflow):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if wait <= bound:
+                    self.wait_buckets[index] += 1
+                    break
+            if overflow:
+                self.overflow_checkouts += 1
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times every checkout and counts connection churn."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        event.listen(self, 'connect', lambda *args: self.stats.incr('connects'))
+        event.listen(self, 'close', lambda *args: self.stats.incr('closes'))
+        event.listen(self, 'invalidate', lambda *args: self.stats.incr('invalidations'))
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.incr('timeouts')
+            raise
+        # overflow() > 0 means connections beyond pool_size are open
+        self.stats.record_checkout(time.perf_counter() - start, self.overflow() > 0)
+        return connection
+
+
+def pool_snapshot(pool):
+    """Return the current gauges and counters of pool as a dict."""
+    snapshot = {'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        snapshot.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+        )
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        snapshot.update(
+            checkouts=stats.checkouts,
+            overflow_checkouts=stats.overflow_checkouts,
+            checkout_timeouts=stats.timeouts,
+            checkout_wait_seconds_total=round(stats.wait_total, 6),
+            checkout_wait_seconds_max=round(stats.wait_max, 6),
+            checkout_wait_buckets={
+                ('+Inf' if bound == float('inf') else str(bound)): count
+                for bound, count in zip(WAIT_BUCKETS, stats.wait_buckets)
+            },
+            connects=stats.connects,
+            closes=stats.closes,
+            invalidations=stats.invalidations,
+        )
+    return snapshot
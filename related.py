@@ -0,0 +1,222 @@
+"""
+Related posts by tag overlap.
+
+Two posts are scored with an IDF-weighted Jaccard index over their tags:
+the weight of the tags they share divided by the weight of the tags either
+has, where a tag on n of N posts weighs ln(N / n), so a rare shared tag
+counts for more than a common one. The database computes the scores
+set-wise (the posts x tags matrix is posts_tags) and keeps the top
+RELATED_POSTS of every post in related_posts. Pairs that share only the
+COMMON_TAGS most used tags are pruned to those that can make a top list,
+since those tags otherwise pair nearly every post with every other.
+
+`flask blogly rebuild-related-posts` ranks the common tags and the posts
+that pass that pruning (common_tags and related_leaders) and recomputes
+every list; run it periodically. After a post's tags change, a
+refresh_related_posts job recomputes the lists the change can affect,
+reading only the tags of those posts and of their candidates, so its cost
+follows the edit rather than the size of posts_tags.
+"""
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from models import AUTHOR_VISIBLE, CommonTag, Post, RelatedLeader, RelatedPost, db
+
+# the most used tags (on most posts, so they pair a post with most others)
+# are given a bit of a mask each; see _CANDIDATES
+COMMON_TAGS = 16
+
+# the tags of the posts matching a condition, with their current weight and
+# common tags bit (tags ranked since the last rebuild have none)
+_TAGGED = """
+        SELECT pt.post_id, pt.tag_id,
+               ln((SELECT count(*) FROM posts) / CAST(t.post_count AS FLOAT)) AS weight,
+               coalesce(c.bit, 0) AS bit
+        FROM posts_tags AS pt
+        JOIN tags AS t ON t.id = pt.tag_id
+        LEFT JOIN common_tags AS c ON c.tag_id = pt.tag_id
+        {}"""
+
+# the tags of posts :ids and their total weight and common tags mask
+_OWN = """
+    mine AS (""" + _TAGGED.format("WHERE pt.post_id IN :ids") + """
+    ),
+    own AS (
+        SELECT post_id, sum(weight) AS total, CAST(sum(bit) AS BIGINT) AS mask
+        FROM mine GROUP BY post_id
+    )"""
+
+# the posts :ids can score against: those sharing a less common tag with
+# them, and of those sharing only common tags, the :count + 1 lightest per
+# set of common tags shared (their scores only fall as their total weight
+# grows, so no other such post can make the top :count). The lightest of
+# every mask are kept in related_leaders, which keeps that join small.
+_CANDIDATES = """,
+    lightest AS (
+        SELECT m.mask, l.post_id, row_number() OVER (
+            PARTITION BY m.mask, l.mask & m.mask ORDER BY l.total, l.post_id DESC
+        ) AS place
+        FROM (SELECT DISTINCT mask FROM own WHERE mask <> 0) AS m
+        JOIN related_leaders AS l ON (l.mask & m.mask) <> 0
+    ),
+    candidates AS (
+        SELECT a.post_id, b.post_id AS related_id
+        FROM mine AS a
+        JOIN posts_tags AS b ON b.tag_id = a.tag_id AND b.post_id <> a.post_id
+        WHERE a.bit = 0
+        UNION
+        SELECT a.post_id, l.post_id
+        FROM own AS a
+        JOIN lightest AS l ON l.mask = a.mask AND l.post_id <> a.post_id
+        WHERE l.place <= :count + 1
+    ),
+    shared AS (
+        SELECT c.post_id, c.related_id, sum(a.weight) AS shared
+        FROM candidates AS c
+        JOIN mine AS a ON a.post_id = c.post_id
+        JOIN posts_tags AS b ON b.post_id = c.related_id AND b.tag_id = a.tag_id
+        GROUP BY c.post_id, c.related_id
+        HAVING sum(a.weight) > 0
+    )"""
+
+# the same, against every post sharing a tag
+_SHARED = """,
+    shared AS (
+        SELECT a.post_id, b.post_id AS related_id, sum(a.weight) AS shared
+        FROM mine AS a
+        JOIN posts_tags AS b ON b.tag_id = a.tag_id AND b.post_id <> a.post_id
+        GROUP BY a.post_id, b.post_id
+        HAVING sum(a.weight) > 0
+    )"""
+
+# the total weight of the related posts only
+_SCORED = """,
+    theirs AS (""" + _TAGGED.format(
+        "WHERE pt.post_id IN (SELECT DISTINCT related_id FROM shared)") + """
+    ),
+    totals AS (
+        SELECT post_id, sum(weight) AS total FROM theirs GROUP BY post_id
+    ),
+    scored AS (
+        SELECT s.post_id, s.related_id,
+               s.shared / (ta.total + tb.total - s.shared) AS score
+        FROM shared AS s
+        JOIN own AS ta ON ta.post_id = s.post_id
+        JOIN totals AS tb ON tb.post_id = s.related_id
+    )"""
+
+_REFRESH = text("WITH" + _OWN + _CANDIDATES + _SCORED + """,
+    ranked AS (
+        SELECT post_id, related_id, score, row_number() OVER (
+            PARTITION BY post_id ORDER BY score DESC, related_id DESC
+        ) AS rank
+        FROM scored
+    )
+    INSERT INTO related_posts (post_id, rank, related_id, score)
+    SELECT post_id, rank, related_id, score FROM ranked WHERE rank <= :count
+""").bindparams(bindparam('ids', expanding=True))
+
+# lists that may change when the tags of posts :ids changed: those they are
+# in, and those they now score above the last entry of (or that are short)
+_AFFECTED = text("WITH" + _OWN + _SHARED + _SCORED + """
+    SELECT post_id FROM related_posts WHERE related_id IN :ids
+    UNION
+    SELECT s.related_id FROM scored AS s
+    LEFT JOIN related_posts AS last
+        ON last.post_id = s.related_id AND last.rank = :count
+    WHERE last.score IS NULL OR s.score > last.score
+""").bindparams(bindparam('ids', expanding=True))
+
+_RANK_COMMON_TAGS = text("""
+    INSERT INTO common_tags (tag_id, bit)
+    SELECT id, CAST(1 AS BIGINT) << CAST(popularity - 1 AS INTEGER) FROM (
+        SELECT id, row_number() OVER (ORDER BY post_count DESC, id) AS popularity
+        FROM tags WHERE post_count > 0
+    ) AS ranked
+    WHERE popularity <= :common
+""")
+
+# the :count + 1 lightest posts of every common tags mask
+_RANK_LEADERS = text("""
+    WITH tagged AS (""" + _TAGGED.format("") + """
+    ),
+    totals AS (
+        SELECT post_id, sum(weight) AS total, CAST(sum(bit) AS BIGINT) AS mask
+        FROM tagged GROUP BY post_id
+    )
+    INSERT INTO related_leaders (post_id, mask, total)
+    SELECT post_id, mask, total FROM (
+        SELECT post_id, total, mask, row_number() OVER (
+            PARTITION BY mask ORDER BY total, post_id DESC
+        ) AS place
+        FROM totals WHERE mask <> 0
+    ) AS ranked
+    WHERE place <= :count + 1
+""")
+
+# posts :ids join the leaders of their current mask (a superset of the
+# lightest only adds candidates) until the next rebuild ranks them again
+_TRACK_LEADERS = text("WITH" + _OWN + """
+    INSERT INTO related_leaders (post_id, mask, total)
+    SELECT post_id, mask, total FROM own WHERE mask <> 0
+""").bindparams(bindparam('ids', expanding=True))
+
+
+def _count():
+    return current_app.config['RELATED_POSTS']
+
+
+def rank_common_tags():
+    """
+    Rank the common tags and the lightest posts of each of their masks, in
+    the current transaction (the caller commits).
+    """
+    RelatedLeader.query.delete(synchronize_session=False)
+    CommonTag.query.delete(synchronize_session=False)
+    db.session.execute(_RANK_COMMON_TAGS, {'common': COMMON_TAGS})
+    db.session.execute(_RANK_LEADERS, {'count': _count()})
+
+
+def track_leaders(post_ids):
+    """Make post_ids, whose tags changed, candidates for their new masks."""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    RelatedLeader.query.filter(RelatedLeader.post_id.in_(post_ids)).delete(
+        synchronize_session=False
+    )
+    db.session.execute(_TRACK_LEADERS, {'ids': post_ids})
+
+
+def refresh_related_posts(post_ids):
+    """
+    Recompute the related posts of post_ids in the current transaction (the
+    caller commits); returns the number of rows written.
+    """
+    post_ids = list(post_ids)
+    if not post_ids:
+        return 0
+    RelatedPost.query.filter(RelatedPost.post_id.in_(post_ids)).delete(
+        synchronize_session=False
+    )
+    return db.session.execute(_REFRESH, {'ids': post_ids, 'count': _count()}).rowcount
+
+
+def affected_by(post_ids):
+    """Ids of the posts whose related posts may change with post_ids' tags."""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return set()
+    return {
+        affected_id for (affected_id,) in
+        db.session.execute(_AFFECTED, {'ids': post_ids, 'count': _count()})
+    }
+
+
+def related_posts(post_id):
+    """(id, title) of the related posts of post_id, best first."""
+    return db.session.query(Post.id, Post.title).join(
+        RelatedPost, RelatedPost.related_id == Post.id
+    ).filter(
+        RelatedPost.post_id == post_id, AUTHOR_VISIBLE
+    ).order_by(RelatedPost.rank).all()
@@ -0,0 +1,86 @@
+"""Read-replica routing for the Flask-SQLAlchemy session."""
+import random
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.sql.expression import UpdateBase
+
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+STICKY_COOKIE = 'blogly_primary_until'
+
+
+def _mark_written():
+    if has_request_context():
+        g.replica_bind = None
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends reads of read-only requests to a replica engine.
+
+    Everything else stays on the primary: flushes, DML statements, sessions
+    holding pending changes, work outside a request, and any read issued in
+    a request after it has written.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        bind = g.get('replica_bind') if has_request_context() else None
+        if bind is not None:
+            if self._flushing or isinstance(clause, UpdateBase) \
+                    or not self._is_clean():
+                _mark_written()
+            else:
+                return self.db.get_engine(self.app, bind=bind)
+        return super().get_bind(mapper, clause)
+
+
+event.listen(RoutingSession, 'after_flush', lambda *args: _mark_written())
+event.listen(RoutingSession, 'after_bulk_update', lambda *args: _mark_written())
+event.listen(RoutingSession, 'after_bulk_delete', lambda *args: _mark_written())
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy extension whose session routes read-only requests across the
+    replica_N binds (see config.database_config).
+
+    After a write request the client is pinned to the primary for
+    DB_REPLICA_STICKY_SECONDS via a cookie. That way the redirect following
+    a POST reads its own write even if the replicas lag.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.config.setdefault('DB_REPLICA_STICKY_SECONDS', 5)
+
+        @app.before_request
+        def choose_replica():
+            replicas = [
+                key for key in (app.config['SQLALCHEMY_BINDS'] or ())
+                if key.startswith('replica_')
+            ]
+            try:
+                sticky_until = float(request.cookies.get(STICKY_COOKIE, 0))
+            except ValueError:
+                sticky_until = 0
+            read_only = request.method in SAFE_METHODS and sticky_until < time.time()
+            g.replica_bind = random.choice(replicas) if replicas and read_only else None
+
+        @app.after_request
+        def stick_to_primary(response):
+            if request.method not in SAFE_METHODS and app.config['SQLALCHEMY_BINDS']:
+                window = app.config['DB_REPLICA_STICKY_SECONDS']
+                response.set_cookie(
+                    STICKY_COOKIE, str(time.time() + window),
+                    max_age=window, httponly=True, samesite='Lax'
+                )
+            return response
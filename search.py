@@ -0,0 +1,77 @@
+"""Full-text post search over the posts.search_vector tsvector column."""
+from markupsafe import Markup, escape
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import defer
+
+from models import AUTHOR_VISIBLE, Post, PostTag, Tag, db
+
+SEARCH_CONFIG = 'english'
+# generated tsvector column created by the DDL in models.py
+SEARCH_VECTOR = literal_column('posts.search_vector')
+# ts_headline markers; the snippet is escaped before they become <mark> tags
+_START_SEL = '\x02'
+_STOP_SEL = '\x03'
+HEADLINE_OPTIONS = (
+    f"StartSel={_START_SEL}, StopSel={_STOP_SEL}, "
+    "MaxFragments=2, MinWords=5, MaxWords=20, FragmentDelimiter=\" ... \""
+)
+
+
+class SearchResult:
+    """A matching post with its rank and highlighted content snippet."""
+
+    def __init__(self, post, rank, snippet):
+        self.post = post
+        self.rank = rank
+        self.snippet = snippet
+
+    def __repr__(self):
+        return f"<SearchResult: post_id={self.post.id} rank={self.rank:.4f}>"
+
+
+def highlight(headline):
+    """Escape a ts_headline snippet and turn its markers into <mark> tags."""
+    return Markup(
+        str(escape(headline or ''))
+        .replace(_START_SEL, '<mark>')
+        .replace(_STOP_SEL, '</mark>')
+    )
+
+
+def search_posts(terms, tag=None, user_id=None, page=1, per_page=20):
+    """
+    Return (results, has_next) for the page-th page of posts matching terms
+    (web search syntax: "quoted phrases", -exclusions, OR), best match first.
+
+    Matching and ranking run against the GIN-indexed search_vector; snippets
+    are only computed for the rows of the requested page, and the content
+    they are cut from is not loaded.
+    """
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+    rank = func.ts_rank_cd(SEARCH_VECTOR, tsquery).label('rank')
+
+    matches = db.session.query(Post.id.label('id'), rank).filter(
+        SEARCH_VECTOR.op('@@')(tsquery), AUTHOR_VISIBLE
+    )
+    if tag:
+        matches = matches.filter(Post.id.in_(
+            db.session.query(PostTag.post_id).join(Tag).filter(Tag.name == tag)
+        ))
+    if user_id:
+        matches = matches.filter(Post.user_id == user_id)
+    matches = matches.order_by(rank.desc(), Post.id.desc()).offset(
+        (page - 1) * per_page
+    ).limit(per_page + 1).subquery()
+
+    rows = db.session.query(
+        Post, matches.c.rank,
+        func.ts_headline(SEARCH_CONFIG, Post.content, tsquery, HEADLINE_OPTIONS)
+    ).join(matches, Post.id == matches.c.id).options(
+        defer(Post.content)
+    ).order_by(matches.c.rank.desc(), Post.id.desc()).all()
+
+    results = [
+        SearchResult(post, rank, highlight(headline))
+        for post, rank, headline in rows[:per_page]
+    ]
+    return results, len(rows) > per_page
@@ -0,0 +1,44 @@
+"""
+Production serving with gunicorn: worker and thread sizing, fork safety.
+
+    SECRET_KEY=... DATABASE_URL=... gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py builds the app once in the master (preload_app), so
+workers fork with the code, templates and config already loaded, and
+disposes the database engines in each worker after the fork: a worker
+must never use a connection its parent opened. Sizing, from the
+environment:
+
+    WEB_CONCURRENCY   worker processes (default: CPUs + 1)
+    WEB_THREADS       threads per worker (default: DB_POOL_SIZE, so every
+                      thread can hold a pooled connection without overflow)
+    PORT              port bound on all interfaces (default 8000)
+
+Each worker has its own pool, so the database sees up to
+WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections. The
+in-process caches (post cards, the tag catalog) are per worker too; their
+keys come from the database, so a change made in any process reaches all.
+"""
+import os
+
+from config import _env_int
+from models import db
+
+
+def worker_count(environ=os.environ, cpus=None):
+    """Worker processes: WEB_CONCURRENCY, else one per CPU plus one."""
+    return max(1, _env_int(environ, 'WEB_CONCURRENCY', (cpus or os.cpu_count() or 1) + 1))
+
+
+def thread_count(environ=os.environ):
+    """Threads per worker: WEB_THREADS, else DB_POOL_SIZE."""
+    return max(1, _env_int(environ, 'WEB_THREADS', _env_int(environ, 'DB_POOL_SIZE', 5)))
+
+
+def dispose_engines(app):
+    """
+    Drop the pooled connections of every engine of app (primary and replica
+    binds), so the next checkout in this process opens its own.
+    """
+    for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or ()):
+        db.get_engine(app, bind).dispose()
@@ -0,0 +1,78 @@
+"""Cold-start profiling: module import times and app factory phases."""
+import json
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+# "import time:  self [us] |  cumulative | imported package" (python -X importtime)
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+class StartupProfiler:
+    """Wall-clock durations of the named phases of create_app."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+
+    def __repr__(self):
+        return f"<StartupProfiler: phases={len(self.phases)}>"
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        return {
+            'total_seconds': round(time.perf_counter() - self.started, 6),
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases},
+        }
+
+
+def parse_importtime(lines):
+    """
+    Return [(module, self_seconds, cumulative_seconds, depth)] from the
+    stderr of `python -X importtime`, in import order.
+    """
+    imports = []
+    for line in lines:
+        match = IMPORTTIME_LINE.match(line.rstrip())
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us) / 1e6, int(cumulative_us) / 1e6,
+                            len(indent) // 2))
+    return imports
+
+
+def _child(profile):
+    """Runs in the profiled interpreter: import the app, build it, report."""
+    start = time.perf_counter()
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app(profile)
+    print(json.dumps({
+        'import_seconds': round(imported - start, 6),
+        'create_app': app.extensions['startup'],
+    }))
+
+
+def profile_startup(profile='production', python=sys.executable):
+    """
+    Start a fresh interpreter with -X importtime that imports and builds
+    the app, and return its report: per-module import times, the time to
+    import app.py and the create_app phases.
+    """
+    proc = subprocess.run(
+        [python, '-X', 'importtime', '-c',
+         f"import startup; startup._child({profile!r})"],
+        capture_output=True, text=True, check=True
+    )
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    report['imports'] = parse_importtime(proc.stderr.splitlines())
+    return report
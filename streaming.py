@@ -0,0 +1,73 @@
+"""Streamed rendering of listing pages."""
+from flask import current_app, get_flashed_messages, stream_with_context
+
+
+class StreamedRows:
+    """
+    Query results for a streamed template, fetched batch_size rows at a
+    time through a server-side cursor (yield_per), so a listing of any
+    length keeps one batch in memory. Notes when the template starts on
+    them, which ends the page header.
+    """
+
+    def __init__(self, query, batch_size):
+        self.query = query.yield_per(batch_size)
+        self.started = False
+
+    def __repr__(self):
+        return f"<StreamedRows: started={self.started}>"
+
+    def __iter__(self):
+        self.started = True
+        return iter(self.query)
+
+
+def _chunks(pieces, rows, buffer_size):
+    """
+    Join template output into chunks of about buffer_size characters; the
+    page header is sent piece by piece, before the first rows are fetched.
+    """
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= buffer_size or not all(streamed.started for streamed in rows):
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def on_stream_end(response, callback):
+    """
+    Call callback() once the body of the streamed response has been sent
+    in full, for after_request hooks whose figures are only complete then
+    (the rows of a streamed page are fetched while it is being sent).
+    """
+    body = response.response
+
+    def chunks():
+        yield from body
+        callback()
+
+    response.response = chunks()
+    return response
+
+
+def stream_template(template_name, **context):
+    """
+    Like render_template, but return a response that renders as it is sent:
+    the header goes out at once and the StreamedRows in context follow in
+    STREAM_BUFFER_BYTES chunks. Statements run while streaming happen after
+    the response headers, so they are not in the X-DB-* headers; the query
+    budget and request metrics take them in when the stream ends.
+    """
+    app = current_app._get_current_object()
+    # the session cookie is sent before the template runs: take the flashed
+    # messages out of it now (the template then reads them from the request)
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    rows = [value for value in context.values() if isinstance(value, StreamedRows)]
+    chunks = _chunks(template.generate(context), rows, app.config['STREAM_BUFFER_BYTES'])
+    return app.response_class(stream_with_context(chunks), mimetype='text/html')
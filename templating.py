@@ -0,0 +1,44 @@
+"""
+Template compilation: a Jinja bytecode cache and a warm-up at boot.
+
+Jinja compiles a template to Python source and then to bytecode on its
+first use in a process. Warming up compiles every template when the app
+is built, so no request pays for it. Under gunicorn the preloaded master
+does this once and the workers fork with the compiled templates. The
+bytecode cache keeps the compiled code on disk across restarts, keyed by
+template name and source checksum, so a new deploy recompiles only the
+templates that changed.
+"""
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_templates(app):
+    """
+    Set up template compilation for app:
+
+        TEMPLATE_BYTECODE_CACHE  keep compiled templates on disk
+        TEMPLATE_CACHE_DIR       where (default: a directory of the system
+                                 temp dir, per user)
+        TEMPLATE_WARMUP          compile every template now (default: unless
+                                 debugging, which reloads edited templates)
+
+    Call once the template filters are registered: compiling checks that
+    the filters a template uses exist.
+    """
+    app.config.setdefault('TEMPLATE_BYTECODE_CACHE', False)
+    app.config.setdefault('TEMPLATE_CACHE_DIR', None)
+    app.config.setdefault('TEMPLATE_WARMUP', not app.debug)
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config['TEMPLATE_CACHE_DIR']
+        )
+    if app.config['TEMPLATE_WARMUP']:
+        warm_templates(app)
+
+
+def warm_templates(app):
+    """Compile (or load from the bytecode cache) every HTML template; return how many."""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
@@ -0,0 +1,212 @@
+from unittest import TestCase
+
+from app import create_app
+from models import IdempotencyKey, Job, Post, Tag, db
+from seed import seed
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class FlaskApiTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        db.drop_all()
+        db.create_all()
+        # populate test database
+        seed()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.drop_all()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_list_posts(self):
+        with app.test_client() as client:
+            resp = client.get("/api/v1/posts")
+            data = resp.get_json()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(data['data']), Post.query.count())
+        self.assertEqual(
+            set(data['data'][0]),
+            {'id', 'title', 'content', 'created_at', 'user_id', 'version'}
+        )
+        self.assertIsNone(data['links']['next'])
+
+    def test_list_posts_sparse_fields_and_includes(self):
+        with app.test_client() as client:
+            resp = client.get("/api/v1/posts?fields=title&include=tags,user")
+            data = resp.get_json()
+
+        self.assertEqual(resp.status_code, 200)
+        # versions, page, one query per include
+        self.assertLessEqual(int(resp.headers['X-DB-Query-Count']), 4)
+        posts = {post['title']: post for post in data['data']}
+        sorcery = posts["Dr. Strange's ultimate sorcery"]
+        self.assertEqual(set(sorcery), {'id', 'title', 'tags', 'user'})
+        self.assertEqual([tag['name'] for tag in sorcery['tags']], ['secret', 'sorcery'])
+        self.assertEqual(sorcery['user']['last_name'], 'Strange')
+
+    def test_list_posts_excerpt_field(self):
+        with app.test_client() as client:
+            data = client.get("/api/v1/posts?fields=title,excerpt").get_json()
+
+        posts = {post['title']: post for post in data['data']}
+        self.assertEqual(set(posts["Batman's ability"]), {'id', 'title', 'excerpt'})
+        self.assertEqual(posts["Batman's ability"]['excerpt'], "Batman is rich.")
+
+    def test_list_posts_pagination(self):
+        with app.test_client() as client:
+            seen = []
+            url = "/api/v1/posts?limit=2&fields=title"
+            while url:
+                data = client.get(url).get_json()
+                seen.extend(post['id'] for post in data['data'])
+                url = data['links']['next']
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), Post.query.count())
+
+    def test_etag_not_modified(self):
+        with app.test_client() as client:
+            first = client.get("/api/v1/tags")
+            second = client.get(
+                "/api/v1/tags", headers={'If-None-Match': first.headers['ETag']}
+            )
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.get_data(), b'')
+        # answered from the table versions alone
+        self.assertEqual(second.headers['X-DB-Query-Count'], '1')
+
+    def test_etag_follows_included_tables(self):
+        with app.test_client() as client:
+            first = client.get("/api/v1/posts/2?include=tags")
+            secret = Tag.query.filter_by(name="secret").one().id
+            client.patch(f"/api/v1/tags/{secret}", json={"name": "hidden", "version": 1})
+            second = client.get(
+                "/api/v1/posts/2?include=tags", headers={'If-None-Match': first.headers['ETag']}
+            )
+            # restore the seeded tag for the other tests
+            client.patch(f"/api/v1/tags/{secret}", json={"name": "secret", "version": 2})
+
+        self.assertEqual(second.status_code, 200)
+        self.assertIn('hidden', [tag['name'] for tag in second.get_json()['data']['tags']])
+
+    def test_etag_changes_with_data(self):
+        with app.test_client() as client:
+            first = client.get("/api/v1/users/1")
+            client.post("/users/1/edit", data={"first_name": "Vincent", "last_name": "Strange"})
+            second = client.get(
+                "/api/v1/users/1", headers={'If-None-Match': first.headers['ETag']}
+            )
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.get_json()['data']['first_name'], 'Vincent')
+
+    def test_bad_requests(self):
+        with app.test_client() as client:
+            bad_field = client.get("/api/v1/users?fields=password")
+            bad_include = client.get("/api/v1/tags?include=posts")
+            missing = client.get("/api/v1/posts/999")
+
+        self.assertEqual(bad_field.status_code, 400)
+        self.assertIn('password', bad_field.get_json()['error'])
+        self.assertEqual(bad_include.status_code, 400)
+        self.assertEqual(missing.status_code, 404)
+
+    def test_update_with_version(self):
+        post = Post.query.filter_by(title="Batman's ability").one()
+        url = f"/api/v1/posts/{post.id}"
+        with app.test_client() as client:
+            version = client.get(url).get_json()['data']['version']
+            updated = client.patch(url, json={'title': "Bat skills", 'version': version})
+            stale = client.patch(url, json={'title': "Lost update", 'version': version})
+            missing = client.patch(url, json={'title': "Blind write"})
+            readonly = client.patch(url, json={'user_id': 1, 'version': version + 1})
+        db.session.expire_all()
+
+        self.assertEqual(updated.status_code, 200)
+        self.assertEqual(updated.get_json()['data']['title'], "Bat skills")
+        self.assertEqual(updated.get_json()['data']['version'], version + 1)
+        self.assertEqual(stale.status_code, 409)
+        self.assertIn(f"current version is {version + 1}", stale.get_json()['error'])
+        self.assertEqual(missing.status_code, 428)
+        self.assertEqual(readonly.status_code, 400)
+        self.assertEqual(Post.query.get(post.id).title, "Bat skills")
+
+
+
+class BulkPostsApiTests(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        seed()
+        self.batch = {'data': [
+            {'title': "Portal maintenance", 'content': "...", 'user_id': 1,
+             'tags': ['sorcery', 'portals']},
+            {'title': "Cave cleanup", 'content': "...", 'user_id': 2},
+        ]}
+
+    def tearDown(self):
+        db.session.rollback()
+        db.drop_all()
+
+    def test_create_posts(self):
+        with app.test_client() as client:
+            resp = client.post("/api/v1/posts", json=self.batch)
+            data = resp.get_json()['data']
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertLessEqual(int(resp.headers['X-DB-Query-Count']), 8)
+        self.assertEqual([post['title'] for post in data],
+                         ["Portal maintenance", "Cave cleanup"])
+        portal = Post.query.get(data[0]['id'])
+        self.assertEqual(sorted(tag.name for tag in portal.tags), ['portals', 'sorcery'])
+        self.assertEqual(Post.query.get(data[1]['id']).tags, [])
+        self.assertEqual(Tag.query.filter_by(name='sorcery').one().post_count, 2)
+        self.assertEqual(
+            Job.query.filter_by(kind='refresh_related_posts').one().payload,
+            {'post_ids': [data[0]['id']]}
+        )
+
+    def test_retry_with_idempotency_key(self):
+        headers = {'Idempotency-Key': 'batch-1'}
+        with app.test_client() as client:
+            first = client.post("/api/v1/posts", json=self.batch, headers=headers)
+            retry = client.post("/api/v1/posts", json=self.batch, headers=headers)
+            self.batch['data'].pop()
+            reused = client.post("/api/v1/posts", json=self.batch, headers=headers)
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(reused.status_code, 422)
+        self.assertEqual(Post.query.count(), 5)
+
+    def test_invalid_batch_writes_nothing(self):
+        self.batch['data'].append({'title': "Ghost post", 'content': "...", 'user_id': 99})
+        headers = {'Idempotency-Key': 'batch-2'}
+        with app.test_client() as client:
+            unknown_user = client.post("/api/v1/posts", json=self.batch, headers=headers)
+            self.batch['data'].pop()
+            self.batch['data'][1]['title'] = ''
+            untitled = client.post("/api/v1/posts", json=self.batch)
+            empty = client.post("/api/v1/posts", json={'data': []})
+
+        self.assertEqual(unknown_user.status_code, 422)
+        self.assertIn('unknown users: 99', unknown_user.get_json()['error'])
+        self.assertEqual(untitled.status_code, 422)
+        self.assertIn('data[1]', untitled.get_json()['error'])
+        self.assertEqual(empty.status_code, 400)
+        self.assertEqual(Post.query.count(), 3)
+        self.assertIsNone(Tag.query.filter_by(name='portals').first())
+        # the key of the failed request was not kept
+        self.assertEqual(IdempotencyKey.query.count(), 0)
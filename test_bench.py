@@ -0,0 +1,72 @@
+import logging
+import random
+from collections import Counter
+from unittest import TestCase
+
+from app import create_app
+from bench.datagen import DatasetSpec, Zipf, generate_posts, load_dataset, sample_ids
+from bench.run import QueryLog, Scenario, run_client, summarize
+from models import Post, PostTag, Tag, User, db
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class BloglyBenchTests(TestCase):
+
+    def tearDown(self):
+        db.session.rollback()
+        db.drop_all()
+
+    def test_dataset_is_deterministic(self):
+        spec = DatasetSpec(users=20, posts=50, tags=10, seed=7)
+
+        self.assertEqual(list(generate_posts(spec)), list(generate_posts(spec)))
+        self.assertNotEqual(
+            list(generate_posts(spec)),
+            list(generate_posts(DatasetSpec(users=20, posts=50, tags=10, seed=8)))
+        )
+        self.assertEqual(sample_ids(spec, 30, 'x', skew=1.1), sample_ids(spec, 30, 'x', skew=1.1))
+
+    def test_zipf_is_skewed(self):
+        zipf = Zipf(100, 1.2, random.Random(1))
+
+        counts = Counter(zipf.sample() for _ in range(5000))
+
+        self.assertEqual(counts.most_common(1)[0][0], 0)
+        self.assertGreater(counts[0], 10 * counts[50])
+        self.assertEqual(len(zipf.sample_distinct(5)), 5)
+
+    def test_load_dataset(self):
+        spec = DatasetSpec(users=20, posts=200, tags=10)
+
+        counts = load_dataset(spec)
+
+        self.assertEqual(counts['posts'], 200)
+        self.assertEqual(User.query.count(), 20)
+        self.assertEqual(Post.query.count(), 200)
+        for tag in Tag.query:
+            self.assertEqual(tag.post_count, PostTag.query.filter_by(tag_id=tag.id).count())
+
+    def test_streamed_pages_count_their_queries(self):
+        load_dataset(DatasetSpec(users=5, posts=20, tags=5))
+        query_log = QueryLog()
+        sql_logger = logging.getLogger('blogly.sql')
+        level, sql_logger.level = sql_logger.level, logging.INFO
+        sql_logger.addHandler(query_log)
+        try:
+            measured = run_client(app, Scenario('tags', 'tags_view', ['/tags'] * 3), query_log)
+        finally:
+            sql_logger.removeHandler(query_log)
+            sql_logger.setLevel(level)
+
+        summary = summarize(*measured, budget=1)
+        # the version lookup, then the rows fetched while streaming
+        self.assertEqual(summary['max_queries'], 2)
+        self.assertTrue(summary['over_budget'])
+
+    def test_missing_query_counts_are_not_budget_checked(self):
+        summary = summarize([0.01, 0.02], [1, None], 0, 1.0, budget=1)
+
+        self.assertEqual((summary['max_queries'], summary['unmeasured_queries']), (1, 1))
+        self.assertFalse(summary['over_budget'])
@@ -0,0 +1,195 @@
+import datetime
+import json
+from unittest import TestCase
+
+from app import create_app
+from cli import export_records, import_records, rebuild_post_summaries
+from http_cache import table_versions
+from models import EXCERPT_LENGTH, IdempotencyKey, Post, PostTag, Tag, User, UserPostSummary, db
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class BloglyCliTests(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        self.runner = app.test_cli_runner()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.drop_all()
+
+    def test_import_export_round_trip(self):
+        users = "\n".join(json.dumps(record) for record in [
+            {"id": 1, "first_name": "Stephen", "last_name": "Strange"},
+            {"id": 2, "first_name": "Bruce", "last_name": "Wayne", "image_url": None},
+        ])
+        posts = "\n".join(json.dumps(record) for record in [
+            {"title": "Net worth", "content": "...", "user_id": 1,
+             "created_at": "2018-05-10T09:50:00", "tags": ["wealth", "secret"]},
+            {"title": "Ability", "content": "Batman is rich.", "user_id": 2,
+             "tags": ["wealth"]},
+            {"title": "Untagged", "content": "nothing", "user_id": 2},
+        ])
+
+        result = self.runner.invoke(args=['blogly', 'import', 'users', '-'], input=users)
+        self.assertEqual(result.exit_code, 0, result.output)
+        result = self.runner.invoke(
+            args=['blogly', 'import', 'posts', '-', '--chunk-size', '2'], input=posts
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('rows/sec', result.output)
+
+        self.assertEqual(User.query.count(), 2)
+        self.assertIsNone(User.query.get(2).image_url)
+        self.assertEqual(Post.query.count(), 3)
+        self.assertEqual({tag.name for tag in Tag.query}, {"wealth", "secret"})
+        self.assertEqual(PostTag.query.count(), 3)
+        # imported ids do not collide with rows created afterwards
+        db.session.add(User(first_name="Tony", last_name="Stark"))
+        db.session.commit()
+
+        summaries = {summary.title: summary.tag_names for summary in UserPostSummary.query}
+        self.assertEqual(rebuild_post_summaries(), 3)
+        db.session.expire_all()
+        self.assertEqual(
+            {summary.title: summary.tag_names for summary in UserPostSummary.query}, summaries
+        )
+        self.assertEqual(summaries['Net worth'], ["secret", "wealth"])
+
+        exported = {record['title']: record for record in export_records('posts', 1)}
+        self.assertEqual(sorted(exported['Net worth']['tags']), ["secret", "wealth"])
+        self.assertEqual(exported['Untagged']['tags'], [])
+
+    def test_export_csv(self):
+        import_records('tags', [{"name": "secret"}, {"name": "sorcery"}])
+
+        result = self.runner.invoke(args=['blogly', 'export', 'tags', '--format', 'csv'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("id,name", result.output)
+        self.assertIn("sorcery", result.output)
+
+    def test_migrate_content_compression(self):
+        result = self.runner.invoke(
+            args=['blogly', 'migrate', '--content-compression', 'pglz']
+        )
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(db.session.execute(
+            "SELECT attcompression FROM pg_attribute "
+            "WHERE attrelid = 'posts'::regclass AND attname = 'content'"
+        ).scalar(), 'p')
+
+    def test_migrate_creates_change_triggers(self):
+        # as left by a database created before the triggers
+        for table in ('users', 'posts', 'tags', 'posts_tags'):
+            for event in ('insert', 'update', 'delete'):
+                db.session.execute(f"DROP TRIGGER {table}_version_{event} ON {table}")
+        db.session.commit()
+
+        result = self.runner.invoke(args=['blogly', 'migrate'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        users = table_versions(('users',))['users']
+        db.session.add(User(first_name="Wanda", last_name="Maximoff"))
+        db.session.commit()
+        self.assertEqual(table_versions(('users',))['users'], users + 1)
+        self.assertEqual(db.session.execute(
+            "SELECT count(*) FROM information_schema.triggers "
+            "WHERE trigger_name ~ '_version_(insert|update|delete)$'"
+        ).scalar(), 15)
+
+    def test_migrate_upgrades_baseline_database(self):
+        # the schema and data of the first release
+        db.drop_all()
+        db.session.execute("""
+            CREATE TABLE users (
+                id SERIAL PRIMARY KEY, first_name VARCHAR(32) NOT NULL,
+                last_name VARCHAR(32) NOT NULL, image_url TEXT,
+                CHECK (image_url LIKE 'http%')
+            );
+            CREATE TABLE posts (
+                id SERIAL PRIMARY KEY, title VARCHAR(128) NOT NULL, content TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                user_id INTEGER REFERENCES users (id) ON DELETE CASCADE
+            );
+            CREATE TABLE tags (id SERIAL PRIMARY KEY, name VARCHAR(32) NOT NULL UNIQUE);
+            CREATE TABLE posts_tags (
+                post_id INTEGER REFERENCES posts (id) ON DELETE CASCADE,
+                tag_id INTEGER REFERENCES tags (id) ON DELETE CASCADE,
+                PRIMARY KEY (post_id, tag_id)
+            );
+            INSERT INTO users (first_name, last_name) VALUES ('Bruce', 'Wayne');
+            INSERT INTO posts (title, content, created_at, user_id)
+                VALUES ('Batcave', 'Bats in the cave', now(), 1),
+                       ('Gotham', 'A city', now(), 1);
+            INSERT INTO tags (name) VALUES ('bats'), ('city');
+            INSERT INTO posts_tags VALUES (1, 1), (2, 1), (2, 2);
+        """)
+        db.session.commit()
+
+        result = self.runner.invoke(args=['blogly', 'migrate'])
+        again = self.runner.invoke(args=['blogly', 'migrate'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(again.exit_code, 0, again.output)
+        db.session.expire_all()
+        self.assertEqual({tag.name: tag.post_count for tag in Tag.query},
+                         {'bats': 2, 'city': 1})
+        self.assertEqual(UserPostSummary.query.get(2).tag_names, ['bats', 'city'])
+        with app.test_client() as client:
+            home = client.get("/home")
+            tags = client.get("/tags")
+            search = client.get("/search?q=cave")
+            self.assertEqual(home.status_code, 200)
+            self.assertIn('Bruce Wayne', home.get_data(as_text=True))
+            self.assertIn('>bats</a>', tags.get_data(as_text=True))
+            self.assertEqual(search.status_code, 200)
+            self.assertIn('Batcave', search.get_data(as_text=True))
+
+            # the triggers run: edits move the ETags and the counts
+            etag = client.get("/tags").headers['ETag']
+            db.session.add(Tag(name='caves'))
+            db.session.commit()
+            self.assertNotEqual(client.get("/tags").headers['ETag'], etag)
+
+    def test_migrate_adds_post_excerpt(self):
+        user = User(first_name="Stephen", last_name="Strange")
+        db.session.add(Post(title="Short", content="Sorcery", user=user))
+        db.session.commit()
+        # as left by a version without posts.excerpt
+        db.session.execute("ALTER TABLE posts DROP COLUMN excerpt")
+        db.session.commit()
+
+        result = self.runner.invoke(args=['blogly', 'migrate'])
+        again = self.runner.invoke(args=['blogly', 'migrate'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(again.exit_code, 0, again.output)
+        db.session.expire_all()
+        self.assertEqual(Post.query.filter_by(title="Short").one().excerpt, "Sorcery")
+        db.session.add(Post(title="Long", content="x" * 500, user=user))
+        db.session.commit()
+        self.assertEqual(
+            len(Post.query.filter_by(title="Long").one().excerpt), EXCERPT_LENGTH
+        )
+
+    def test_purge_idempotency_keys(self):
+        now = datetime.datetime.utcnow()
+        db.session.add_all([
+            IdempotencyKey(scope='posts', key='old', request_hash='0' * 64,
+                           created_at=now - datetime.timedelta(days=2)),
+            IdempotencyKey(scope='posts', key='new', request_hash='0' * 64,
+                           created_at=now),
+        ])
+        db.session.commit()
+
+        result = self.runner.invoke(args=['blogly', 'purge-idempotency-keys'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("purged 1 idempotency keys", result.output)
+        self.assertEqual([key.key for key in IdempotencyKey.query], ['new'])
@@ -0,0 +1,100 @@
+from unittest import TestCase
+
+from app import create_app
+from config import database_config, profile_config
+from models import db
+from pool_metrics import InstrumentedQueuePool
+from startup import parse_importtime
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class DatabaseConfigTests(TestCase):
+
+    def test_defaults(self):
+        config = database_config({})
+
+        self.assertEqual(config['SQLALCHEMY_DATABASE_URI'], 'postgres:///blogly')
+        self.assertEqual(config['SQLALCHEMY_BINDS'], {})
+        options = config['SQLALCHEMY_ENGINE_OPTIONS']
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], 5)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertNotIn('connect_args', options)
+
+    def test_environment_overrides(self):
+        config = database_config({
+            'DATABASE_URL': 'postgresql://primary/blogly',
+            'DATABASE_REPLICA_URLS': 'postgresql://r1/blogly, postgresql://r2/blogly',
+            'DB_POOL_SIZE': '20',
+            'DB_MAX_OVERFLOW': '0',
+            'DB_POOL_PRE_PING': 'false',
+            'DB_STATEMENT_TIMEOUT_MS': '5000',
+        })
+
+        self.assertEqual(config['SQLALCHEMY_BINDS'], {
+            'replica_0': 'postgresql://r1/blogly',
+            'replica_1': 'postgresql://r2/blogly',
+        })
+        options = config['SQLALCHEMY_ENGINE_OPTIONS']
+        self.assertEqual(options['pool_size'], 20)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=5000'})
+
+    def test_sqlite_skips_pool_sizing(self):
+        options = database_config({'DATABASE_URL': 'sqlite://'})['SQLALCHEMY_ENGINE_OPTIONS']
+
+        self.assertNotIn('pool_size', options)
+
+    def test_pool_status_view(self):
+        db.session.execute("SELECT 1")
+        db.session.commit()
+        with app.test_client() as client:
+            resp = client.get("/status/pool")
+            data = resp.get_json()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['primary']['pool_class'], 'InstrumentedQueuePool')
+        self.assertGreaterEqual(data['primary']['checkouts'], 1)
+        self.assertGreaterEqual(data['primary']['connects'], 1)
+
+
+class AppFactoryTests(TestCase):
+
+    def tearDown(self):
+        # create_app rebinds the db object to the newest app
+        db.app = app
+
+    def test_profiles(self):
+        self.assertEqual(
+            profile_config('test', {})['SQLALCHEMY_DATABASE_URI'], 'postgresql:///blogly_test'
+        )
+        self.assertTrue(profile_config('dev', {})['DEBUG'])
+        self.assertFalse(profile_config('bench', {})['DEBUG'])
+        with self.assertRaises(RuntimeError):
+            profile_config('production', {})
+        with self.assertRaises(ValueError):
+            profile_config('staging', {})
+
+    def test_create_app_does_not_connect(self):
+        bench = create_app('bench', SQLALCHEMY_DATABASE_URI='postgresql://nowhere.invalid/blogly')
+
+        self.assertFalse(bench.debug)
+        self.assertNotIn('debugtoolbar', bench.blueprints)
+        self.assertIn('home_view', bench.view_functions)
+        self.assertEqual(
+            set(bench.extensions['startup']['phases']),
+            {'config', 'extensions', 'views', 'templates'}
+        )
+        self.assertIn('debugtoolbar', create_app('dev').blueprints)
+
+    def test_parse_importtime(self):
+        imports = parse_importtime([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       120 |        120 |   _weakref",
+            "import time:      1500 |       2000 | flask",
+        ])
+
+        self.assertEqual(imports, [('_weakref', 0.00012, 0.00012, 1), ('flask', 0.0015, 0.002, 0)])
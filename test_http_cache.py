@@ -0,0 +1,119 @@
+from unittest import TestCase
+
+from app import create_app
+from http_cache import compact_table_changes, table_versions
+from models import Post, Tag, TableChange, db
+from seed import seed
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class FlaskHttpCacheTests(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        # populate test database
+        seed()
+        self.post_id = Post.query.first().id
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        db.drop_all()
+
+    def version(self, name):
+        db.session.commit()
+        return table_versions((name,))[name]
+
+    def test_writes_bump_table_versions(self):
+        posts, tags = self.version('posts'), self.version('tags')
+
+        db.session.execute("UPDATE posts SET title = title WHERE id = -1")
+        db.session.commit()
+        self.assertEqual(self.version('posts'), posts)
+
+        Post.query.get(self.post_id).title = "Renamed"
+        db.session.commit()
+        self.assertEqual(self.version('posts'), posts + 1)
+        self.assertEqual(self.version('tags'), tags)
+
+    def test_writers_do_not_wait_on_versions(self):
+        other = Post.query.filter(Post.id != self.post_id).first().id
+        posts = self.version('posts')
+        with db.engine.connect() as first, db.engine.connect() as second:
+            with first.begin():
+                first.execute("UPDATE posts SET title = 'First' WHERE id = %s", self.post_id)
+                with second.begin():
+                    second.execute("SET LOCAL lock_timeout = '1s'")
+                    second.execute("UPDATE posts SET title = 'Second' WHERE id = %s", other)
+                # neither change counts until its transaction commits
+                self.assertEqual(self.version('posts'), posts + 1)
+        self.assertEqual(self.version('posts'), posts + 2)
+
+    def test_compaction_keeps_versions(self):
+        for title in ("One", "Two", "Three"):
+            Post.query.get(self.post_id).title = title
+            db.session.commit()
+        versions = table_versions(('posts', 'tags'))
+
+        self.assertGreater(compact_table_changes(), 0)
+
+        self.assertEqual(table_versions(('posts', 'tags')), versions)
+        self.assertEqual(TableChange.query.filter_by(name='posts').count(), 1)
+
+    def test_not_modified(self):
+        with app.test_client() as client:
+            resp = client.get(f"/posts/{self.post_id}")
+            etag = resp.headers['ETag']
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn('Last-Modified', resp.headers)
+            self.assertIn('public', resp.headers['Cache-Control'])
+            self.assertIn('s-maxage=30', resp.headers['Cache-Control'])
+
+            resp = client.get(f"/posts/{self.post_id}", headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+            self.assertEqual(resp.headers['X-DB-Query-Count'], '1')
+
+            # dates are not trusted: only the ETag can validate
+            resp = client.get(f"/posts/{self.post_id}", headers={
+                'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'
+            })
+            self.assertEqual(resp.status_code, 200)
+
+    def test_write_changes_etag(self):
+        with app.test_client() as client:
+            home = client.get("/home").headers['ETag']
+            tags = client.get("/tags").headers['ETag']
+
+            tag = Tag.query.first()
+            tag.name = "renamed"
+            db.session.commit()
+
+            resp = client.get("/home", headers={'If-None-Match': home})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], home)
+            self.assertEqual(client.get("/tags", headers={'If-None-Match': tags}).status_code, 200)
+            self.assertEqual(client.get("/users", headers={
+                'If-None-Match': client.get("/users").headers['ETag']
+            }).status_code, 304)
+
+    def test_etag_depends_on_arguments(self):
+        with app.test_client() as client:
+            self.assertNotEqual(
+                client.get("/tags/top?n=1").headers['ETag'],
+                client.get("/tags/top?n=2").headers['ETag']
+            )
+
+    def test_flashed_page_is_not_cached(self):
+        with app.test_client() as client:
+            resp = client.post(f"/posts/{self.post_id}/edit",
+                               data={"title": "", "content": ""},
+                               follow_redirects=True)
+
+            self.assertNotIn('ETag', resp.headers)
+            self.assertIn('no-store', resp.headers['Cache-Control'])
@@ -0,0 +1,155 @@
+import datetime
+import re
+from unittest import TestCase
+
+import jobs
+from app import create_app
+from models import Job, Post, PostTag, Tag, User, db
+from seed import seed
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+@jobs.handler('test_fail')
+def fail(job):
+    raise RuntimeError("boom")
+
+
+class FlaskJobTests(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        # populate test database
+        seed()
+        # queue every delete/retag; run each chunk on a single row
+        self.config = dict(app.config)
+        app.config.update(JOB_INLINE_MAX_ROWS=0, JOB_CHUNK_SIZE=1)
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        app.config.update(self.config)
+        db.session.rollback()
+        db.drop_all()
+
+    def test_delete_user_in_background(self):
+        with app.test_client() as client:
+            resp = client.post("/users/1/delete", follow_redirects=True)
+            html = resp.get_data(as_text=True)
+
+            # hidden while the job is pending
+            self.assertIn("in the background", html)
+            self.assertNotIn("Strange", html)
+            self.assertEqual(client.get("/users/1").status_code, 404)
+            self.assertNotIn("Dr. Strange", client.get("/home").get_data(as_text=True))
+            self.assertEqual(
+                {post['user_id'] for post in client.get("/api/v1/posts").json['data']}, {2}
+            )
+            self.assertEqual(Post.query.filter_by(user_id=1).count(), 2)
+
+            self.assertEqual(jobs.work(burst=True), 1)
+
+            job = Job.query.one()
+            self.assertEqual(job.status, 'done')
+            self.assertEqual((job.progress_done, job.progress_total), (3, 3))
+            self.assertIsNone(User.query.get(1))
+            self.assertEqual(Post.query.count(), 1)
+            self.assertEqual(client.get(f"/jobs/{job.id}").json['status'], 'done')
+
+    def test_edit_tag_in_background(self):
+        tag_id = Tag.query.filter_by(name='secret').one().id
+        post_ids = [post.id for post in Post.query.filter(Post.title.like("Dr.%"))]
+
+        with app.test_client() as client:
+            client.post(f"/tags/{tag_id}/edit",
+                        data={"name": "hidden", "shown": [1, 2, 3], "posts": post_ids})
+
+        db.session.expire_all()
+        self.assertEqual(Tag.query.get(tag_id).name, "hidden")
+        self.assertEqual(Tag.query.get(tag_id).post_count, 2)
+
+        with app.app_context():
+            jobs.work(burst=True)
+
+        job = Job.query.one()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.progress_done, job.progress_total), (2, 2))
+        self.assertEqual(
+            {link.post_id for link in PostTag.query.filter_by(tag_id=tag_id)},
+            set(post_ids)
+        )
+
+    def home_tags(self, client):
+        """{post title: tag names} of the cards on /home."""
+        html = client.get("/home").get_data(as_text=True)
+        return {
+            title: re.findall(r'badge-info">([^<]*)<', badges) for title, badges in re.findall(
+                r'card-title text-center">([^<]*)</h3>.*?text-right">(.*?)</p>', html, re.S
+            )
+        }
+
+    def test_edited_tag_reaches_home_cards(self):
+        tag_id = Tag.query.filter_by(name='secret').one().id
+        post_ids = [post.id for post in Post.query.filter(Post.title.like("Dr.%"))]
+
+        with app.test_client() as client:
+            before = self.home_tags(client)
+            client.post(f"/tags/{tag_id}/edit",
+                        data={"name": "hidden", "shown": [1, 2, 3], "posts": post_ids})
+            # renamed with the request, relinked by the job
+            renamed = self.home_tags(client)
+            with app.app_context():
+                jobs.work(burst=True)
+            relinked = self.home_tags(client)
+
+        self.assertIn('secret', before["Batman&#39;s ability"])
+        self.assertIn('hidden', renamed["Batman&#39;s ability"])
+        self.assertNotIn('secret', sum(renamed.values(), []))
+        self.assertNotIn('hidden', relinked["Batman&#39;s ability"])
+        self.assertIn('hidden', relinked["Dr. Strange&#39;s net worth"])
+        self.assertIn('hidden', relinked["Dr. Strange&#39;s ultimate sorcery"])
+
+    def test_newer_job_supersedes_pending_one(self):
+        first = jobs.enqueue('sync_tag_posts', {'tag_id': 1, 'post_ids': []}, key='tag:1')
+        db.session.commit()
+        jobs.enqueue('sync_tag_posts', {'tag_id': 1, 'post_ids': []}, key='tag:1')
+        db.session.commit()
+
+        self.assertEqual(Job.query.get(first.id).status, 'cancelled')
+        with app.app_context():
+            self.assertEqual(jobs.work(burst=True), 1)
+
+    def test_same_key_jobs_do_not_run_concurrently(self):
+        running = Job(kind='test_fail', key='tag:1', status='running',
+                      locked_at=datetime.datetime.utcnow())
+        db.session.add_all([running, Job(kind='test_fail', key='tag:1')])
+        db.session.commit()
+
+        with app.app_context():
+            self.assertIsNone(jobs.claim('test'))
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = jobs.enqueue('test_fail', {})
+        job.max_attempts = 2
+        db.session.commit()
+        job_id = job.id
+
+        with app.app_context():
+            jobs.work(burst=True)
+
+        job = Job.query.get(job_id)
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_at, datetime.datetime.utcnow())
+
+        job.run_at = datetime.datetime.utcnow()
+        db.session.commit()
+        with app.app_context():
+            jobs.work(burst=True)
+
+        job = Job.query.get(job_id)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 2)
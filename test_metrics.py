@@ -0,0 +1,121 @@
+import json
+import os
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from app import create_app
+from metrics import Metrics
+from models import db
+from seed import seed
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class MetricsEndpointTests(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        seed()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.drop_all()
+
+    def test_request_metrics(self):
+        with app.test_client() as client:
+            client.get("/tags/cloud")
+            resp = client.get("/metrics")
+            text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE blogly_http_request_duration_seconds histogram', text)
+        self.assertRegex(
+            text, r'blogly_http_requests_total\{endpoint="tag_cloud_view",'
+                  r'method="GET",status="200"\} [1-9]'
+        )
+        self.assertRegex(
+            text, r'blogly_http_request_duration_seconds_bucket\{'
+                  r'endpoint="tag_cloud_view",le="\+Inf"\} [1-9]'
+        )
+        for family in ('db_seconds', 'template_seconds'):
+            self.assertRegex(
+                text, rf'blogly_http_request_{family}_count\{{endpoint="tag_cloud_view"\}} [1-9]'
+            )
+        self.assertRegex(
+            text, r'blogly_http_response_size_bytes_sum\{endpoint="tag_cloud_view"\} [1-9]'
+        )
+        self.assertRegex(
+            text, r'blogly_template_render_seconds_count\{template="tag_cloud.html"\} [1-9]'
+        )
+        # the scrape itself is in flight
+        self.assertIn('blogly_http_requests_in_flight 1\n', text)
+
+    def test_handled_errors_are_counted(self):
+        with app.test_client() as client:
+            client.post("/users/999/posts/new", data={"title": "Orphan", "content": "..."})
+            text = client.get("/metrics").get_data(as_text=True)
+
+        self.assertRegex(
+            text, r'blogly_handled_errors_total\{endpoint="new_post_view",'
+                  r'error="IntegrityError"\} [1-9]'
+        )
+
+
+class MultiProcessMetricsTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.metrics = Metrics(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_worker_file(self, pid):
+        with open(os.path.join(self.directory.name, f"{pid}.json"), 'w') as file:
+            json.dump({
+                'pid': pid,
+                'values': [
+                    ['blogly_http_requests_total', [['endpoint', 'home_view']], 2],
+                    ['blogly_http_requests_in_flight', [], 3],
+                ],
+                'histograms': [[
+                    'blogly_http_response_size_bytes', [['endpoint', 'home_view']],
+                    [1, 0, 0, 0, 0, 0, 0, 0, 100.0, 1],
+                ]],
+            }, file)
+
+    def test_processes_are_summed(self):
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        self.write_worker_file(exited.pid)
+        self.metrics.inc('blogly_http_requests_total', [('endpoint', 'home_view')])
+        self.metrics.inc('blogly_http_requests_in_flight')
+        self.metrics.observe('blogly_http_response_size_bytes', 2000,
+                             [('endpoint', 'home_view')])
+
+        text = self.metrics.expose()
+
+        self.assertIn('blogly_http_requests_total{endpoint="home_view"} 3\n', text)
+        # the gauge of the exited worker is dropped
+        self.assertIn('blogly_http_requests_in_flight 1\n', text)
+        self.assertIn(
+            'blogly_http_response_size_bytes_bucket{endpoint="home_view",le="256"} 1\n', text
+        )
+        self.assertIn(
+            'blogly_http_response_size_bytes_bucket{endpoint="home_view",le="4096"} 2\n', text
+        )
+        self.assertIn('blogly_http_response_size_bytes_sum{endpoint="home_view"} 2100.0\n', text)
+
+    def test_forked_worker_starts_empty(self):
+        self.metrics.inc('blogly_http_requests_in_flight')
+        # as seen from a child forked after the increment
+        self.metrics._pid = -1
+
+        self.metrics.flush(force=True)
+
+        with open(os.path.join(self.directory.name, f"{os.getpid()}.json")) as file:
+            self.assertEqual(json.load(file)['values'], [])
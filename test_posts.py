@@ -1,21 +1,20 @@
+import re
 import subprocess
 from unittest import TestCase
 
 
 from flask import escape
+from sqlalchemy import event, exc
+from sqlalchemy.orm import selectinload
 
-from app import app
-from models import Post, User, db
+from app import create_app
+from fragment_cache import FragmentCache, LRUBackend
+from instrumentation import QueryBudgetExceeded
+from models import EXCERPT_LENGTH, Post, Tag, User, UserPostSummary, db
+from seed import seed
 
-# Use test database and don't clutter tests with SQL
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
-app.config['SQLALCHEMY_ECHO'] = False
-
-# Make Flask errors be real errors, rather than HTML pages with error info
-app.config['TESTING'] = True
-
-# This is a bit of hack, but don't use Flask DebugToolbar
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
 
 
 class FlaskPostTests(TestCase):
@@ -25,8 +24,7 @@ class FlaskPostTests(TestCase):
         db.drop_all()
         db.create_all()
         # populate test database
-        with open('seed.py', "r") as f:
-            exec(f.read())
+        seed()
 
     @classmethod
     def tearDownClass(cls):
@@ -58,6 +56,217 @@ class FlaskPostTests(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIn(f'<a href="/posts/{self.post_id}">', html)
 
+    def test_user_detail_view_pagination(self):
+        with app.test_client() as client:
+            resp = client.get(f"/users/{self.user_id}?limit=1")
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            # table versions, user, one range read of the summaries
+            self.assertEqual(resp.headers['X-DB-Query-Count'], '3')
+
+            seen = 0
+            pattern = rf'href="(/users/{self.user_id}\?before=[^"]+)"'
+            while True:
+                self.assertEqual(html.count('<li>'), 1)
+                seen += 1
+                match = re.search(pattern, html)
+                if not match:
+                    break
+                html = client.get(match.group(1).replace('&amp;', '&')).get_data(as_text=True)
+
+        self.assertEqual(seen, Post.query.filter_by(user_id=self.user_id).count())
+
+    def test_user_post_summaries_follow_writes(self):
+        def summary():
+            db.session.expire_all()
+            return UserPostSummary.query.get(self.post_id)
+
+        secret, sorcery = (Tag.query.filter_by(name=name).one() for name in ('secret', 'sorcery'))
+        sorcery_post_ids = [post.id for post in sorcery.posts]
+
+        self.assertEqual((summary().title, summary().tag_names), (self.post_title, []))
+        with app.test_client() as client:
+            client.post(f"/posts/{self.post_id}/edit",
+                        data={"title": "Summarized", "content": self.post_content,
+                              "tags": [secret.id, sorcery.id]})
+            self.assertEqual(summary().title, "Summarized")
+            self.assertEqual(summary().tag_names, ["secret", "sorcery"])
+
+            client.post(f"/tags/{sorcery.id}/edit",
+                        data={"name": "magic", "posts": sorcery_post_ids + [self.post_id]})
+            self.assertEqual(summary().tag_names, ["magic", "secret"])
+            # restore the seeded tag for the other tests
+            client.post(f"/tags/{sorcery.id}/edit",
+                        data={"name": "sorcery", "shown": [self.post_id], "posts": sorcery_post_ids})
+            self.assertEqual(summary().tag_names, ["secret"])
+
+            client.post(f"/posts/{self.post_id}/delete")
+        self.assertIsNone(summary())
+
+    def test_home_view(self):
+        with app.test_client() as client:
+            resp = client.get("/home")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(f'<h3 class="card-title text-center">{escape(self.post_title)}</h3>', html)
+        self.assertIn('<span class="badge badge-info">sorcery</span>', html)
+
+    def test_home_view_shows_excerpt_without_content(self):
+        long_post = Post(title="Long read", content="spell " * 100, user_id=2)
+        db.session.add(long_post)
+        db.session.commit()
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            with app.test_client() as client:
+                html = client.get("/home").get_data(as_text=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+            db.session.delete(long_post)
+            db.session.commit()
+
+        excerpt = ("spell " * 100)[:EXCERPT_LENGTH - 1] + "\u2026"
+        self.assertIn(f'<p class="card-text">{excerpt}</p>', html)
+        self.assertIn(f'<p class="card-text">{escape(self.post_content)}</p>', html)
+        self.assertFalse([sql for sql in statements if 'posts.content' in sql])
+
+    def test_excerpt_follows_content(self):
+        post = Post.query.get(self.post_id)
+        self.assertEqual(post.excerpt, self.post_content)
+        post.content = "x" * (EXCERPT_LENGTH + 1)
+        db.session.commit()
+        self.assertEqual(post.excerpt, "x" * (EXCERPT_LENGTH - 1) + "\u2026")
+
+    def test_home_view_pagination(self):
+        with app.test_client() as client:
+            resp = client.get("/home?limit=1")
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            # newest post first, followed by a link to the next page
+            self.assertIn(escape(self.post_title), html)
+            self.assertIn('Older posts', html)
+
+            seen = 1
+            next_url = re.search(r'href="(/home\?before=[^"]+)"', html).group(1)
+            while next_url:
+                resp = client.get(next_url.replace('&amp;', '&'))
+                html = resp.get_data(as_text=True)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(html.count('<h3 class="card-title'), 1)
+                seen += 1
+                match = re.search(r'href="(/home\?before=[^"]+)"', html)
+                next_url = match and match.group(1)
+
+        self.assertEqual(seen, Post.query.count())
+
+    def test_home_view_query_count(self):
+        with app.test_client() as client:
+            resp = client.get("/home")
+
+        self.assertEqual(resp.status_code, 200)
+        # table versions, posts, tags
+        self.assertLessEqual(int(resp.headers['X-DB-Query-Count']), 3)
+        self.assertEqual(resp.headers['X-DB-Repeated-Queries'], '0')
+
+    def test_home_view_query_budget_exceeded(self):
+        budgets = app.config['SQL_QUERY_BUDGETS']
+        app.config['SQL_QUERY_BUDGETS'] = {**budgets, 'home_view': 1}
+        try:
+            with app.test_client() as client:
+                with self.assertRaises(QueryBudgetExceeded):
+                    client.get("/home")
+        finally:
+            app.config['SQL_QUERY_BUDGETS'] = budgets
+
+    def test_failed_statement_leaves_no_start_time(self):
+        connection = db.session.connection()
+        with self.assertRaises(exc.ProgrammingError):
+            db.session.execute("SELECT * FROM no_such_table")
+
+        self.assertEqual(connection.info['query_start_time'], {})
+
+    def test_home_view_invalid_cursor(self):
+        with app.test_client() as client:
+            resp = client.get("/home?before=not-a-cursor")
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_home_view_card_invalidation(self):
+        with app.test_client() as client:
+            client.get("/home")
+            client.post(
+                f"/posts/{self.post_id}/edit",
+                data={"title": "Renamed title", "content": self.post_content}
+            )
+            resp = client.get("/home")
+            html = resp.get_data(as_text=True)
+
+        self.assertIn('<h3 class="card-title text-center">Renamed title</h3>', html)
+
+    def test_card_cache_is_consistent_across_workers(self):
+        # two web workers, each with its own in-process cache
+        first, second = FragmentCache(), FragmentCache()
+        first.backend, second.backend = LRUBackend(), LRUBackend()
+
+        def card(cache):
+            with app.test_request_context():
+                post = Post.query.options(selectinload(Post.tags)).get(self.post_id)
+                return cache.render_posts('_post_card.html', [post])[0]
+
+        card(first)
+        card(second)
+        renamed = '<h3 class="card-title text-center">Renamed title</h3>'
+        # and the edit served by a third
+        with app.test_client() as client:
+            client.post(
+                f"/posts/{self.post_id}/edit",
+                data={"title": "Renamed title", "content": self.post_content}
+            )
+        db.session.expire_all()
+
+        self.assertIn(renamed, card(first))
+        self.assertIn(renamed, card(second))
+
+    def test_home_view_author_name_follows_user(self):
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        with app.test_client() as client:
+            client.get("/home")
+            client.post(f"/users/{self.user_id}/edit",
+                        data={"first_name": "Vincent", "last_name": "Strange"})
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                html = client.get("/home").get_data(as_text=True)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+                # restore the seeded user for the other tests
+                client.post(f"/users/{self.user_id}/edit",
+                            data={"first_name": "Stephen", "last_name": "Strange"})
+
+        self.assertIn(f'<a href="/users/{self.user_id}">Vincent Strange</a>', html)
+        self.assertNotIn('Stephen Strange', html)
+        # the cards are rendered from posts.author_name
+        self.assertFalse([sql for sql in statements if 'users.first_name' in sql])
+
+    def test_home_view_tag_rename_invalidation(self):
+        with app.test_client() as client:
+            client.post(
+                f"/posts/{self.post_id}/edit",
+                data={"title": self.post_title, "content": self.post_content,
+                      "tags": [1]}
+            )
+            client.get("/home")
+            client.post("/tags/1/edit", data={"name": "renamed", "posts": [self.post_id]})
+            resp = client.get("/home")
+            html = resp.get_data(as_text=True)
+            # restore the seeded tag for the other tests
+            client.post("/tags/1/edit",
+                        data={"name": "secret", "shown": [self.post_id], "posts": [2, 3]})
+
+        self.assertIn('<span class="badge badge-info">renamed</span>', html)
+
     def test_get_new_post_view(self):
         with app.test_client() as client:
             resp = client.get(f"/users/{self.user_id}/posts/new")
@@ -138,6 +347,26 @@ class FlaskPostTests(TestCase):
         self.assertEqual(Post.query.get(self.post_id).title, "Test title")
         self.assertEqual(Post.query.get(self.post_id).content, "test content")
 
+    def test_post_edit_post_view_conflict(self):
+        with app.test_client() as client:
+            html = client.get(f"/posts/{self.post_id}/edit").get_data(as_text=True)
+            version = int(re.search(r'name="version" value="(\d+)"', html).group(1))
+            first = client.post(f"/posts/{self.post_id}/edit", data={
+                "title": "First", "content": "saved", "version": version
+            })
+            # a second form rendered from the same version, tags-only edit
+            second = client.post(f"/posts/{self.post_id}/edit", data={
+                "title": "First", "content": "saved", "version": version,
+                "tags": [Tag.query.filter_by(name='secret').one().id]
+            }, follow_redirects=True)
+
+        db.session.expire_all()
+        post = Post.query.get(self.post_id)
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(post.version, version + 1)
+        self.assertEqual(post.tags, [])
+        self.assertIn('was changed by someone else', second.get_data(as_text=True))
+
     def test_fail_post_edit_user_view(self):
         with app.test_client() as client:
             resp = client.post(
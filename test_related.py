@@ -0,0 +1,122 @@
+import math
+from unittest import TestCase
+
+import jobs
+import related
+from app import create_app
+from cli import rebuild_related_posts
+from models import CommonTag, Post, RelatedLeader, RelatedPost, Tag, db
+from seed import seed
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class RelatedPostsTests(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        # populate test database
+        seed()
+        self.net_worth, self.sorcery, self.batman = [
+            Post.query.filter(Post.title.startswith(prefix)).one().id
+            for prefix in ("Dr. Strange's net", "Dr. Strange's ultimate", "Batman")
+        ]
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        db.drop_all()
+
+    def related(self, post_id):
+        return [
+            (row.related_id, round(row.score, 4)) for row in
+            RelatedPost.query.filter_by(post_id=post_id).order_by(RelatedPost.rank)
+        ]
+
+    def test_rebuild_scores_weighted_tag_overlap(self):
+        with app.app_context():
+            self.assertEqual(rebuild_related_posts(chunk_size=2), 2)
+
+        # 'secret' is on 2 of 3 posts, 'sorcery' on 1
+        secret, sorcery = math.log(3 / 2), math.log(3)
+        score = round(secret / (secret + sorcery), 4)
+        self.assertEqual(self.related(self.sorcery), [(self.batman, score)])
+        self.assertEqual(self.related(self.batman), [(self.sorcery, score)])
+        self.assertEqual(self.related(self.net_worth), [])
+
+    def test_common_tag_pruning_keeps_scores(self):
+        with app.app_context():
+            rebuild_related_posts()
+            pruned = [self.related(post_id) for post_id in (self.sorcery, self.batman)]
+            # with no tag counted as common, every pair is scored
+            common_tags, related.COMMON_TAGS = related.COMMON_TAGS, 0
+            try:
+                rebuild_related_posts()
+            finally:
+                related.COMMON_TAGS = common_tags
+
+        self.assertEqual(
+            [self.related(post_id) for post_id in (self.sorcery, self.batman)], pruned
+        )
+
+    def test_post_detail_shows_related_posts(self):
+        with app.app_context():
+            rebuild_related_posts()
+
+        with app.test_client() as client:
+            resp = client.get(f"/posts/{self.sorcery}")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Related posts', html)
+        self.assertIn(f'<a href="/posts/{self.batman}">Batman&#39;s ability</a>', html)
+
+    def test_tag_edit_refreshes_affected_lists(self):
+        sorcery_tag = Tag.query.filter_by(name='sorcery').one().id
+        with app.app_context():
+            rebuild_related_posts()
+
+        with app.test_client() as client:
+            client.post(f"/posts/{self.net_worth}/edit", data={
+                "title": "Dr. Strange's net worth", "content": "...",
+                "tags": [sorcery_tag],
+            })
+        with app.app_context():
+            self.assertEqual(jobs.work(burst=True), 1)
+
+        db.session.expire_all()
+        # 'sorcery' and 'secret' are now both on 2 of 3 posts, so weigh the same
+        self.assertEqual(self.related(self.net_worth), [(self.sorcery, 0.5)])
+        self.assertCountEqual(
+            self.related(self.sorcery), [(self.net_worth, 0.5), (self.batman, 0.5)]
+        )
+
+    def test_tag_edit_tracks_leaders_until_rebuild(self):
+        sorcery_tag = Tag.query.filter_by(name='sorcery').one().id
+        with app.app_context():
+            rebuild_related_posts()
+            sorcery_bit = CommonTag.query.get(sorcery_tag).bit
+
+        with app.test_client() as client:
+            client.post(f"/posts/{self.net_worth}/edit", data={
+                "title": "Dr. Strange's net worth", "content": "...",
+                "tags": [sorcery_tag],
+            })
+        with app.app_context():
+            self.assertEqual(jobs.work(burst=True), 1)
+
+        db.session.expire_all()
+        # the job ranks no tags, it only files the edited post under its mask
+        self.assertEqual(RelatedLeader.query.get(self.net_worth).mask, sorcery_bit)
+        # the lists the job refreshed score as a rebuild does ('batman' only
+        # drifts with the weights, which the rebuild picks up)
+        refreshed = [self.related(post_id) for post_id in (self.net_worth, self.sorcery)]
+        with app.app_context():
+            rebuild_related_posts()
+        self.assertEqual(
+            [self.related(post_id) for post_id in (self.net_worth, self.sorcery)],
+            refreshed
+        )
@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+from app import create_app
+from models import User, db
+from routing import STICKY_COOKIE
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class ReplicaRoutingTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # a "replica" that is really the test database, on its own engine
+        app.config['SQLALCHEMY_BINDS'] = {'replica_0': 'postgresql:///blogly_test'}
+        db.drop_all()
+        db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.drop_all()
+        app.config['SQLALCHEMY_BINDS'] = {}
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+
+    def bind_for(self, path, method='GET', headers=None):
+        with app.test_request_context(path, method=method, headers=headers):
+            app.preprocess_request()
+            return db.session.get_bind(mapper=None)
+
+    def test_reads_go_to_replica(self):
+        self.assertIs(self.bind_for('/users'), db.get_engine(app, 'replica_0'))
+
+    def test_writes_stay_on_primary(self):
+        self.assertIs(self.bind_for('/users/new', method='POST'), db.get_engine(app))
+
+    def test_pending_changes_stay_on_primary(self):
+        with app.test_request_context('/users'):
+            app.preprocess_request()
+            db.session.add(User(first_name="Test", last_name="Stark"))
+            self.assertIs(db.session.get_bind(mapper=None), db.get_engine(app))
+            db.session.expunge_all()
+            # a request that wrote keeps reading from the primary
+            self.assertIs(db.session.get_bind(mapper=None), db.get_engine(app))
+
+    def test_sticky_primary_after_write(self):
+        with app.test_client() as client:
+            resp = client.post("/users/new", data={"first_name": "Test", "last_name": "Stark"})
+        cookie = next(
+            header for header in resp.headers.getlist('Set-Cookie')
+            if header.startswith(STICKY_COOKIE)
+        )
+        until = cookie.split(';')[0].split('=')[1]
+
+        self.assertIs(
+            self.bind_for('/users', headers={'Cookie': f"{STICKY_COOKIE}={until}"}),
+            db.get_engine(app)
+        )
+        self.assertIs(
+            self.bind_for('/users', headers={'Cookie': f"{STICKY_COOKIE}=0"}),
+            db.get_engine(app, 'replica_0')
+        )
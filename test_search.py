@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from app import create_app
+from models import Post, db
+from seed import seed
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class FlaskSearchTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        db.drop_all()
+        db.create_all()
+        # populate test database
+        seed()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.drop_all()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_search_view(self):
+        with app.test_client() as client:
+            resp = client.get("/search?q=sorcery")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('<a href="/posts/2">Dr. Strange&#39;s ultimate sorcery</a>', html)
+        self.assertNotIn('<a href="/posts/3">', html)
+
+    def test_search_view_ranking_and_snippet(self):
+        with app.test_client() as client:
+            resp = client.get("/search.json?q=rich")
+            data = resp.get_json()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([result['id'] for result in data['results']], [3])
+        self.assertIn('<mark>rich</mark>', data['results'][0]['snippet'])
+
+    def test_search_view_escapes_snippet(self):
+        post = Post(title="Markup", content="<script>alert('xss')</script> gadget", user_id=2)
+        db.session.add(post)
+        db.session.commit()
+
+        with app.test_client() as client:
+            resp = client.get("/search?q=gadget")
+            html = resp.get_data(as_text=True)
+
+        self.assertNotIn('<script>', html)
+        self.assertIn('<mark>gadget</mark>', html)
+
+    def test_search_view_filters(self):
+        with app.test_client() as client:
+            by_tag = client.get("/search.json?q=strange&tag=sorcery").get_json()
+            by_author = client.get("/search.json?q=strange&author=2").get_json()
+
+        self.assertEqual([result['id'] for result in by_tag['results']], [2])
+        self.assertEqual(by_author['results'], [])
+
+    def test_search_view_pagination(self):
+        app.config['SEARCH_RESULTS_PER_PAGE'] = 1
+        try:
+            with app.test_client() as client:
+                first = client.get("/search.json?q=strange").get_json()
+                second = client.get("/search.json?q=strange&page=2").get_json()
+        finally:
+            app.config['SEARCH_RESULTS_PER_PAGE'] = 20
+
+        self.assertTrue(first['has_next'])
+        self.assertFalse(second['has_next'])
+        self.assertNotEqual(first['results'][0]['id'], second['results'][0]['id'])
@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from app import create_app
+from models import db
+from serving import dispose_engines, thread_count, worker_count
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class ServingTests(TestCase):
+
+    def test_worker_count(self):
+        self.assertEqual(worker_count({}, cpus=4), 5)
+        self.assertEqual(worker_count({'WEB_CONCURRENCY': '3'}, cpus=4), 3)
+        self.assertEqual(worker_count({'WEB_CONCURRENCY': '0'}, cpus=4), 1)
+
+    def test_thread_count_follows_pool_size(self):
+        self.assertEqual(thread_count({}), 5)
+        self.assertEqual(thread_count({'DB_POOL_SIZE': '8'}), 8)
+        self.assertEqual(thread_count({'DB_POOL_SIZE': '8', 'WEB_THREADS': '2'}), 2)
+
+    def test_dispose_engines_drops_pooled_connections(self):
+        with app.app_context():
+            db.session.execute('SELECT 1')
+            db.session.remove()
+            pool = db.engine.pool
+            self.assertEqual(pool.checkedin(), 1)
+
+            dispose_engines(app)
+
+            self.assertEqual(db.engine.pool.checkedin(), 0)
+            self.assertIsNot(db.engine.pool, pool)
+            self.assertEqual(db.session.execute('SELECT 1').scalar(), 1)
+            db.session.remove()
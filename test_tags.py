@@ -0,0 +1,231 @@
+import re
+from unittest import TestCase
+
+from app import create_app
+from catalog import post_picker, tag_catalog
+from cli import reconcile_tag_counts
+from instrumentation import QueryBudgetExceeded
+from models import Post, Tag, User, db
+from seed import seed
+
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
+
+
+class FlaskTagTests(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        # populate test database
+        seed()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        db.drop_all()
+
+    def tag_id(self, name):
+        return Tag.query.filter_by(name=name).one().id
+
+    def post_counts(self):
+        db.session.expire_all()
+        return {tag.name: tag.post_count for tag in Tag.query}
+
+    def test_seeded_post_counts(self):
+        self.assertEqual(self.post_counts(), {'secret': 2, 'sorcery': 1, 'wealth': 1})
+
+    def test_post_counts_follow_post_writes(self):
+        with app.test_client() as client:
+            client.post("/users/2/posts/new",
+                        data={"title": "Cave", "content": "Bats",
+                              "tags": [self.tag_id('sorcery'), self.tag_id('wealth')]})
+            post_id = Post.query.filter_by(title="Cave").one().id
+            self.assertEqual(
+                self.post_counts(), {'secret': 2, 'sorcery': 2, 'wealth': 2}
+            )
+
+            client.post(f"/posts/{post_id}/edit",
+                        data={"title": "Cave", "content": "Bats",
+                              "tags": [self.tag_id('sorcery'), self.tag_id('wealth'),
+                                       self.tag_id('secret')]})
+            self.assertEqual(
+                self.post_counts(), {'secret': 3, 'sorcery': 2, 'wealth': 2}
+            )
+
+            # removing tags from one post leaves other posts' links alone
+            client.post(f"/posts/{post_id}/edit",
+                        data={"title": "Cave", "content": "Bats",
+                              "tags": [self.tag_id('secret')]})
+            self.assertEqual(
+                self.post_counts(), {'secret': 3, 'sorcery': 1, 'wealth': 1}
+            )
+
+            client.post(f"/posts/{post_id}/delete")
+            self.assertEqual(
+                self.post_counts(), {'secret': 2, 'sorcery': 1, 'wealth': 1}
+            )
+
+    def test_post_counts_follow_cascades(self):
+        db.session.delete(User.query.get(1))
+        db.session.commit()
+
+        self.assertEqual(self.post_counts(), {'secret': 1, 'sorcery': 0, 'wealth': 0})
+
+    def test_edit_tag_view_syncs_posts(self):
+        tag_id = self.tag_id('secret')
+        with app.test_client() as client:
+            resp = client.post(f"/tags/{tag_id}/edit",
+                               data={"name": "secret", "shown": [1, 2, 3], "posts": [1, 2]})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(
+            sorted(post.id for post in Tag.query.get(tag_id).posts), [1, 2]
+        )
+        self.assertEqual(self.post_counts()['secret'], 2)
+
+    def test_new_tag_view(self):
+        with app.test_client() as client:
+            resp = client.post("/tags/new", data={"name": "bats", "posts": [3]})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual([post.id for post in Tag.query.filter_by(name="bats").one().posts], [3])
+        self.assertEqual(self.post_counts()['bats'], 1)
+
+    def test_tags_view_streams(self):
+        with app.test_client() as client:
+            client.post("/tags/new", data={"name": "bats"})
+            resp = client.get("/tags")
+            self.assertTrue(resp.is_streamed)
+            html = resp.get_data(as_text=True)
+            again = client.get("/tags").get_data(as_text=True)
+
+        self.assertIn('>bats</a>', html)
+        # flashed once, on the next page
+        self.assertEqual(html.count('Success: tag created!'), 1)
+        self.assertNotIn('Success: tag created!', again)
+
+    def test_tags_view_budget_counts_streamed_rows(self):
+        budgets = app.config['SQL_QUERY_BUDGETS']
+        with app.test_client() as client:
+            # the header is sent with one query; the rows take another
+            app.config['SQL_QUERY_BUDGETS'] = dict(budgets, tags_view=1)
+            try:
+                resp = client.get("/tags")
+                with self.assertRaises(QueryBudgetExceeded):
+                    resp.get_data()
+            finally:
+                app.config['SQL_QUERY_BUDGETS'] = budgets
+
+    def test_top_tags_view(self):
+        with app.test_client() as client:
+            resp = client.get("/tags/top?n=1")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(f'<a href="/tags/{self.tag_id("secret")}">secret</a>', html)
+        self.assertNotIn('sorcery', html)
+
+    def test_tag_cloud_view(self):
+        with app.test_client() as client:
+            resp = client.get("/tags/cloud")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('style="font-size: 2.0rem">secret</a>', html)
+        self.assertIn('style="font-size: 1.0rem">sorcery</a>', html)
+
+    def test_reconcile_tag_counts(self):
+        Tag.query.update({Tag.post_count: 42})
+        db.session.commit()
+
+        self.assertEqual(reconcile_tag_counts(), 3)
+        self.assertEqual(self.post_counts(), {'secret': 2, 'sorcery': 1, 'wealth': 1})
+
+    def test_tag_catalog_reloads_only_when_tags_change(self):
+        tag_catalog.clear()
+        tags = tag_catalog.tags()
+        self.assertEqual([tag.name for tag in tags], ['secret', 'sorcery', 'wealth'])
+
+        # tagging a post moves post_count, not the catalog
+        db.session.get_bind().execute(
+            "INSERT INTO posts_tags (post_id, tag_id) VALUES (1, %s)", self.tag_id('sorcery')
+        )
+        self.assertIs(tag_catalog.tags(), tags)
+
+        Tag.query.filter_by(name='wealth').update({'name': 'riches'})
+        db.session.commit()
+        self.assertEqual([tag.name for tag in tag_catalog.tags()],
+                         ['riches', 'secret', 'sorcery'])
+
+    def test_post_picker(self):
+        with app.app_context():
+            page = post_picker('dr. STRANGE', limit=1)
+            self.assertEqual([post.title for post in page], ["Dr. Strange's net worth"])
+            page = post_picker('dr. strange', after=page.next_cursor, limit=1)
+            self.assertEqual([post.title for post in page], ["Dr. Strange's ultimate sorcery"])
+            self.assertIsNone(page.next_cursor)
+
+            # LIKE wildcards in the prefix are matched literally
+            self.assertEqual(len(post_picker('%')), 0)
+            self.assertEqual(
+                [post.id for post in post_picker(exclude_tag_id=self.tag_id('secret'))], [1]
+            )
+
+    def test_post_picker_view(self):
+        with app.test_client() as client:
+            resp = client.get("/posts/picker?q=bat")
+            bad = client.get("/posts/picker?after=nonsense")
+
+        self.assertEqual(resp.json, {
+            'results': [{'id': 3, 'title': "Batman's ability"}], 'next': None
+        })
+        self.assertEqual(bad.status_code, 400)
+
+    def test_get_edit_tag_view(self):
+        with app.test_client() as client:
+            resp = client.get(f"/tags/{self.tag_id('secret')}/edit?q=dr")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        # the tag's posts are checked; the picker offers the other matches
+        self.assertIn('value="3" id="post-3" checked', html)
+        self.assertIn('value="2" id="post-2" checked', html)
+        self.assertIn('value="1" id="post-1">', html)
+        self.assertEqual(html.count('name="posts"'), 3)
+
+    def test_edit_tag_view_pages_tagged_posts(self):
+        tag_id = self.tag_id('secret')
+        with app.test_client() as client:
+            html = client.get(f"/tags/{tag_id}/edit?limit=1").get_data(as_text=True)
+            cursor = re.search(r'name="tagged_after" value="([^"]*)"', html).group(1)
+            self.assertIn('value="3" id="post-3" checked', html)
+            self.assertNotIn('id="post-2"', html)
+
+            # "More tagged posts" resubmits the form: post 3 was unchecked
+            html = client.get(f"/tags/{tag_id}/edit", query_string={
+                "name": "hidden", "shown": [3], "tagged_after": cursor, "limit": 1
+            }).get_data(as_text=True)
+            self.assertIn('value="2" id="post-2" checked', html)
+            self.assertIn('<input type="hidden" name="remove" value="3">', html)
+            self.assertIn('value="hidden" name="name"', html)
+            self.assertNotIn('name="tagged_after"', html)
+
+            # posts never shown keep their links
+            client.post(f"/tags/{tag_id}/edit",
+                        data={"name": "hidden", "remove": [3], "shown": [1], "posts": [1]})
+
+        self.assertEqual(sorted(post.id for post in Tag.query.get(tag_id).posts), [1, 2])
+        self.assertEqual(self.post_counts()['hidden'], 2)
+
+    def test_new_tag_view_carries_choices(self):
+        with app.test_client() as client:
+            html = client.get("/tags/new", query_string={
+                "name": "bats", "add": [1], "shown": [3], "posts": [3]
+            }).get_data(as_text=True)
+
+        self.assertIn('value="bats" name="name"', html)
+        self.assertIn('<input type="hidden" name="add" value="1">', html)
+        self.assertIn('value="3" id="post-3" checked', html)
+
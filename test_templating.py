@@ -0,0 +1,42 @@
+import datetime
+import os
+import tempfile
+from unittest import TestCase
+
+from app import create_app, format_datetime
+from templating import warm_templates
+
+
+class TemplatingTests(TestCase):
+
+    def test_warmup_compiles_every_template(self):
+        app = create_app('test')
+
+        compiled = {name for (loader, name) in app.jinja_env.cache.keys()}
+        self.assertIn('home.html', compiled)
+        self.assertIn('_post_card.html', compiled)
+        self.assertEqual(len(compiled), len(app.jinja_env.list_templates(extensions=['html'])))
+
+    def test_bytecode_cache_is_reused(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings = {'TEMPLATE_BYTECODE_CACHE': True, 'TEMPLATE_CACHE_DIR': directory}
+            first = create_app('test', **settings)
+            files = sorted(os.listdir(directory))
+            self.assertEqual(len(files), warm_templates(first))
+
+            # a new process loads the compiled code instead of compiling again
+            second = create_app('test', **settings)
+            loaded = []
+            second.jinja_env.compile = lambda *args, **kwargs: loaded.append(args)
+            second.jinja_env.cache.clear()
+            warm_templates(second)
+
+        self.assertEqual(loaded, [])
+
+    def test_format_datetime_is_memoized(self):
+        value = datetime.datetime(2020, 4, 1, 13, 5)
+        hits = format_datetime.cache_info().hits
+
+        self.assertEqual(format_datetime(value), 'Wed Apr 01 2020, 01:05 PM')
+        self.assertEqual(format_datetime(value), 'Wed Apr 01 2020, 01:05 PM')
+        self.assertGreater(format_datetime.cache_info().hits, hits)
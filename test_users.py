@@ -1,17 +1,11 @@
+import re
 from unittest import TestCase
-from app import app
+from app import create_app
 from flask import session
 from models import db, User
 
-# Use test database and don't clutter tests with SQL
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
-app.config['SQLALCHEMY_ECHO'] = False
-
-# Make Flask errors be real errors, rather than HTML pages with error info
-app.config['TESTING'] = True
-
-# This is a bit of hack, but don't use Flask DebugToolbar
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+# blogly_test database, TESTING on, no debug toolbar
+app = create_app('test')
 
 db.drop_all()
 db.create_all()
@@ -50,6 +44,55 @@ class FlaskUserTests(TestCase):
             html
         )
     
+    def test_users_view_pages(self):
+        db.session.add_all([
+            User(first_name="Batch", last_name=f"User{index:02}") for index in range(25)
+        ])
+        db.session.commit()
+        with app.test_client() as client:
+            first = client.get("/users?limit=20")
+            html = first.get_data(as_text=True)
+            more = re.search(r'href="(/users\?[^"]*after=[^"]*)"', html).group(1)
+            second = client.get(more.replace('&amp;', '&')).get_data(as_text=True)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertLessEqual(int(first.headers['X-DB-Query-Count']), 2)
+        # Stark, then User00..User18
+        self.assertEqual(html.count('<li>'), 20)
+        self.assertLess(html.index('Test Stark'), html.index('User00'))
+        self.assertNotIn('User19', html)
+        self.assertEqual(second.count('<li>'), 6)
+        self.assertLess(second.index('User19'), second.index('User24'))
+        self.assertNotIn('More users', second)
+
+    def test_users_view_prefix(self):
+        db.session.add_all([
+            User(first_name="Stephen", last_name="Strange"),
+            User(first_name="Peter", last_name="Parker"),
+        ])
+        db.session.commit()
+        with app.test_client() as client:
+            letter = client.get("/users?q=S").get_data(as_text=True)
+            prefix = client.get("/users?q=str").get_data(as_text=True)
+            none = client.get("/users?q=%25").get_data(as_text=True)
+
+        self.assertIn('Test Stark', letter)
+        self.assertIn('Stephen Strange', letter)
+        self.assertNotIn('Peter Parker', letter)
+        self.assertLess(letter.index('Stark'), letter.index('Strange'))
+        self.assertNotIn('Test Stark', prefix)
+        self.assertIn('Stephen Strange', prefix)
+        self.assertIn('No users whose last name starts with', none)
+
+    def test_users_view_flash_once(self):
+        with app.test_client() as client:
+            client.post("/users/new", data={"first_name": "Flash", "last_name": "Once"})
+            first = client.get("/users").get_data(as_text=True)
+            second = client.get("/users").get_data(as_text=True)
+
+        self.assertIn('alert-success', first)
+        self.assertNotIn('alert-success', second)
+
     def test_get_new_user_view(self):
         with app.test_client() as client:
             resp = client.get("/users/new")
@@ -0,0 +1,10 @@
+"""
+WSGI entry point: the app of $BLOGLY_PROFILE (default 'production').
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+See serving.py for the process model and its settings.
+"""
+from app import create_app
+
+app = create_app()